@@ -0,0 +1,75 @@
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+from dataclasses import asdict
+
+from benchmarks.suite import suite
+
+
+# Returns the current git commit, if any.
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Prints the relative change of every benchmark between two result files, flagging the regressions beyond the
+# threshold. Returns whether there was no such regression.
+def compare(baseline_path: str, current_path: str, threshold: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {result["key"]: result for result in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+
+    ok = True
+    for result in current:
+        base = baseline.get(result["key"])
+        if base is None:
+            print(f"{result['key']:50} {result['value']:14.4g} {result['unit']:14} (new)")
+            continue
+        change = (result["value"] - base["value"]) / base["value"]
+        regression = -change if result["higher_is_better"] else change
+        flag = "REGRESSION" if regression > threshold else ""
+        ok = ok and not flag
+        print(f"{result['key']:50} {result['value']:14.4g} {result['unit']:14} {change:+8.1%} {flag}")
+    return ok
+
+
+# Runs the benchmark suite and writes the results as JSON, or compares two result files.
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-o", "--output", type=str, default=None, help="JSON file to write (default: stdout)")
+    parser.add_argument("-g", "--group_sizes", nargs='+', type=int, default=[4, 100, 1000, 10000],
+                        help="group sizes of the simulator benchmarks")
+    parser.add_argument("-k", "--filter", type=str, default="", help="only run the benchmarks containing this string")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), default=None,
+                        help="compare two result files instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(*args.compare, args.threshold) else 1)
+
+    results = []
+    for (name, benchmark) in suite(args.group_sizes):
+        if args.filter in name:
+            result = benchmark()
+            print(f"{result.key:50} {result.value:14.4g} {result.unit}", file=sys.stderr)
+            results.append(asdict(result) | {"key": result.key})
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from core import Dispatcher, Event, EventQueue, GeoLatencyModel, Group, Message, NodeId, Path, Simulator
+from injection import Injector
+from protosim import LATENCY_MODELS, MainModule, SCHEDULERS, build_parser, load_modules
+
+
+# The result of a benchmark.
+@dataclass
+class Result:
+    name: str
+    params: dict[str, Any]
+    value: float
+    unit: str
+    higher_is_better: bool = True
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    # The key identifying the benchmark across runs.
+    @property
+    def key(self) -> str:
+        return self.name + "".join(f" {key}={value}" for (key, value) in sorted(self.params.items()))
+
+
+# Returns the best wall time in seconds of `repeat` calls of a function.
+def best_time(function: Callable[[], Any], repeat: int = 3) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def build_injector(group_size: int, seed: int = 0, **options) -> Injector:
+    args = build_parser().parse_args(["ping"])
+    (args.group_size, args.seed) = (group_size, seed)
+    for (option, value) in options.items():
+        setattr(args, option, value)
+    return Injector(args, load_modules(args.modules))
+
+
+# Events per second of Simulator.run with BroadcastPing, with the given command-line options.
+def bench_simulator(group_size: int, **options) -> Result:
+    injector = build_injector(group_size, **options)
+    start = time.perf_counter()
+    simulator = injector.get(Simulator)
+    built = time.perf_counter()
+    simulator.run()
+    end = time.perf_counter()
+    return Result("simulator", {"group_size": group_size, **options}, simulator.processed_events / (end - built),
+                  "events/s",
+                  extra={"build_s": built - start, "run_s": end - built, "events": simulator.processed_events})
+
+
+# Construction time of a latency model.
+def bench_latency_construction(group_size: int, latency_model: str = "geo") -> Result:
+    group = Group([NodeId(i) for i in range(group_size)])
+    params = {"group_size": group_size} | ({"latency_model": latency_model} if latency_model != "geo" else {})
+    return Result("latency_construction", params,
+                  best_time(lambda: LATENCY_MODELS[latency_model](group, seed=0)), "s", higher_is_better=False)
+
+
+# Cost of a GeoLatencyModel.get_latency call.
+def bench_get_latency(group_size: int, calls: int = 100_000) -> Result:
+    group = Group([NodeId(i) for i in range(group_size)])
+    model = GeoLatencyModel(group, seed=0)
+    rng = random.Random(0)
+    pairs = [(rng.choice(group), rng.choice(group)) for _ in range(calls)]
+
+    def run():
+        for (src, dst) in pairs:
+            model.get_latency(src, dst)
+
+    return Result("get_latency", {"group_size": group_size}, best_time(run) / calls * 1e9, "ns/call",
+                  higher_is_better=False)
+
+
+# Push/pop throughput of the event queue in the hold model: with `pending` events in the queue, every pop is
+# followed by a push with a delay drawn from the latencies of a geographically distributed group.
+def bench_event_queue(scheduler: str, pending: int, operations: int = 200_000) -> Result:
+    group = Group([NodeId(i) for i in range(100)])
+    model = GeoLatencyModel(group, seed=0)
+    rng = random.Random(0)
+    delays = [model.get_latency(rng.choice(group), rng.choice(group)) for _ in range(pending + operations)]
+    message = Message(Path(), NodeId(0))
+
+    def run():
+        event_queue = EventQueue(scheduler=SCHEDULERS[scheduler]())
+        for delay in delays[:pending]:
+            event_queue.push(Event(delay, NodeId(0), message))
+        for delay in delays[pending:]:
+            event_queue.pop()
+            event_queue.push(Event(delay, NodeId(0), message))
+
+    return Result("event_queue", {"scheduler": scheduler, "pending": pending},
+                  operations / best_time(run), "ops/s")
+
+
+# Memory taken by each pending event of the event queue.
+def bench_pending_memory(scheduler: str, pending: int = 1_000_000) -> Result:
+    rng = random.Random(0)
+    paths = [Path().append(name="message", index=i) for i in range(100)]
+    tracemalloc.start()
+    try:
+        event_queue = EventQueue(scheduler=SCHEDULERS[scheduler]())
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(pending):
+            event_queue.push(Event(rng.uniform(0, 1000), NodeId(i % 1000), Message(rng.choice(paths), NodeId(0))))
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    return Result("pending_memory", {"scheduler": scheduler, "pending": pending}, size / pending, "bytes/event",
+                  higher_is_better=False)
+
+
+# Throughput of arming and cancelling protocol timers, with the given number of timers pending (e.g. a timeout per
+# node), the clock advancing to the next timer every 100 operations.
+def bench_timers(pending: int, operations: int = 200_000) -> Result:
+    rng = random.Random(0)
+    delays = [rng.uniform(100, 1000) for _ in range(pending + operations)]
+    message = Message(Path(), NodeId(0))
+
+    def run():
+        event_queue = EventQueue()
+        timers = [event_queue.set_timer(Event(delay, NodeId(0), message)) for delay in delays[:pending]]
+        for (i, delay) in enumerate(delays[pending:]):
+            event_queue.cancel_timer(timers[i % pending])
+            timers[i % pending] = event_queue.set_timer(Event(delay, NodeId(0), message))
+            if i % 100 == 0:
+                event_queue.pop_instant()
+
+    return Result("timers", {"pending": pending}, operations / best_time(run), "ops/s")
+
+
+# Throughput of Dispatcher.deliver, with subscriptions on paths of the given depth.
+def bench_dispatcher(depth: int, subscriptions: int = 100, deliveries: int = 200_000) -> Result:
+    dispatcher = Dispatcher(NodeId(0))
+    root = Path()
+    for level in range(depth - 1):
+        root = root.append(name="protocol", level=level)
+    paths = [root.append(name="message", index=i) for i in range(subscriptions)]
+    for path in paths:
+        dispatcher.subscribe(path, lambda msg: None)
+    rng = random.Random(0)
+    messages = [Message(rng.choice(paths), NodeId(1)) for _ in range(deliveries)]
+
+    def run():
+        for msg in messages:
+            dispatcher.deliver(msg)
+
+    return Result("dispatcher", {"depth": depth}, deliveries / best_time(run), "deliveries/s")
+
+
+# Time taken by the injector to build each node.
+def bench_injector(group_size: int) -> Result:
+    def run():
+        injector = build_injector(group_size)
+        MainModule.build_nodes(injector, injector.get(Group), None)
+
+    return Result("injector", {"group_size": group_size}, best_time(run, repeat=1) / group_size * 1e6, "us/node",
+                  higher_is_better=False)
+
+
+# Returns the benchmarks of the suite, as (name, function) pairs.
+def suite(group_sizes: list[int]) -> list[tuple[str, Callable[[], Result]]]:
+    benchmarks = []
+    for group_size in group_sizes:
+        benchmarks.append((f"simulator {group_size}", lambda n=group_size: bench_simulator(n)))
+    # BroadcastPing written as a coroutine, against the callbacks of "simulator 1000".
+    options_variants = ({"jitter": 0.1}, {"uplink_mbps": 100.0}, {"latency_model": "continent"},
+                        {"latency_model": "location"}, {"modules": ["coroutine_ping"]})
+    for options in options_variants:
+        benchmarks.append((f"simulator 1000 {options}", lambda o=options: bench_simulator(1000, **o)))
+    for group_size in (100, 1000):
+        benchmarks.append((f"latency_construction {group_size}", lambda n=group_size: bench_latency_construction(n)))
+        benchmarks.append((f"get_latency {group_size}", lambda n=group_size: bench_get_latency(n)))
+    benchmarks.append(("latency_construction 100000 location",
+                       lambda: bench_latency_construction(100_000, "location")))
+    for scheduler in SCHEDULERS:
+        for pending in (1000, 100_000):
+            benchmarks.append((f"event_queue {scheduler} {pending}",
+                               lambda s=scheduler, p=pending: bench_event_queue(s, p)))
+        benchmarks.append((f"pending_memory {scheduler}", lambda s=scheduler: bench_pending_memory(s)))
+    for pending in (1000, 100_000):
+        benchmarks.append((f"timers {pending}", lambda p=pending: bench_timers(p)))
+    for depth in (2, 16):
+        benchmarks.append((f"dispatcher {depth}", lambda d=depth: bench_dispatcher(d)))
+    for group_size in (100, 1000):
+        benchmarks.append((f"injector {group_size}", lambda n=group_size: bench_injector(n)))
+    return benchmarks
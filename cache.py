@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from argparse import Namespace
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional, Type
+
+import geodata
+from injection import Injector
+from injection.injector import ABSENT, AbstractModule
+
+# The root directory of the simulator's sources.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# The sources whose content determines the results of a simulation, relative to ROOT.
+# The results cached by the sweep runner, and the traces stored with results, depend on sweep.py and tracing.py.
+SOURCES = ["cache.py", "core.py", "coroutines.py", "geodata.py", "latency.py", "metrics.py", "randomness.py", "pdes.py",
+           "profiling.py", "protosim.py", "sweep.py", "timers.py", "tracing.py", "injection", "protocols", "modules"]
+
+# The command-line arguments that do not change the results of a simulation.
+IGNORED_ARGS = {"trace", "partitions", "build_workers", "cache", "cache_size_mb", "profile", "profile_period", "metrics",
+                "metrics_interval", "latency_cache_rows"}
+
+
+# Returns the key identifying the results of a simulation: a hash of the command-line arguments, of the injector's
+# bindings, of the data files they refer to, and of the simulator's and modules' sources, prefixed by the producer of
+# the results, since tools store results of different forms. Returns None if the simulation is not reproducible
+# (unseeded) or not built from its configuration (restored from a checkpoint), or if it saves a checkpoint, which a
+# cache hit would skip.
+# The key must be computed before getting any object from the injector.
+def config_key(args: Namespace, injector: Injector, modules: Iterable[Type[AbstractModule]] = (),
+               producer: str = "protosim") -> Optional[str]:
+    if args.seed is None or getattr(args, "restore", None) or getattr(args, "checkpoint", None):
+        return None
+    digest = hashlib.sha256()
+
+    def update(value: Any):
+        digest.update(repr(value).encode())
+        digest.update(b"\0")
+
+    def update_file(path: str):
+        for data_file in _data_files(path):
+            with open(data_file, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+
+    for (name, value) in sorted(vars(args).items()):
+        if name not in IGNORED_ARGS:
+            update((name, value))
+            update_file(value)
+
+    for binding in sorted(injector.bindings(), key=lambda binding: repr(binding.object_type)):
+        update((repr(binding.object_type), binding.scope.name, _describe(binding.constructor)))
+        if binding.constructor is None:
+            update(_describe(binding.instance))
+            update_file(binding.instance)
+        elif dataclasses.is_dataclass(binding.constructor):
+            # The defaults of the fields, such as the paths of data files.
+            for f in dataclasses.fields(binding.constructor):
+                if f.default is not dataclasses.MISSING:
+                    update((f.name, _describe(f.default)))
+                    update_file(f.default)
+
+    sources = [os.path.join(ROOT, source) for source in SOURCES]
+    sources += [inspect.getsourcefile(module) for module in modules]
+    for path in sorted(set(_python_files(sources))):
+        update(os.path.relpath(path, ROOT))
+        update_file(path)
+    return f"{producer}-{digest.hexdigest()}"
+
+
+# Returns the files read for a value that is the path of a data file: the file itself, or for a geographical dataset,
+# the files of the dataset that geodata.load reads.
+def _data_files(value: Any) -> list[str]:
+    if not isinstance(value, str) or not (os.path.isfile(value) or os.path.isdir(value)):
+        return []
+    path = geodata.resolve(value)
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith(".npy") or name == geodata.SOURCE_HASH]
+
+
+def _describe(value: Any) -> str:
+    if value is None or value is ABSENT or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (bool, int, float, str)) for v in value):
+        return repr(value)
+    if callable(value) and hasattr(value, "__qualname__"):
+        return f"{_module_name(value)}.{value.__qualname__}"
+    return type(value).__qualname__
+
+
+# Returns the name of the module defining an object, the same whether the module runs as a script or is imported.
+def _module_name(value: Any) -> str:
+    name = getattr(value, "__module__", None) or ""
+    path = getattr(sys.modules.get(name), "__file__", None)
+    if name != "__main__" or path is None:
+        return name
+    return os.path.splitext(os.path.relpath(os.path.abspath(path), ROOT))[0].replace(os.sep, ".")
+
+
+def _python_files(paths: list[str]) -> Iterable[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for (directory, subdirectories, files) in os.walk(path):
+                subdirectories[:] = [d for d in subdirectories if d != "__pycache__"]
+                yield from (os.path.join(directory, f) for f in files if f.endswith(".py"))
+        elif path and os.path.isfile(path):
+            yield path
+
+
+# An on-disk cache of simulation results, by key (see `config_key`).
+# Each entry is a directory holding the result as JSON and optionally a trace. Entries are written atomically, so
+# that several processes can share a cache. When the cache exceeds its size, the least recently used entries are
+# evicted.
+@dataclass
+class ResultCache:
+    directory: str
+    max_bytes: int = 1 << 30
+
+    _RESULT = "result.json"
+    _TRACE = "trace"
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    # Returns the result stored for a key, if any, marking it as recently used.
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, self._RESULT)) as f:
+                result = json.load(f)
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return result
+
+    # Returns the directory of the trace stored for a key, if any.
+    def trace_directory(self, key: str) -> Optional[str]:
+        trace = os.path.join(self.directory, key, self._TRACE)
+        return trace if os.path.isdir(trace) else None
+
+    # Stores the result of a key, with a copy of the given trace directory.
+    def put(self, key: str, result: dict[str, Any], trace_directory: Optional[str] = None):
+        entry = os.path.join(self.directory, key)
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        try:
+            with open(os.path.join(staging, self._RESULT), "w") as f:
+                json.dump(result, f)
+            if trace_directory is not None:
+                shutil.copytree(trace_directory, os.path.join(staging, self._TRACE))
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(staging, entry)
+        except OSError:
+            # Another process stored the same entry at the same time.
+            logging.debug(f"Could not store the cache entry {key}", exc_info=True)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    # Evicts the least recently used entries until the cache fits in its size.
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.stat(path).st_mtime, _size(path), path))
+            except FileNotFoundError:
+                pass
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def _size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for (path, _, files) in os.walk(directory) for f in files)
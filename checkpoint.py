@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import io
+import multiprocessing
+import os
+import pickle
+import random
+from dataclasses import dataclass
+from typing import Any, Callable, TypeVar
+
+import numpy as np
+
+from core import Simulator
+
+# Checkpoints of a simulation, to run several variants of a simulation from a common prefix.
+#
+# A snapshot is a pickle of the simulator, which holds the whole simulation state: the event queue (clock and
+# pending events), the nodes with their protocols and dispatchers (subscriptions and backlogs), and the network with
+# its latency model, together with the state of the global random generators. Paths are pickled by value and
+# interned again when loaded. The protocols' subscriptions must thus be picklable (e.g. bound methods, not lambdas),
+# and traced simulations and simulations of coroutine protocols cannot be checkpointed. Spilled backlogs are copied
+# into the snapshot.
+#
+# Alternatively, `fork` continues the simulation in forked processes, which share the state of the parent
+# copy-on-write, without pickling it.
+
+T = TypeVar('T')
+
+
+# The state of a simulation.
+@dataclass
+class Snapshot:
+    simulator: Simulator
+    random_state: Any  # The state of the `random` module.
+    numpy_random_state: Any  # The state of the `numpy.random` module.
+
+
+def snapshot(simulator: Simulator) -> bytes:
+    if simulator.event_queue.tracer is not None or simulator.network.tracer is not None:
+        raise ValueError("Cannot checkpoint a traced simulation")
+    state = Snapshot(simulator, random.getstate(), np.random.get_state())
+    return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Restores a simulation from a snapshot, including the state of the global random generators.
+# Restoring a snapshot in the process that took it yields an independent copy of the simulation.
+def restore(data: bytes) -> Simulator:
+    state: Snapshot = pickle.loads(data)
+    random.setstate(state.random_state)
+    np.random.set_state(state.numpy_random_state)
+    return state.simulator
+
+
+def save(simulator: Simulator, path: str):
+    data = snapshot(simulator)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def load(path: str) -> Simulator:
+    with open(path, "rb") as f:
+        return restore(f.read())
+
+
+# Runs each variant on the simulation in its own forked process, returning their (picklable) results in order.
+# A variant receives the simulator as it is in the parent, typically changes some parameters and continues the
+# simulation. At most `jobs` variants run at the same time.
+def fork(simulator: Simulator, variants: list[Callable[[Simulator], T]], jobs: int = os.cpu_count()) -> list[T]:
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise OSError("Forking is not supported on this platform: use snapshot and restore instead")
+    context = multiprocessing.get_context("fork")
+    results: list[Any] = [None] * len(variants)
+    running: list[tuple[int, multiprocessing.Process, Any]] = []
+
+    def collect(entry):
+        (i, process, connection) = entry
+        try:
+            (ok, value) = pickle.load(io.BytesIO(connection.recv_bytes()))
+        finally:
+            process.join()
+        if not ok:
+            raise value
+        results[i] = value
+
+    try:
+        for (i, variant) in enumerate(variants):
+            if len(running) >= max(jobs, 1):
+                collect(running.pop(0))
+            (connection, child_connection) = context.Pipe(duplex=False)
+            process = context.Process(target=_run_variant, args=(simulator, variant, child_connection), daemon=True)
+            process.start()
+            child_connection.close()
+            running.append((i, process, connection))
+        while running:
+            collect(running.pop(0))
+    except BaseException:
+        for (_, process, _) in running:
+            process.terminate()
+            process.join()
+        raise
+    return results
+
+
+def _run_variant(simulator: Simulator, variant: Callable[[Simulator], Any], connection):
+    try:
+        data = pickle.dumps((True, variant(simulator)), protocol=pickle.HIGHEST_PROTOCOL)
+    except BaseException as e:
+        try:
+            data = pickle.dumps((False, e))
+        except Exception:
+            data = pickle.dumps((False, RuntimeError(repr(e))))
+    connection.send_bytes(data)
+    connection.close()
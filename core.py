@@ -1,82 +1,615 @@
 from __future__ import annotations
 
+import bisect
 import heapq
-import json
 import logging
-import random
+import math
+import os
+import pickle
+import tempfile
+import weakref
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import Enum
+from itertools import count, groupby
+from operator import attrgetter
+from time import perf_counter_ns
 from types import SimpleNamespace
-from typing import NewType, Annotated, Any, Optional, Callable
+from typing import NewType, Annotated, Any, Optional, Callable, Iterable
 
-import geopy.distance
+import numpy as np
 
+import geodata
+from metrics import Metrics
+from profiling import Profiler
+from randomness import RandomStreams
+from timers import Timer, TimerWheel
+from tracing import Tracer, TraceKind
 
-@dataclass
+
+@dataclass(slots=True)
 class Event:
     delay: int  # The delay relative to the current instant with which the event will be processed.
     node_id: NodeId  # The id of the node that will process the event.
     message: Message  # The message that will be delivered to the node.
 
-    def __lt__(self, other: Event):
-        return self.node_id < other.node_id
+
+# A message sent to several nodes, scheduled as a single entry that is re-inserted for each successive delivery.
+# The deliveries are sorted by instant and then by the sequence number they would have had as individual events.
+@dataclass(slots=True)
+class Multicast:
+    message: Message
+    sent_at: float  # The instant at which the message was sent.
+    instants: np.ndarray  # The sorted delivery instants.
+    seqs: np.ndarray  # The sequence numbers of the deliveries.
+    node_ids: np.ndarray  # The destination nodes of the deliveries.
+    position: int = 0  # The index of the next delivery.
+
+    # Returns the next delivery as an event, and re-inserts the multicast into the scheduler if deliveries remain.
+    def pop(self, scheduler: Scheduler) -> Event:
+        i = self.position
+        instant = float(self.instants[i])
+        event = Event(instant - self.sent_at, NodeId(self.node_ids[i]), self.message)
+        self.position = i = i + 1
+        if i < len(self.instants):
+            scheduler.push(float(self.instants[i]), int(self.seqs[i]), self)
+        return event
+
+
+# The priority queue underlying the EventQueue.
+# Entries (events or multicasts) are ordered by instant, and entries scheduled for the same instant by their sequence
+# number.
+class Scheduler(ABC):
+    @abstractmethod
+    def push(self, instant: float, seq: int, event: Event | Multicast):
+        pass
+
+    # Removes the next entry, returning it together with its instant.
+    @abstractmethod
+    def pop(self) -> tuple[float, Event | Multicast]:
+        pass
+
+    # Returns the instant of the next event.
+    @abstractmethod
+    def peek(self) -> float:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+# A binary heap of events.
+@dataclass
+class HeapScheduler(Scheduler):
+    def __post_init__(self):
+        self._events: list[tuple[float, int, Event]] = []
+
+    def push(self, instant: float, seq: int, event: Event):
+        heapq.heappush(self._events, (instant, seq, event))
+
+    def pop(self) -> tuple[float, Event]:
+        (instant, _, event) = heapq.heappop(self._events)
+        return instant, event
+
+    def peek(self) -> float:
+        return self._events[0][0]
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+# A calendar queue (R. Brown, 1988) with amortized O(1) push and pop.
+# Time is divided in buckets of equal width, mapped cyclically onto an array of sorted lists (one "year" being a full
+# cycle through the array). The number of buckets follows the number of events and the bucket width is re-estimated
+# from the spacing of the next events whenever the array is resized.
+@dataclass
+class CalendarScheduler(Scheduler):
+    bucket_width: float = 1.0  # The initial bucket width.
+    bucket_count: int = 64  # The initial (and minimal) number of buckets.
+
+    # Number of events sampled to estimate the bucket width.
+    _SAMPLE_SIZE = 25
+
+    def __post_init__(self):
+        self._width = self.bucket_width
+        self._buckets: list[list[tuple[float, int, Event]]] = [[] for _ in range(self.bucket_count)]
+        self._size = 0
+        self._bucket = 0  # The number (instant // width) of the bucket at which the search for the next event starts.
+        self._last = 0.0  # The instant of the last popped event.
+
+    def push(self, instant: float, seq: int, event: Event):
+        bucket = int(instant // self._width)
+        bisect.insort(self._buckets[bucket % len(self._buckets)], (instant, seq, event))
+        self._bucket = min(self._bucket, bucket)
+        self._size += 1
+        if self._size > 2 * len(self._buckets):
+            self._resize(2 * len(self._buckets))
+
+    def pop(self) -> tuple[float, Event]:
+        if not self._size:
+            raise IndexError("pop from an empty scheduler")
+        (instant, _, event) = self._next_bucket().pop(0)
+        self._last = instant
+        self._size -= 1
+        if self._size < len(self._buckets) // 2 and len(self._buckets) > self.bucket_count:
+            self._resize(len(self._buckets) // 2)
+        return instant, event
+
+    def peek(self) -> float:
+        if not self._size:
+            raise IndexError("peek into an empty scheduler")
+        return self._next_bucket()[0][0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    # Returns the bucket whose first event is the next event.
+    def _next_bucket(self) -> list[tuple[float, int, Event]]:
+        buckets, width = self._buckets, self._width
+        for bucket_number in range(self._bucket, self._bucket + len(buckets)):
+            bucket = buckets[bucket_number % len(buckets)]
+            if bucket and bucket[0][0] // width <= bucket_number:
+                self._bucket = bucket_number
+                return bucket
+
+        # No event within a year: the queue is sparse, search directly for the earliest event.
+        bucket = min((bucket for bucket in buckets if bucket), key=lambda b: b[0])
+        self._bucket = int(bucket[0][0] // width)
+        return bucket
+
+    def _resize(self, bucket_count: int):
+        events = sorted(event for bucket in self._buckets for event in bucket)
+
+        sample = events[:self._SAMPLE_SIZE]
+        if len(sample) > 1 and sample[-1][0] > sample[0][0]:
+            self._width = 3 * (sample[-1][0] - sample[0][0]) / (len(sample) - 1)
+
+        self._buckets = [[] for _ in range(bucket_count)]
+        for event in events:
+            self._buckets[int(event[0] // self._width) % bucket_count].append(event)
+        self._bucket = int((events[0][0] if events else self._last) // self._width)
+
+
+# A scheduler storing the pending events as rows of a structured array rather than as objects, for simulations with
+# millions of pending events.
+# A row holds the instant, the sequence number and the fields of the event and of its message, with the path as its id
+# and the payload as a handle into a table of objects: about 50 bytes per pending event, against several hundred for
+# the objects. Events are rebuilt when popped, so the message delivered is equal to, but not the same object as, the
+# message sent. Events whose message is not a plain Message, and multicasts, are kept whole in the table of objects.
+# As in a ladder queue, the rows are pushed unsorted; when the front is empty, the earliest rows are moved to the
+# front, sorted, and popped from there. Events pushed before the end of the front go to a small heap.
+@dataclass
+class ArrayScheduler(Scheduler):
+    front_size: int = 1 << 16  # The number of rows moved to the front at once.
+    capacity: int = 1024  # The initial (and minimal) capacity of the array.
+
+    _ROW = np.dtype([('instant', np.float64), ('seq', np.int64), ('delay', np.float64), ('node_id', np.int32),
+                     ('sender', np.int32), ('path', np.int32), ('handle', np.int64)])
+    # The path of the rows holding a whole event or multicast in the table of objects.
+    _OBJECT = -1
+    # The handle of a None payload.
+    _NONE = -1
+
+    def __post_init__(self):
+        self._rows = np.empty(self.capacity, dtype=self._ROW)  # The unsorted rows, from the end of the front on.
+        self._count = 0
+        self._front: list[tuple] = []  # The sorted rows of the front, as tuples.
+        self._cursor = 0  # The index of the next row of the front.
+        self._early: list[tuple] = []  # A heap of the rows pushed before the end of the front.
+        self._threshold = -np.inf  # The end of the front: the rows of the array are at this instant or later.
+        self._objects: list[Any] = []
+        self._free_handles: list[int] = []
+
+    def push(self, instant: float, seq: int, event: Event | Multicast):
+        message = event.message if type(event) is Event else None
+        if type(message) is Message and isinstance(message.sender, int):
+            row = (instant, seq, event.delay, event.node_id, message.sender, message.path.id,
+                   self._store(message.payload))
+        else:
+            row = (instant, seq, 0.0, 0, 0, self._OBJECT, self._store(event))
+        if instant < self._threshold:
+            heapq.heappush(self._early, row)
+            return
+        if self._count == len(self._rows):
+            self._resize(2 * len(self._rows))
+        self._rows[self._count] = row
+        self._count += 1
+
+    def pop(self) -> tuple[float, Event | Multicast]:
+        if self._cursor == len(self._front) and not self._early:
+            self._refill()
+        if self._early and (self._cursor == len(self._front) or self._early[0] < self._front[self._cursor]):
+            row = heapq.heappop(self._early)
+        else:
+            row = self._front[self._cursor]
+            self._cursor += 1
+        (instant, _, delay, node_id, sender, path, handle) = row
+        obj = self._release(handle)
+        if path == self._OBJECT:
+            return instant, obj
+        return instant, Event(delay, NodeId(node_id), Message(Path.from_id(path), NodeId(sender), obj))
+
+    def peek(self) -> float:
+        if self._cursor == len(self._front) and not self._early:
+            self._refill()
+        if self._cursor == len(self._front):
+            return self._early[0][0]
+        if self._early:
+            return min(self._early[0][0], self._front[self._cursor][0])
+        return self._front[self._cursor][0]
+
+    def __len__(self) -> int:
+        return self._count + len(self._front) - self._cursor + len(self._early)
+
+    def _store(self, obj: Any) -> int:
+        if obj is None:
+            return self._NONE
+        if self._free_handles:
+            handle = self._free_handles.pop()
+            self._objects[handle] = obj
+            return handle
+        self._objects.append(obj)
+        return len(self._objects) - 1
+
+    def _release(self, handle: int) -> Any:
+        if handle == self._NONE:
+            return None
+        obj = self._objects[handle]
+        self._objects[handle] = None
+        self._free_handles.append(handle)
+        return obj
+
+    # Moves the earliest rows of the array to the front.
+    def _refill(self):
+        if not self._count:
+            raise IndexError("pop from an empty scheduler")
+        rows = self._rows[:self._count]
+        instants = rows['instant']
+        if self._count <= self.front_size:
+            selected = np.ones(self._count, dtype=bool)
+            threshold = np.nextafter(instants.max(), np.inf)
+        else:
+            threshold = np.partition(instants, self.front_size)[self.front_size]
+            selected = instants < threshold
+            if not selected.any():
+                # The earliest rows are all at the same instant.
+                selected = instants == threshold
+                threshold = np.nextafter(threshold, np.inf)
+        front = rows[selected]
+        rest = rows[~selected]
+        self._front = front[np.lexsort((front['seq'], front['instant']))].tolist()
+        self._cursor = 0
+        self._threshold = float(threshold)
+        self._count = len(rest)
+        self._rows[:self._count] = rest
+        if len(self._rows) > self.capacity and self._count < len(self._rows) // 4:
+            self._resize(len(self._rows) // 2)
+
+    # Path ids are specific to a process: the paths of the rows are pickled along with them, and their ids remapped
+    # when unpickled.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        path_ids = set(np.unique(self._rows['path'][:self._count]).tolist())
+        path_ids.update(row[5] for row in self._front[self._cursor:])
+        path_ids.update(row[5] for row in self._early)
+        path_ids.discard(self._OBJECT)
+        state['_paths'] = {path_id: Path.from_id(path_id) for path_id in path_ids}
+        return state
+
+    def __setstate__(self, state):
+        paths = state.pop('_paths')
+        self.__dict__.update(state)
+        remap = {path_id: path.id for (path_id, path) in paths.items() if path.id != path_id}
+        if not remap:
+            return
+        table = np.arange(max(paths) + 1, dtype=np.int32)
+        table[list(remap)] = list(remap.values())
+        column = self._rows['path'][:self._count]
+        rows = column != self._OBJECT
+        column[rows] = table[column[rows]]
+        self._front = [row[:5] + (remap.get(row[5], row[5]),) + row[6:] for row in self._front]
+        self._early = [row[:5] + (remap.get(row[5], row[5]),) + row[6:] for row in self._early]
+
+    def _resize(self, capacity: int):
+        rows = np.empty(max(capacity, self.capacity), dtype=self._ROW)
+        rows[:self._count] = self._rows[:self._count]
+        self._rows = rows
 
 
 @dataclass
 class EventQueue:
     clock: int = 0
+    scheduler: Scheduler = field(default_factory=HeapScheduler)
+    tracer: Optional[Tracer] = None
+    profiler: Optional[Profiler] = None
+    # The timers of the protocols, which fire in order with the events of the scheduler.
+    timers: TimerWheel = field(default_factory=TimerWheel)
 
     def __post_init__(self):
-        self._events: list[tuple[int, Event]] = []
+        # The node on behalf of which events are currently pushed, set by the Simulator.
+        self.current_node: Optional[NodeId] = None
+        # Number of events pushed on behalf of each node, from which the sequence numbers are derived.
+        self._pushed: dict[NodeId, int] = {}
+        # Number of pending events. A multicast is a single scheduler entry, but counts once per destination.
+        self._size = 0
+        # If the queue only holds the events of a partition of the nodes (see `partition`).
+        self._local_nodes: Optional[frozenset[NodeId]] = None
+        self._outbox: Optional[list[tuple[float, int, Event]]] = None
+
+    # Reserves `count` consecutive sequence numbers for events pushed on behalf of the current node.
+    # The sequence number of the n-th event pushed on behalf of node i is (i << 40) | n. Sequence numbers thus do not
+    # depend on how the events of different nodes interleave, which lets partitions of the nodes be simulated
+    # separately with the same event order. Events pushed outside of a node count as pushed on behalf of node 0.
+    def _next_seq(self, count: int = 1) -> int:
+        node = self.current_node or 0
+        pushed = self._pushed.get(node, 0)
+        self._pushed[node] = pushed + count
+        return (node << 40) | pushed
 
     # TODO: rename these
     def push(self, event: Event):
-        instant = self.clock + event.delay
-        heapq.heappush(self._events, (instant, event))
+        if self.profiler is not None and self.profiler.active:
+            self.profiler.time("event queue", "push", self.schedule, self.clock + event.delay, self._next_seq(), event)
+        else:
+            self.schedule(self.clock + event.delay, self._next_seq(), event)
+
+    # Schedules the delivery of a message to several nodes, with the given delays.
+    # The deliveries are processed in the same order as if each of them had been pushed as an event, in turn.
+    def push_multicast(self, message: Message, delays: np.ndarray, node_ids: list[NodeId]):
+        if not node_ids:
+            return
+        instants = self.clock + np.asarray(delays, dtype=np.float64)
+        seqs = self._next_seq(len(node_ids)) + np.arange(len(node_ids))
+        if self.profiler is not None and self.profiler.active:
+            self.profiler.time("event queue", "push_multicast", self.schedule_multicast, message, instants, seqs,
+                               np.asarray(node_ids))
+        else:
+            self.schedule_multicast(message, instants, seqs, np.asarray(node_ids))
 
+    # Schedules an event at the given instant with the given sequence number.
+    def schedule(self, instant: float, seq: int, event: Event):
+        if self._local_nodes is not None and event.node_id not in self._local_nodes:
+            self._outbox.append((instant, seq, event))
+            return
+        self.scheduler.push(instant, seq, event)
+        self._size += 1
+
+    # Schedules the deliveries of a message at the given instants with the given sequence numbers.
+    def schedule_multicast(self, message: Message, instants: np.ndarray, seqs: np.ndarray, node_ids: np.ndarray):
+        if self._local_nodes is not None:
+            local = np.fromiter((node_id in self._local_nodes for node_id in node_ids.tolist()), dtype=bool,
+                                count=len(node_ids))
+            for i in np.flatnonzero(~local).tolist():
+                event = Event(float(instants[i]) - self.clock, NodeId(node_ids[i]), message)
+                self._outbox.append((float(instants[i]), int(seqs[i]), event))
+            instants, seqs, node_ids = instants[local], seqs[local], node_ids[local]
+            if not len(node_ids):
+                return
+        order = np.argsort(instants, kind='stable')
+        multicast = Multicast(message, self.clock, instants[order], seqs[order], node_ids[order])
+        self.scheduler.push(float(multicast.instants[0]), int(multicast.seqs[0]), multicast)
+        self._size += len(node_ids)
+
+    # Restricts the queue to the events of the given nodes.
+    # Events for other nodes are appended to `outbox` as (instant, sequence number, event) instead of being scheduled.
+    def partition(self, local_nodes: Iterable[NodeId], outbox: list[tuple[float, int, Event]]):
+        self._local_nodes = frozenset(local_nodes)
+        self._outbox = outbox
+
+    # Arms a timer delivering an event after its delay, on behalf of the current node.
+    # Unlike pushed events, timers are not in the scheduler, and can be cancelled.
+    def set_timer(self, event: Event) -> Timer:
+        return self.timers.add(self.clock + event.delay, self._next_seq(), event)
+
+    # Cancels a timer. Returns whether it was pending.
+    def cancel_timer(self, timer: Timer) -> bool:
+        return self.timers.cancel(timer)
+
+    # Returns the instant of the next event.
+    def peek(self) -> float:
+        if self.timers:
+            return min(self.scheduler.peek() if self.scheduler else math.inf, self.timers.peek())
+        return self.scheduler.peek()
+
+    # Removes the next event. As in `pop_instant`, the events of the scheduler come before the timers of their
+    # instant.
     def pop(self) -> Event:
-        (instant, event) = heapq.heappop(self._events)
-        self.clock = instant
+        timers = self.timers
+        if timers and (not self.scheduler or timers.peek() < self.scheduler.peek()):
+            (self.clock, event) = timers.pop()
+            if self.tracer is not None:
+                self.tracer.now = self.clock
+            return event
+        return self._pop_scheduled()
+
+    def _pop_scheduled(self) -> Event:
+        (self.clock, event) = self.scheduler.pop()
+        if type(event) is Multicast:
+            event = event.pop(self.scheduler)
+        self._size -= 1
+        if self.tracer is not None:
+            self.tracer.now = self.clock
+            msg = event.message
+            self.tracer.record(TraceKind.POP, self.clock, msg.sender, event.node_id, msg.path.id,
+                               payload_size(msg.payload))
         return event
 
+    # Removes all the events scheduled for the next instant, in order, followed by the timers of that instant.
+    def pop_instant(self) -> list[Event]:
+        scheduler = self.scheduler
+        if self.timers:
+            instant = self.peek()
+            events = []
+            while scheduler and scheduler.peek() == instant:
+                events.append(self._pop_scheduled())
+            self.clock = instant
+            if self.tracer is not None:
+                self.tracer.now = instant
+            events += self.timers.pop_instant(instant)
+            return events
+        events = [self._pop_scheduled()]
+        while scheduler and scheduler.peek() == self.clock:
+            events.append(self._pop_scheduled())
+        return events
+
     def __len__(self) -> int:
-        return len(self._events)
+        return self._size + len(self.timers)
 
 
+# A segment of a Path, made of named fields.
+# Segments are interned: constructing a segment equal to an existing one returns the existing segment, so segments are
+# compared by identity and hashed by a small integer. Segments must not be modified after construction.
+# The segments are interned weakly, so that those only used to build paths (e.g. the InstanceId of a protocol, from
+# which the segment of its path is made) are freed, and their numbers are not reused.
+# A single positional argument is a shorthand for the `id` field.
 class PathSegment(SimpleNamespace):
+    __slots__ = ('_number', '__weakref__')
+
+    _segments: weakref.WeakValueDictionary[tuple, PathSegment] = weakref.WeakValueDictionary()
+    _numbers = count()
+
+    def __new__(cls, value: Any = None, /, **fields):
+        if value is not None:
+            fields = {'id': value, **fields}
+        key = (cls, *sorted(fields.items()))
+        segment = PathSegment._segments.get(key)
+        if segment is None:
+            segment = super().__new__(cls)
+            SimpleNamespace.__init__(segment, **fields)
+            segment._number = next(PathSegment._numbers)
+            PathSegment._segments[key] = segment
+        return segment
+
+    # The segment is initialized by __new__.
+    def __init__(self, *args, **kwargs):
+        pass
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+
     def __hash__(self):
-        return hash(tuple(self.__dict__.values()))
+        return self._number
+
+    def __reduce__(self):
+        return _new_path_segment, (type(self), self.__dict__)
+
+
+def _new_path_segment(cls: type[PathSegment], fields: dict[str, Any]) -> PathSegment:
+    return cls(**fields)
 
 
+# A sequence of segments identifying a protocol instance or one of its message types.
+# Paths are interned like their segments, and are numbered: `id` is a small integer identifying the path in this
+# process, and `Path.from_id` returns the path with a given id.
+# Unlike segments, paths stay interned for the lifetime of the process, as their ids are held by schedulers, backlogs,
+# traces, metrics and profiles. The intern tables are thus bounded by the number of distinct paths created in the
+# process, including the paths of the protocol instances created on demand (see Dispatcher.register_factory) and of
+# their messages, about 1 kB each with their segment.
 class Path(tuple[PathSegment, ...]):
+    _paths: dict[tuple[PathSegment, ...], Path] = {}
+    _paths_by_id: list[Path] = []
+
+    def __new__(cls, segments: Iterable[PathSegment] = ()):
+        segments = tuple(segments)
+        path = Path._paths.get(segments)
+        if path is None:
+            path = super().__new__(cls, segments)
+            path.id = len(Path._paths_by_id)
+            path._children = {}
+            Path._paths[segments] = path
+            Path._paths_by_id.append(path)
+        return path
+
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+
+    def __hash__(self):
+        return self.id
+
+    def __reduce__(self):
+        return Path, (tuple(self),)
+
+    @staticmethod
+    def from_id(path_id: int) -> Path:
+        return Path._paths_by_id[path_id]
+
+    # Returns the path of the given segments if it exists, without creating it.
+    @staticmethod
+    def find(segments: tuple[PathSegment, ...]) -> Optional[Path]:
+        return Path._paths.get(segments)
+
     def append(self, segment: Optional[PathSegment] = None, **kwargs) -> Path:
         segment = PathSegment(**segment.__dict__, **kwargs) if segment else PathSegment(**kwargs)
-        return Path(self + (segment,))
+        child = self._children.get(segment)
+        if child is None:
+            child = self._children[segment] = Path(self + (segment,))
+        return child
 
 
 class InstanceId(PathSegment):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     path: Path
     sender: NodeId   # The id of the node that sent the message.
     payload: Any = None  # The payload of the message.
 
 
+# Returns the size of a message payload: its length if it has one, 0 otherwise.
+def payload_size(payload: Any) -> int:
+    return len(payload) if hasattr(payload, '__len__') else 0
+
+
 @dataclass
 class Network:
     event_queue: EventQueue
     latency_model: LatencyModel
+    tracer: Optional[Tracer] = None
+    profiler: Optional[Profiler] = None
+    metrics: Optional[Metrics] = None
 
     def send(self, msg: Message, dst_node_id: NodeId):
-        delay = self.latency_model.get_latency(msg.sender, dst_node_id)
+        if self.profiler is not None and self.profiler.active:
+            self.profiler.time("network", "send", self._send, msg, dst_node_id)
+        else:
+            self._send(msg, dst_node_id)
+
+    def _send(self, msg: Message, dst_node_id: NodeId):
+        if self.profiler is not None and self.profiler.active:
+            delay = self.profiler.time("latency model", "get_message_latency", self.latency_model.get_message_latency,
+                                       msg, dst_node_id)
+        else:
+            delay = self.latency_model.get_message_latency(msg, dst_node_id)
+        if self.metrics is not None:
+            self.metrics.send(self.event_queue.clock, msg, dst_node_id, delay)
+        if self.tracer is not None:
+            self.tracer.record(TraceKind.SEND, self.event_queue.clock, msg.sender, dst_node_id, msg.path.id,
+                               payload_size(msg.payload))
         self.event_queue.push(Event(delay, dst_node_id, msg))
 
+    # Sends the same message to several nodes, as a single multicast entry in the event queue.
     def broadcast(self, msg: Message, dst_node_ids: list[NodeId]):
-        for node_id in dst_node_ids:
-            self.send(msg, node_id)
+        if self.profiler is not None and self.profiler.active:
+            self.profiler.time("network", "broadcast", self._broadcast, msg, dst_node_ids)
+        else:
+            self._broadcast(msg, dst_node_ids)
+
+    def _broadcast(self, msg: Message, dst_node_ids: list[NodeId]):
+        if self.profiler is not None and self.profiler.active:
+            delays = self.profiler.time("latency model", "get_message_latencies",
+                                        self.latency_model.get_message_latencies, msg, dst_node_ids)
+        else:
+            delays = self.latency_model.get_message_latencies(msg, dst_node_ids)
+        if self.metrics is not None:
+            self.metrics.send_many(self.event_queue.clock, msg, dst_node_ids, delays)
+        if self.tracer is not None:
+            self.tracer.record_many(TraceKind.SEND, self.event_queue.clock, msg.sender, dst_node_ids, msg.path.id,
+                                    payload_size(msg.payload))
+        self.event_queue.push_multicast(msg, delays, dst_node_ids)
 
 
 @dataclass(kw_only=True)
@@ -95,12 +628,35 @@ class Protocol(ABC):
     def subscribe(self, path: Path, callback: Callable[[Message], None]):
         self.dispatcher.subscribe(path, callback)
 
+    # Creates the sub-protocols under a path prefix on demand, see Dispatcher.register_factory.
+    def register_factory(self, prefix: Path, factory: Callable[[PathSegment], Any]):
+        self.dispatcher.register_factory(prefix, factory)
+
+    # Declares the protocol finished: if it was created on demand, it is released with its subscriptions.
+    def finish(self):
+        self.dispatcher.release(self.path)
+
     def send(self, msg: Message, destination: NodeId):
         self.network.send(msg, destination)
 
     def broadcast(self, msg: Message, destination: list[NodeId]):
         self.network.broadcast(msg, destination)
 
+    # Returns the path on which the timers of the given name are delivered to the protocol.
+    def timer_path(self, name: str) -> Path:
+        return self.path.append(timer=name)
+
+    # Arms a timer: after the delay, a message with the payload is delivered to the node on `timer_path(name)`, to
+    # which the protocol subscribes like to any other path. Timers go through neither the network nor the scheduler,
+    # and can be cancelled.
+    def set_timer(self, delay: float, name: str, payload: Any = None) -> Timer:
+        msg = Message(self.timer_path(name), self.node_id, payload)
+        return self.network.event_queue.set_timer(Event(delay, self.node_id, msg))
+
+    # Cancels a timer. Returns whether it was pending.
+    def cancel_timer(self, timer: Timer) -> bool:
+        return self.network.event_queue.cancel_timer(timer)
+
     # Method that is executed when the protocol is started.
     def start(self):
         raise NotImplementedError
@@ -120,30 +676,332 @@ class Node:
         self.dispatcher.deliver(msg)
 
 
+# What a backlog does with a message beyond its limits.
+class BacklogPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"  # Drop the oldest message of the path (or of the node, for the node limit).
+    DROP_NEWEST = "drop_newest"  # Drop the incoming message.
+    SPILL = "spill"  # Move the oldest message to a spill file, from which it is read back when replayed.
+
+
+# A temporary file to which backlogs spill messages, shared by the backlogs of all the nodes.
+# The space of the messages read back is not reclaimed until the file is closed.
+@dataclass
+class SpillFile:
+    directory: Annotated[Optional[str], 'backlog_spill_directory'] = None
+
+    def __post_init__(self):
+        self._file = tempfile.TemporaryFile(dir=self.directory)
+
+    # Writes a message, returning its position (offset and length) in the file.
+    def write(self, msg: Message) -> tuple[int, int]:
+        data = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self._file.seek(0, os.SEEK_END)
+        self._file.write(data)
+        return offset, len(data)
+
+    def read(self, position: tuple[int, int]) -> Message:
+        (offset, length) = position
+        self._file.seek(offset)
+        return pickle.loads(self._file.read(length))
+
+    def close(self):
+        self._file.close()
+
+    # The spilled messages are copied along with the file, which is pickled by value (e.g. in checkpoints).
+    def __getstate__(self):
+        self._file.seek(0)
+        return {"directory": self.directory, "data": self._file.read()}
+
+    def __setstate__(self, state):
+        self.directory = state["directory"]
+        self.__post_init__()
+        self._file.write(state["data"])
+
+
+# The paths for which a missing subscription was reported, shared by the backlogs of the nodes of a simulation so that
+# each path is reported once per simulation.
+@dataclass
+class BacklogReports:
+    path_ids: set[int] = field(default_factory=set)
+
+    # Path ids are specific to a process: the paths are pickled.
+    def __getstate__(self):
+        return {"paths": [Path.from_id(path_id) for path_id in self.path_ids]}
+
+    def __setstate__(self, state):
+        self.path_ids = {path.id for path in state["paths"]}
+
+
+# The messages delivered to a node for paths it has no subscription for yet, by path id, held until a subscription.
+# The number of messages held in memory can be limited per path and for the whole node, beyond which messages are
+# dropped or spilled according to the policy.
+@dataclass
+class Backlog:
+    node_id: NodeId
+    path_limit: Annotated[Optional[int], 'backlog_path_limit'] = None
+    node_limit: Annotated[Optional[int], 'backlog_node_limit'] = None
+    policy: BacklogPolicy = BacklogPolicy.DROP_OLDEST
+    spill_file: Optional[SpillFile] = None
+    reports: Optional[BacklogReports] = None  # Shared by the backlogs of a simulation, otherwise specific to this one.
+
+    def __post_init__(self):
+        if self.policy is BacklogPolicy.SPILL and self.spill_file is None:
+            self.spill_file = SpillFile()
+        if self.reports is None:
+            self.reports = BacklogReports()
+        self._messages: dict[int, deque[Message]] = {}  # The messages held in memory, oldest first.
+        self._spilled: dict[int, list[tuple[int, int]]] = {}  # The positions of the spilled messages, oldest first.
+        self._in_memory = 0
+        # With a node limit, the paths of the messages in memory in arrival order, to find the oldest one.
+        # Removing a message from the backlog leaves its entry in place: the first `_stale[path id]` entries of a path
+        # are stale.
+        self._order: deque[int] = deque()
+        self._stale: dict[int, int] = {}
+        self.size = 0  # The number of messages held, in memory or spilled.
+        self.dropped = 0  # The number of messages dropped.
+        self.spilled = 0  # The number of messages spilled.
+
+    def add(self, msg: Message):
+        path_id = msg.path.id
+        reported = self.reports.path_ids
+        if path_id not in reported:
+            reported.add(path_id)
+            logging.warning(f"Node {self.node_id} does not have a subscription for path {msg.path} "
+                            f"(reported once per path)")
+
+        messages = self._messages.get(path_id)
+        if self.policy is BacklogPolicy.DROP_NEWEST and (
+                (self.path_limit is not None and messages is not None and len(messages) >= self.path_limit) or
+                (self.node_limit is not None and self._in_memory >= self.node_limit)):
+            self.dropped += 1
+            return
+
+        if messages is None:
+            messages = self._messages[path_id] = deque()
+        messages.append(msg)
+        self._in_memory += 1
+        self.size += 1
+        if self.node_limit is not None:
+            self._order.append(path_id)
+        if self.path_limit is not None and len(messages) > self.path_limit:
+            self._evict(path_id)
+        if self.node_limit is not None and self._in_memory > self.node_limit:
+            self._evict(self._pop_oldest_path(), ordered=False)
+
+    # Removes and returns the messages held for a path, oldest first.
+    def take(self, path_id: int) -> list[Message]:
+        spilled = self._spilled.pop(path_id, None)
+        messages = [self.spill_file.read(position) for position in spilled] if spilled else []
+        in_memory = self._messages.pop(path_id, None)
+        if in_memory:
+            messages.extend(in_memory)
+            self._in_memory -= len(in_memory)
+            if self.node_limit is not None:
+                self._stale[path_id] = self._stale.get(path_id, 0) + len(in_memory)
+                if len(self._order) > 2 * self._in_memory + 64:
+                    self._compact()
+        self.size -= len(messages)
+        return messages
+
+    def __len__(self) -> int:
+        return self.size
+
+    # Drops or spills the oldest message in memory of a path. The message's entry in `_order` becomes stale, unless
+    # it was already removed.
+    def _evict(self, path_id: int, ordered: bool = True):
+        messages = self._messages[path_id]
+        msg = messages.popleft()
+        if not messages:
+            del self._messages[path_id]
+        self._in_memory -= 1
+        if ordered and self.node_limit is not None:
+            self._stale[path_id] = self._stale.get(path_id, 0) + 1
+        if self.policy is BacklogPolicy.SPILL:
+            self._spilled.setdefault(path_id, []).append(self.spill_file.write(msg))
+            self.spilled += 1
+        else:
+            self.size -= 1
+            self.dropped += 1
+
+    # Removes the entry of the oldest message in memory from `_order`, returning its path.
+    def _pop_oldest_path(self) -> int:
+        while True:
+            path_id = self._order.popleft()
+            stale = self._stale.get(path_id)
+            if not stale:
+                return path_id
+            if stale == 1:
+                del self._stale[path_id]
+            else:
+                self._stale[path_id] = stale - 1
+
+    # Path ids are specific to a process: the messages are pickled by path.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_messages', '_spilled', '_stale'):
+            state[key] = {Path.from_id(path_id): value for (path_id, value) in state[key].items()}
+        state['_order'] = deque(map(Path.from_id, self._order))
+        return state
+
+    def __setstate__(self, state):
+        for key in ('_messages', '_spilled', '_stale'):
+            state[key] = {path.id: value for (path, value) in state[key].items()}
+        state['_order'] = deque(path.id for path in state['_order'])
+        self.__dict__.update(state)
+
+    # Removes the stale entries from `_order`.
+    def _compact(self):
+        order = deque()
+        for path_id in self._order:
+            stale = self._stale.get(path_id)
+            if stale:
+                self._stale[path_id] = stale - 1
+            else:
+                order.append(path_id)
+        self._order = order
+        self._stale = {}
+
+
+# Returned by the factories of protocol instances for the instances that finished (see Dispatcher.register_factory).
+FINISHED = object()
+
+
 @dataclass
 class Dispatcher:
     node_id: NodeId
+    tracer: Optional[Tracer] = None
+    backlog: Optional[Backlog] = None  # The messages for paths without subscription, unbounded by default.
+    profiler: Optional[Profiler] = None
+    metrics: Optional[Metrics] = None
 
     def __post_init__(self):
-        self._subscriptions: dict[Path, Callable[[Message], None]] = {}
-        self._backlog: dict[Path, list[Message]] = {}
+        # Subscriptions by path id.
+        self._subscriptions: dict[int, Callable[[Message], None]] = {}
+        if self.backlog is None:
+            self.backlog = Backlog(self.node_id)
+        # Factories of protocol instances, by the prefix of the paths of their instances (see `register_factory`).
+        self._factories: dict[Path, Callable[[PathSegment], Any]] = {}
+        # The instances created by the factories, by path, with the subscriptions, factories and instances they own.
+        self._instances: dict[Path, Protocol] = {}
+        self._owned: dict[Path, list[tuple[str, Path]]] = {}
+        # The number of messages discarded for finished instances.
+        self.discarded = 0
 
     # Delivers a message to the node for processing.
     def deliver(self, msg: Message):
-        if msg.path in self._subscriptions:
-            self._subscriptions[msg.path](msg)
+        if self.tracer is not None:
+            self.tracer.record(TraceKind.DELIVER, self.tracer.now, msg.sender, self.node_id, msg.path.id,
+                               payload_size(msg.payload))
+        if self.metrics is not None:
+            self.metrics.deliver(msg)
+        callback = self._subscriptions.get(msg.path.id)
+        if callback is None and self._factories:
+            callback = self._instantiate(msg.path)
+        if self.profiler is not None and self.profiler.active:
+            if callback is not None:
+                self.profiler.deliver(callback, msg)
+            else:
+                self.profiler.time("dispatcher", "backlog", self.backlog.add, msg)
+        elif callback is not None:
+            callback(msg)
         else:
-            self._backlog.setdefault(msg.path, []).append(msg)
-            logging.warning(f"Node {self.node_id} does not have a subscription for path {msg.path}")
+            self.backlog.add(msg)
+
+    # Path ids are specific to a process: the subscriptions are pickled by path.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_subscriptions'] = {Path.from_id(path_id): callback
+                                   for (path_id, callback) in self._subscriptions.items()}
+        return state
 
+    def __setstate__(self, state):
+        state['_subscriptions'] = {path.id: callback for (path, callback) in state['_subscriptions'].items()}
+        self.__dict__.update(state)
+
+    # Subscribes to the messages of a path, passing the backlogged messages of the path to the callback at once.
     def subscribe(self, path: Path, callback: Callable[[Message], None]):
-        if path in self._subscriptions:
+        if path.id in self._subscriptions:
             raise ValueError(f"Node {self.node_id} already has a subscription for path {path}")
-        self._subscriptions[path] = callback
-        if path in self._backlog:
-            for msg in self._backlog[path]:
-                self.deliver(msg)
-            del self._backlog[path]
+        self._subscriptions[path.id] = callback
+        if self._instances:
+            self._own("subscription", path)
+        if self.backlog:
+            for msg in self.backlog.take(path.id):
+                callback(msg)
+
+    # Registers a factory of protocol instances, created on demand: the first message for a path under
+    # `prefix + (segment,)` without subscription creates the instance `factory(segment)`, starts it, and is delivered to
+    # it if it subscribed to the path. The factory returns None for segments that are not instances.
+    # An instance is released by `release` once finished, together with the subscriptions, factories and instances it
+    # registered, and the dispatcher keeps nothing of it: memory is taken by the active instances only, apart from the
+    # interned paths of the released ones (see Path). Whether an instance finished is up to the protocol owning the
+    # factory, which records it as it sees fit (e.g. as a watermark of sequential instance numbers): for the segments
+    # of finished instances, the factory returns FINISHED and the messages are discarded.
+    def register_factory(self, prefix: Path, factory: Callable[[PathSegment], Any]):
+        if prefix in self._factories:
+            raise ValueError(f"Node {self.node_id} already has a factory for path {prefix}")
+        self._factories[prefix] = factory
+        if self._instances:
+            self._own("factory", prefix)
+
+    # Releases an instance created by a factory.
+    def release(self, path: Path):
+        if self._instances.pop(path, None) is None:
+            return
+        for (kind, owned) in self._owned.pop(path, ()):
+            if kind == "subscription":
+                self._subscriptions.pop(owned.id, None)
+            elif kind == "factory":
+                self._factories.pop(owned, None)
+            else:
+                self.release(owned)
+
+    # Returns the callback of a path without subscription once the instance it belongs to is created, if any.
+    def _instantiate(self, path: Path) -> Optional[Callable[[Message], None]]:
+        for length in range(len(path) - 1, -1, -1):
+            prefix = Path.find(path[:length])
+            factory = self._factories.get(prefix) if prefix is not None else None
+            if factory is not None:
+                break
+        else:
+            return None
+        protocol = self._create(Path(path[:length + 1]), factory)
+        if protocol is None:
+            return None
+        if protocol is FINISHED:
+            return self._discard
+        return self._subscriptions.get(path.id)
+
+    # Creates and starts the instance of a path under the prefix of a factory as its first message would, e.g. for
+    # the instances that no incoming message creates, such as the node's own broadcasts. Returns the instance, or what
+    # the factory returned instead (None or FINISHED).
+    def instantiate(self, path: Path) -> Any:
+        factory = self._factories.get(Path.find(path[:-1]))
+        if factory is None:
+            raise ValueError(f"Node {self.node_id} does not have a factory for path {path}")
+        return self._create(path, factory)
+
+    def _create(self, instance_path: Path, factory: Callable[[PathSegment], Any]) -> Any:
+        protocol = self._instances.get(instance_path)
+        if protocol is None:
+            protocol = factory(instance_path[-1])
+            if protocol is None or protocol is FINISHED:
+                return protocol
+            self._own("instance", instance_path)
+            self._instances[instance_path] = protocol
+            protocol.start()
+        return protocol
+
+    def _discard(self, msg: Message):
+        self.discarded += 1
+
+    # Records that the innermost instance whose path starts the given path, if any, owns it.
+    def _own(self, kind: str, path: Path):
+        for length in range(len(path) - (kind == "instance"), 0, -1):
+            owner = Path.find(path[:length])
+            if owner is not None and owner in self._instances:
+                self._owned.setdefault(owner, []).append((kind, path))
+                return
 
 
 class NodeId(int):
@@ -158,19 +1016,132 @@ class Simulator:
     nodes: list[Node]
     event_queue: EventQueue
     network: Network
+    profiler: Optional[Profiler] = None
+    metrics: Optional[Metrics] = None
+
+    def __post_init__(self):
+        self._nodes_by_id = {node.id: node for node in self.nodes}
+        # The number of events processed so far.
+        self.processed_events = 0
+        # If not None, every delivery is appended to this list as (instant, node id, message).
+        self.deliveries: Optional[list[tuple[float, NodeId, Message]]] = None
+        self.started = False
 
     # Runs the simulation until there are no more events to execute.
     def run(self):
-        logging.info("Starting simulation")
+        self.run_until(math.inf)
+
+    # Returns the summary metrics of the simulation.
+    def summary(self) -> dict[str, Any]:
+        backlogs = [node.dispatcher.backlog for node in self.nodes]
+        return {
+            "events": self.processed_events,
+            "sim_time_ms": self.event_queue.clock,
+            "backlog_held": sum(map(len, backlogs)),
+            "backlog_dropped": sum(backlog.dropped for backlog in backlogs),
+            "backlog_spilled": sum(backlog.spilled for backlog in backlogs),
+        }
+
+    # Runs the simulation until a condition, one instant at a time: until an instant, processing the events scheduled
+    # up to and including it, or until a predicate holds, e.g. once every node decided. The predicate is checked
+    # before the first instant, then before the next instant once at least `every` events were processed since its
+    # last check, so that costly predicates need not be checked at every instant.
+    # The nodes are started on the first call, and later calls resume the simulation where it stopped.
+    # Returns whether the simulation stopped on the condition, rather than because there are no more events.
+    def run_until(self, until: float | Callable[[], bool], every: int = 0) -> bool:
+        start = perf_counter_ns()
+        self._start_once()
+        event_queue = self.event_queue
+        try:
+            if not callable(until):
+                while event_queue and event_queue.peek() <= until:
+                    self.step()
+                return bool(event_queue)
+            checked = -math.inf
+            while event_queue:
+                if self.processed_events - checked >= every:
+                    if until():
+                        return True
+                    checked = self.processed_events
+                self.step()
+            return until()
+        finally:
+            if self.profiler is not None:
+                self.profiler.run_ns += perf_counter_ns() - start
+
+    # Runs the simulation as a generator of the events processed until an instant, as (instant, event), for
+    # consumers streaming them. The events of an instant are yielded once they were all processed, in the order of
+    # their processing. The simulation stops as soon as the consumer does, and can be resumed later.
+    def iter_events(self, until: float = math.inf) -> Iterable[tuple[float, Event]]:
+        self._start_once()
+        event_queue = self.event_queue
+        while event_queue and event_queue.peek() <= until:
+            start = perf_counter_ns()
+            events = self.step()
+            if self.profiler is not None:
+                self.profiler.run_ns += perf_counter_ns() - start
+            instant = event_queue.clock
+            for event in events:
+                yield (instant, event)
 
+    def _start_once(self):
+        if not self.started:
+            logging.info("Starting simulation")
+            self.start()
+
+    # Starts the nodes.
+    # When profiling, the starts of the nodes are timed.
+    def start(self):
+        self.started = True
+        if self.profiler is not None:
+            self.profiler.active = True
         for node in self.nodes:
-            node.start()
+            self.event_queue.current_node = node.id
+            if self.profiler is not None:
+                self.profiler.time("node", "start", node.start)
+            else:
+                node.start()
+        self.event_queue.current_node = None
+        if self.profiler is not None:
+            self.profiler.active = False
+
+    # Processes all the events of the next instant at once, grouped by destination node, and returns them in the
+    # order in which they were processed.
+    # The sort is stable, so every node processes its events in the order in which they were scheduled.
+    def step(self) -> list[Event]:
+        event_queue, nodes, deliveries = self.event_queue, self._nodes_by_id, self.deliveries
+        debug = logging.root.isEnabledFor(logging.DEBUG)
+        if debug:
+            logging.debug("There are %d event(s) in the queue", len(event_queue))
+
+        if self.metrics is not None:
+            self.metrics.step(event_queue.peek(), len(event_queue))
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_step()
+        if profiler is not None and profiler.active:
+            events = profiler.time("event queue", "pop", event_queue.pop_instant)
+        else:
+            events = event_queue.pop_instant()
+        self.processed_events += len(events)
+        events.sort(key=_event_node_id)
+        for node_id, node_events in groupby(events, key=_event_node_id):
+            node = nodes[node_id]
+            event_queue.current_node = node_id
+            for event in node_events:
+                if debug:
+                    logging.debug("Node %d processing message %s at instant %s",
+                                  node_id, event.message, event_queue.clock)
+                if deliveries is not None:
+                    deliveries.append((event_queue.clock, node_id, event.message))
+                node.deliver(event.message)
+        event_queue.current_node = None
+        if profiler is not None:
+            profiler.end_step()
+        return events
+
 
-        while self.event_queue:
-            logging.debug(f"There are {len(self.event_queue)} event(s) in the queue")
-            event = self.event_queue.pop()
-            logging.debug(f"Node {event.node_id} processing message {event.message} at instant {self.event_queue.clock}")
-            self.nodes[event.node_id].deliver(event.message)
+_event_node_id = attrgetter('node_id')
 
 
 class LatencyModel(ABC):
@@ -178,39 +1149,107 @@ class LatencyModel(ABC):
     def get_latency(self, src: NodeId, dst: NodeId) -> int:
         pass
 
+    # Returns the latencies from one node to several nodes.
+    # Models able to compute them in a vectorized way should override this.
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return np.array([self.get_latency(src, dst) for dst in dsts], dtype=np.float64)
+
+    # Returns the latency of a message to a node.
+    # Models whose latency depends on the message (e.g. on the size of its payload) should override this and
+    # `get_message_latencies`.
+    def get_message_latency(self, msg: Message, dst: NodeId) -> float:
+        return self.get_latency(msg.sender, dst)
+
+    def get_message_latencies(self, msg: Message, dsts: list[NodeId]) -> np.ndarray:
+        return self.get_latencies(msg.sender, dsts)
+
+    # Returns lower bounds of the latencies from one node to several nodes, which bound the lookahead of parallel
+    # simulations (see pdes.py). Stochastic models must override this.
+    def get_min_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return self.get_latencies(src, dsts)
+
+
+# Mean radius of the Earth in km.
+EARTH_RADIUS_KM = 6371.0088
+
+
+# Returns the great-circle distances in km between the given points (in radians), using the haversine formula.
+# The arguments are broadcast against each other, so one source can be measured against many destinations at once.
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
 
 @dataclass
 class GeoLatencyModel(LatencyModel):
     group: Group
     geo_data_file_path: str = "resources/lotus_geo_20231105.json"
+    # If set, latency rows are computed and cached on first use instead of precomputing the full N x N matrix.
+    lazy: Annotated[bool, 'lazy_latency'] = False
+    # The maximal number of rows cached in lazy mode, the least recently used being evicted first.
+    cache_rows: Annotated[int, 'latency_cache_rows'] = 1024
+    # Seed for the placement of the nodes, if no random streams are given.
+    seed: Annotated[Optional[int], 'seed'] = None
+    random_streams: Optional[RandomStreams] = None
+
+    # Number of matrix rows computed per vectorized step, bounding the size of temporary arrays.
+    _BLOCK_ROWS = 256
 
     def __post_init__(self):
-        with open(self.geo_data_file_path) as f:
-            data = json.load(f)
-            # The geographical locations of the population.
-            population = [
-                SimpleNamespace(
-                    latitude=float(peer['latitude']),
-                    longitude=float(peer['longitude']),
-                    city=peer['city'],
-                    country=peer['country'],
-                ) for peer in data
-            ]
-            self._node_locations = {}
-            for node_id in self.group:
-                loc = random.choice(population)
-                self._node_locations[node_id] = loc
-                logging.info(f"Node {node_id} is located in {loc.city}, {loc.country}")
+        # The geographical locations of the population, and the index in the population of the location of each node.
+        (population, peers) = geodata.place_nodes(self.geo_data_file_path, self.group, self.random_streams, self.seed)
+        self._node_locations = {node_id: population.location(peer) for (node_id, peer) in zip(self.group, peers)}
+
+        # Row/column of each node in the latency matrix.
+        self._index = {node_id: i for i, node_id in enumerate(self.group)}
+        # Whether node ids are their own matrix indices, so that they can be used to index latency rows directly.
+        self._ids_are_indices = all(node_id == i for i, node_id in enumerate(self.group))
+        self._latitudes = np.radians(population.latitude[peers].astype(np.float64))
+        self._longitudes = np.radians(population.longitude[peers].astype(np.float64))
+
+        self._rows: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        if not self.lazy:
+            self._matrix = np.empty((len(self.group), len(self.group)), dtype=np.float32)
+            for start in range(0, len(self.group), self._BLOCK_ROWS):
+                self._matrix[start:start + self._BLOCK_ROWS] = self._compute_rows(slice(start, start + self._BLOCK_ROWS))
+
+    # Computes the latencies from the nodes at the given matrix rows to all nodes, in single precision (well below a
+    # ns), which halves the memory of the matrix.
+    def _compute_rows(self, rows) -> np.ndarray:
+        distances = haversine_km(self._latitudes[rows, np.newaxis], self._longitudes[rows, np.newaxis],
+                                 self._latitudes, self._longitudes)
+        return (distances / 200 * 1.5).astype(np.float32)
+
+    # Returns the latencies from the node at the given matrix row to all nodes, computing them if necessary.
+    def _row(self, i: int) -> np.ndarray:
+        if self._matrix is not None:
+            return self._matrix[i]
+        rows = self._rows
+        row = rows.get(i)
+        if row is None:
+            row = rows[i] = self._compute_rows(slice(i, i + 1))[0]
+            if len(rows) > self.cache_rows:
+                rows.popitem(last=False)
+        else:
+            rows.move_to_end(i)
+        return row
+
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        if self._ids_are_indices:
+            indices = np.asarray(dsts, dtype=np.intp)
+        else:
+            indices = np.fromiter(map(self._index.__getitem__, dsts), dtype=np.intp, count=len(dsts))
+        return self._row(self._index[src])[indices]
 
     def get_location(self, node_id: NodeId):
         return self._node_locations[node_id]
 
     def get_distance(self, src: NodeId, dst: NodeId) -> float:
-        src_loc = self._node_locations[src].latitude, self._node_locations[src].longitude
-        dst_loc = self._node_locations[dst].latitude, self._node_locations[dst].longitude
-        return geopy.distance.distance(src_loc, dst_loc).km
+        i, j = self._index[src], self._index[dst]
+        return float(haversine_km(self._latitudes[i], self._longitudes[i], self._latitudes[j], self._longitudes[j]))
 
     # Returns the latency in ms
     # 1.5 ms per 200 km
     def get_latency(self, src: NodeId, dst: NodeId) -> float:
-        return self.get_distance(src, dst) / 200 * 1.5
+        return float(self._row(self._index[src])[self._index[dst]])
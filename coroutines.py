@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Optional
+
+from core import EventQueue, Message, Path, Protocol
+
+# Protocols written as coroutines, on an asyncio event loop in simulated time.
+#
+# The loop's clock is the clock of the event queue, in ms: `asyncio.sleep(10)` sleeps 10 simulated ms. Delayed calls
+# are timers of the protocol whose coroutine makes them (see Protocol.set_timer), and the ready callbacks run as soon
+# as a delivery or a timer wakes a coroutine up, on behalf of its node. Thousands of coroutines thus run in one thread
+# without ever sleeping, in the same deterministic order as callbacks would. Coroutines cannot be pickled: the
+# simulations of coroutine protocols cannot be checkpointed, but can be forked.
+
+# The protocol on behalf of which the current coroutine runs. Tasks inherit it from the coroutine creating them.
+_protocol: contextvars.ContextVar[CoroutineProtocol] = contextvars.ContextVar("protocol")
+
+# The name of the timers of the loop's delayed calls.
+_TIMER = "asyncio"
+
+
+# Refuses to pickle the objects holding coroutines, whose frames cannot be pickled, with an explicit error.
+def _not_picklable(self):
+    raise ValueError("Cannot checkpoint a simulation of coroutine protocols: fork it instead (see checkpoint.fork)")
+
+
+@dataclass(eq=False)
+class SimulatorLoop(asyncio.AbstractEventLoop):
+    event_queue: EventQueue
+
+    def __post_init__(self):
+        self._ready: deque[asyncio.Handle] = deque()
+        self._running = False
+        # The timers of the delayed calls, by handle id.
+        self._timers: dict[int, Any] = {}
+
+    def time(self) -> float:
+        return self.event_queue.clock
+
+    def call_soon(self, callback: Callable[..., Any], *args: Any, context=None) -> asyncio.Handle:
+        handle = asyncio.Handle(callback, args, self, context)
+        self._ready.append(handle)
+        return handle
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args: Any, context=None) -> asyncio.TimerHandle:
+        return self.call_at(self.time() + delay, callback, *args, context=context)
+
+    def call_at(self, when: float, callback: Callable[..., Any], *args: Any, context=None) -> asyncio.TimerHandle:
+        protocol = _protocol.get(None)
+        if protocol is None:
+            raise RuntimeError("Delayed calls can only be made by the coroutines of a protocol")
+        handle = asyncio.TimerHandle(when, callback, args, self, context)
+        handle._scheduled = True
+        self._timers[id(handle)] = protocol.set_timer(max(when - self.time(), 0.0), _TIMER, handle)
+        return handle
+
+    def _timer_handle_cancelled(self, handle: asyncio.TimerHandle):
+        timer = self._timers.pop(id(handle), None)
+        if timer is not None:
+            self.event_queue.cancel_timer(timer)
+
+    # Runs a delayed call whose timer fired.
+    def run_timer(self, msg: Message):
+        handle: asyncio.TimerHandle = msg.payload
+        self._timers.pop(id(handle), None)
+        handle._scheduled = False
+        if not handle.cancelled():
+            self._ready.append(handle)
+        self.run_ready()
+
+    def create_future(self) -> asyncio.Future:
+        return asyncio.Future(loop=self)
+
+    def create_task(self, coro: Coroutine, *, name: Optional[str] = None, context=None) -> asyncio.Task:
+        return asyncio.Task(coro, loop=self, name=name, context=context)
+
+    # Starts the main coroutine of a protocol, in its own context.
+    def spawn(self, protocol: CoroutineProtocol, coro: Coroutine) -> asyncio.Task:
+        context = contextvars.copy_context()
+        context.run(_protocol.set, protocol)
+        task = self.create_task(coro, name=str(protocol.path), context=context)
+        task.add_done_callback(_raise_failure)
+        self.run_ready()
+        return task
+
+    # Runs the ready callbacks, and those they make ready, as the running loop.
+    def run_ready(self):
+        if self._running:
+            return
+        self._running = True
+        previous = asyncio.events._get_running_loop()
+        asyncio.events._set_running_loop(self)
+        try:
+            ready = self._ready
+            while ready:
+                handle = ready.popleft()
+                if not handle.cancelled():
+                    handle._run()
+        finally:
+            asyncio.events._set_running_loop(previous)
+            self._running = False
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def is_closed(self) -> bool:
+        return False
+
+    def get_debug(self) -> bool:
+        return False
+
+    # Failures of the callbacks abort the simulation. Other reports, such as coroutines still waiting when the
+    # simulation ends, are logged.
+    def call_exception_handler(self, context: dict[str, Any]):
+        if "exception" in context:
+            raise context["exception"]
+        logging.debug(context["message"])
+
+    def default_exception_handler(self, context: dict[str, Any]):
+        self.call_exception_handler(context)
+
+    __reduce__ = _not_picklable
+
+
+def _raise_failure(task: asyncio.Task):
+    if not task.cancelled():
+        task.result()
+
+
+# The messages of a path, for the coroutines receiving them.
+class _Mailbox:
+    def __init__(self, loop: SimulatorLoop):
+        self._loop = loop
+        self._messages: deque[Message] = deque()
+        self._waiters: deque[asyncio.Future] = deque()
+
+    __reduce__ = _not_picklable
+
+    def put(self, msg: Message):
+        waiters = self._waiters
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(msg)
+                self._loop.run_ready()
+                return
+        self._messages.append(msg)
+
+    async def get(self) -> Message:
+        if self._messages:
+            return self._messages.popleft()
+        waiter = self._loop.create_future()
+        self._waiters.append(waiter)
+        return await waiter
+
+
+# A protocol written as a coroutine, `run`, started with the protocol.
+# The messages of a path are received with `receive`, once the protocol receives the path: the messages of a path
+# arriving before are backlogged by the dispatcher.
+@dataclass(kw_only=True)
+class CoroutineProtocol(Protocol):
+    loop: SimulatorLoop
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._mailboxes: dict[int, _Mailbox] = {}
+
+    __reduce__ = _not_picklable
+
+    def start(self):
+        self.subscribe(self.timer_path(_TIMER), self.loop.run_timer)
+        self.loop.spawn(self, self.run())
+
+    async def run(self):
+        raise NotImplementedError
+
+    # Returns the next message of a path.
+    async def receive(self, path: Path) -> Message:
+        mailbox = self._mailboxes.get(path.id)
+        if mailbox is None:
+            mailbox = self._mailboxes[path.id] = _Mailbox(self.loop)
+            self.subscribe(path, mailbox.put)
+        return await mailbox.get()
+
+    # Returns the next `count` messages of a path, e.g. a quorum of replies.
+    async def receive_many(self, path: Path, count: int) -> list[Message]:
+        return [await self.receive(path) for _ in range(count)]
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+
+from randomness import RandomStreams
+
+
+# A geographical dataset of peers, stored column-wise.
+# City, country and continent names are interned: the per-peer columns hold indices into the name tables.
+@dataclass(eq=False)
+class GeoDataset:
+    latitude: np.ndarray  # float32, in degrees.
+    longitude: np.ndarray  # float32, in degrees.
+    city: np.ndarray  # int32 indices into `cities`.
+    country: np.ndarray  # int32 indices into `countries`.
+    continent: np.ndarray  # int32 indices into `continents`.
+    cities: np.ndarray
+    countries: np.ndarray
+    continents: np.ndarray
+
+    _COLUMNS = ("latitude", "longitude", "city", "country", "continent", "cities", "countries", "continents")
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    # Returns the location of the i-th peer.
+    def location(self, i: int) -> SimpleNamespace:
+        return SimpleNamespace(
+            latitude=float(self.latitude[i]),
+            longitude=float(self.longitude[i]),
+            city=str(self.cities[self.city[i]]),
+            country=str(self.countries[self.country[i]]),
+        )
+
+    # Parses a JSON array of peers, as exported from the Lotus network crawler.
+    @staticmethod
+    def from_json(path: str) -> GeoDataset:
+        with open(path) as f:
+            data = json.load(f)
+
+        tables: dict[str, dict[str, int]] = {"city": {}, "country": {}, "continent": {}}
+
+        def intern(column: str, peer: dict) -> int:
+            table = tables[column]
+            return table.setdefault(peer.get(column) or "", len(table))
+
+        return GeoDataset(
+            latitude=np.array([float(peer['latitude']) for peer in data], dtype=np.float32),
+            longitude=np.array([float(peer['longitude']) for peer in data], dtype=np.float32),
+            city=np.array([intern("city", peer) for peer in data], dtype=np.int32),
+            country=np.array([intern("country", peer) for peer in data], dtype=np.int32),
+            continent=np.array([intern("continent", peer) for peer in data], dtype=np.int32),
+            cities=np.array(list(tables["city"]), dtype=str),
+            countries=np.array(list(tables["country"]), dtype=str),
+            continents=np.array(list(tables["continent"]), dtype=str),
+        )
+
+    # Memory-maps a dataset written by `save`.
+    @staticmethod
+    def from_directory(path: str) -> GeoDataset:
+        return GeoDataset(**{
+            column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r') for column in GeoDataset._COLUMNS
+        })
+
+    # Writes the dataset as a directory with one .npy file per column, with the hash of the JSON file it was converted
+    # from, if any.
+    def save(self, path: str, source: Optional[str] = None):
+        os.makedirs(path, exist_ok=True)
+        for column in self._COLUMNS:
+            np.save(os.path.join(path, f"{column}.npy"), getattr(self, column))
+        if source is not None:
+            with open(os.path.join(path, SOURCE_HASH), "w") as f:
+                f.write(file_hash(source))
+
+
+# The file of a binary dataset holding the hash of the JSON file it was converted from.
+SOURCE_HASH = "source.sha256"
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# Returns the path of the binary dataset converted from the given JSON file.
+def binary_path(json_path: str) -> str:
+    return os.path.splitext(json_path)[0]
+
+
+# Returns the path of the dataset that `load` reads for a path: a binary dataset directory as is, and for a JSON file,
+# the binary dataset converted from it if it exists and was converted from the current content of the file, otherwise
+# the JSON file.
+def resolve(path: str) -> str:
+    directory = binary_path(path)
+    if os.path.isdir(path) or not os.path.isdir(directory):
+        return path
+    try:
+        with open(os.path.join(directory, SOURCE_HASH)) as f:
+            source_hash = f.read().strip()
+    except FileNotFoundError:
+        source_hash = None
+    if not os.path.isfile(path) or source_hash == file_hash(path):
+        return directory
+    logging.warning(f"The binary dataset {directory} was not converted from the current {path}, parsing JSON "
+                    f"(convert it again with geodata.py)")
+    return path
+
+
+# Loads a geographical dataset (see `resolve`). A binary dataset directory is memory-mapped.
+def load(path: str) -> GeoDataset:
+    path = resolve(path)
+    if os.path.isdir(path):
+        return GeoDataset.from_directory(path)
+    logging.info(f"No up-to-date binary dataset found for {path}, parsing JSON")
+    return GeoDataset.from_json(path)
+
+
+# Places the nodes of a group at peers of a dataset, drawn from the "node_placement" stream of the random streams
+# (or of new streams with the given seed): models placing nodes this way place them identically for the same seed.
+# Returns the dataset and the index of the peer of each node. Unless `quiet`, the location of each node is logged.
+def place_nodes(path: str, group: list[int], random_streams: Optional[RandomStreams] = None,
+                seed: Optional[int] = None, quiet: bool = False) -> tuple[GeoDataset, np.ndarray]:
+    population = load(path)
+    random_streams = random_streams or RandomStreams(seed)
+    peers = random_streams.generator("node_placement").integers(len(population), size=len(group)).astype(np.int32)
+    if not quiet:
+        for (node_id, peer) in zip(group, peers):
+            location = population.location(peer)
+            logging.info(f"Node {node_id} is located in {location.city}, {location.country}")
+    return (population, peers)
+
+
+# Converts a JSON dataset to the binary format.
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json_path", type=str, help="JSON dataset to convert")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="output directory (default: the JSON path without its extension)")
+    args = parser.parse_args()
+
+    output = args.output or binary_path(args.json_path)
+    dataset = GeoDataset.from_json(args.json_path)
+    dataset.save(output, source=args.json_path)
+    logging.info(f"Converted {len(dataset)} peers from {args.json_path} to {output}")
+
+
+if __name__ == "__main__":
+    main()
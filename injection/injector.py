@@ -2,8 +2,12 @@ from __future__ import annotations
 import inspect
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+import io
 import logging
-from typing import Any, Optional, Callable, Type, get_type_hints, Iterable
+import multiprocessing
+import pickle
+import types
+from typing import Any, Optional, Callable, Type, get_type_hints, Iterable, Union, get_origin, get_args
 
 from core import NodeId
 from injection import Factory, Scope
@@ -40,14 +44,24 @@ class Binding:
     instance: Any = ABSENT
 
 
+# How to call a constructor, compiled once from its signature.
+@dataclass
+class ResolutionPlan:
+    # The parameters to inject, as (parameter name, type to get from the injector), in order.
+    parameters: list[tuple[str, Type]]
+    return_type: Any  # The return annotation of the constructor.
+
+
 class Injector:
-    def __init__(self, args, modules: Iterable[Type[AbstractModule]]):
+    def __init__(self, args=None, modules: Iterable[Type[AbstractModule]] = ()):
         self._bindings_by_type: dict[Type, Binding] = {
             Injector: Binding(Injector, constructor=lambda: self,
                               scope=Scope.SINGLETON, instance=self)
         }
         self._bindings_with_node_scope: list[Binding] = []
         self._current_node_scope: Optional[NodeId] = None
+        # The resolution plans of the constructors, which depend on the bindings: cleared when a binding is added.
+        self._plans: dict[Callable[..., Any], ResolutionPlan] = {}
 
         for module in modules:
             module(args).configure(self)
@@ -65,6 +79,7 @@ class Injector:
 
         binding = Binding(object_type, constructor, scope)
         self._bindings_by_type[object_type] = binding
+        self._plans.clear()
         if scope == Scope.NODE:
             self._bindings_with_node_scope.append(binding)
 
@@ -74,6 +89,7 @@ class Injector:
                 f"Type {object_type} already has a binding: {self._bindings_by_type[object_type]}.")
         self._bindings_by_type[object_type] = Binding(object_type, None,
                                                       Scope.SINGLETON, instance)
+        self._plans.clear()
 
     @staticmethod
     def _is_factory(object_type: Type) -> bool:
@@ -82,42 +98,41 @@ class Injector:
     def _has_binding(self, object_type: Type) -> bool:
         return object_type in self._bindings_by_type
 
+    # Returns X for the type Optional[X], None for other types.
+    @staticmethod
+    def _optional_type(object_type: Type) -> Optional[Type]:
+        if get_origin(object_type) in (Union, types.UnionType):
+            args = [arg for arg in get_args(object_type) if arg is not type(None)]
+            if len(args) == 1 and len(get_args(object_type)) == 2:
+                return args[0]
+        return None
+
     @staticmethod
     def _has_default(parameter: inspect.Parameter) -> bool:
         return parameter.default is not inspect.Parameter.empty
 
-    def _resolve_constructor(self, object_type: Type) -> Callable[..., Any]:
-        logging.debug(f"Resolving constructor for {object_type}")
+    # Returns the binding of a type, if any, checking that it can be used in the current scope.
+    def _resolve_binding(self, object_type: Type) -> Optional[Binding]:
         binding = self._bindings_by_type.get(object_type, None)
+        if binding is not None and binding.scope is Scope.NODE and self._current_node_scope is None:
+            raise Exception(
+                f"Cannot get an object with a node-scoped binding outside of a node scope")
+        return binding
 
-        if binding:
-            logging.debug(f"Found binding: {object_type} -> {binding}.")
-            if binding.scope is Scope.NODE and self._current_node_scope is None:
-                raise Exception(
-                    f"Cannot get an object with a node-scoped binding outside of a node scope")
-
-            if binding.instance is not ABSENT:
-                logging.debug(f"Binding has an instance: {binding.instance}.")
-                return lambda: binding.instance
-
-            logging.debug(
-                f"Binding has no instance, returning constructor: {binding.constructor}")
-            return binding.constructor
-
-        logging.debug(
-            f"No binding found for {object_type}. Using the type itself as a constructor")
-        return object_type
+    # Returns the resolution plan of a constructor, compiling it on first use.
+    def _plan(self, constructor: Callable[..., Any]) -> ResolutionPlan:
+        plan = self._plans.get(constructor)
+        if plan is None:
+            plan = self._plans[constructor] = self._compile_plan(constructor)
+        return plan
 
-    def _resolve_parameters(self, constructor: Callable[..., Any]) -> dict[str, Any]:
+    def _compile_plan(self, constructor: Callable[..., Any]) -> ResolutionPlan:
         signature = inspect.signature(constructor)
-        if not signature.parameters:
-            return {}
-
-        logging.debug(
-            f"Resolving parameters for constructor {constructor} with signature {signature}")
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(f"Compiling resolution plan for constructor {constructor} with signature {signature}")
 
-        # Resolve the constructor's parameters
-        constructor_arguments = {}
+        type_hints = None
+        parameters = []
         for parameter in signature.parameters.values():
             if parameter.annotation is inspect.Parameter.empty:
                 raise Exception(f"Cannot construct an object with an unannotated parameter: {parameter.name}")
@@ -125,51 +140,60 @@ class Injector:
             # Get the parameter's type
             parameter_type = parameter.annotation
             if type(parameter_type) is str:
-                parameter_type = get_type_hints(constructor, include_extras=True)[parameter.name]
+                if type_hints is None:
+                    type_hints = get_type_hints(constructor, include_extras=True)
+                parameter_type = type_hints[parameter.name]
 
             if self._has_binding(parameter_type) or self._is_factory(parameter_type):
-                parameter_value = self.get(parameter_type)
-                constructor_arguments[parameter.name] = parameter_value
+                parameters.append((parameter.name, parameter_type))
+            elif self._has_binding(self._optional_type(parameter_type)):
+                # An Optional[X] parameter receives the X binding, if any.
+                parameters.append((parameter.name, self._optional_type(parameter_type)))
 
-        logging.debug(
-            f"Resolved constructor arguments: {constructor_arguments}.")
-        return constructor_arguments
+        return ResolutionPlan(parameters, signature.return_annotation)
 
-    def _construct_instance(self, object_type: Type) -> Any:
-        logging.debug(f"Constructing instance of type {object_type}")
-        constructor = self._resolve_constructor(object_type)
-        constructor_arguments = self._resolve_parameters(constructor)
-        return constructor(**constructor_arguments)
+    def _resolve_parameters(self, constructor: Callable[..., Any]) -> dict[str, Any]:
+        return {name: self.get(parameter_type) for (name, parameter_type) in self._plan(constructor).parameters}
 
     def _construct_factory(self, factory_type: Type) -> Any:
-        logging.debug(f"Constructing factory of type {factory_type}")
         underlying_type = factory_type.__args__[0]
-        constructor = self._resolve_constructor(underlying_type)
-        signature = inspect.signature(constructor)
-        return_type = signature.return_annotation
-        assert return_type is not inspect.Parameter.empty
+        binding = self._resolve_binding(underlying_type)
+        if binding is None:
+            constructor = underlying_type
+        elif binding.instance is not ABSENT:
+            constructor = lambda: binding.instance
+        else:
+            constructor = binding.constructor
+        plan = self._plan(constructor)
+        assert plan.return_type is not inspect.Parameter.empty
         default_args = self._resolve_parameters(constructor)
-        factory = Factory[constructor](constructor, default_args)
-        logging.debug(f"Constructed factory: {factory}")
-        return factory
-
-    def _save_instance(self, object_type: Type, instance: Any) -> None:
-        binding = self._bindings_by_type.get(object_type, None)
+        return Factory[constructor](constructor, default_args)
 
+    def _save_instance(self, binding: Optional[Binding], instance: Any) -> None:
         if binding and binding.scope is not Scope.UNSCOPED:
             if binding.scope is Scope.NODE:
                 assert self._current_node_scope is not None, "Cannot save a node-scoped object outside of a node"
-                self._bindings_with_node_scope.append(binding)
             binding.instance = instance
 
+    # Returns the bindings, in the order in which they were added.
+    def bindings(self) -> list[Binding]:
+        return list(self._bindings_by_type.values())
+
     def get(self, object_type: Type) -> Any:
-        logging.debug(f"Calling Injector#get for object type {object_type}")
         if self._is_factory(object_type):
             return self._construct_factory(object_type)
+
+        binding = self._resolve_binding(object_type)
+        if binding is None:
+            # No binding: use the type itself as a constructor.
+            constructor = object_type
+        elif binding.instance is not ABSENT:
+            return binding.instance
         else:
-            instance = self._construct_instance(object_type)
-            self._save_instance(object_type, instance)
-            return instance
+            constructor = binding.constructor
+        instance = constructor(**self._resolve_parameters(constructor))
+        self._save_instance(binding, instance)
+        return instance
 
     def enter_node_scope(self, node_id: NodeId) -> None:
         self._current_node_scope = node_id
@@ -180,3 +204,100 @@ class Injector:
         self._current_node_scope = None
         for binding in self._bindings_with_node_scope:
             binding.instance = ABSENT
+
+    # Gets an object of the given type in the scope of each node, in order.
+    # With several workers, the objects of all the nodes but the first are built in forked worker processes, which
+    # send them back pickled. The singletons that exist once the first node is built are shared: they are pickled
+    # by reference and resolved to the parent's instances. The objects must thus be picklable, and must not create
+    # new singletons or have side effects on the existing ones.
+    def instantiate_per_node(self, object_type: Type, node_ids: Iterable[NodeId], workers: int = 1) -> list[Any]:
+        node_ids = list(node_ids)
+        if workers <= 1 or len(node_ids) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            return self._instantiate_per_node(object_type, node_ids)
+
+        objects = self._instantiate_per_node(object_type, node_ids[:1])
+        singletons = [binding.instance for binding in self._bindings_by_type.values()
+                      if binding.scope is Scope.SINGLETON and binding.instance is not ABSENT]
+        chunk_size = -(-(len(node_ids) - 1) // workers)
+        chunks = [node_ids[start:start + chunk_size] for start in range(1, len(node_ids), chunk_size)]
+
+        context = multiprocessing.get_context("fork")
+        connections, processes = [], []
+        for chunk in chunks:
+            (connection, worker_connection) = context.Pipe(duplex=False)
+            process = context.Process(target=self._instantiate_in_worker,
+                                      args=(object_type, chunk, singletons, worker_connection), daemon=True)
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        try:
+            for connection in connections:
+                objects.extend(_SingletonUnpickler(io.BytesIO(connection.recv_bytes()), singletons).load())
+        except BaseException:
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            for process in processes:
+                process.join()
+        return objects
+
+    def _instantiate_per_node(self, object_type: Type, node_ids: list[NodeId]) -> list[Any]:
+        objects = []
+        for node_id in node_ids:
+            self.enter_node_scope(node_id)
+            objects.append(self.get(object_type))
+            self.exit_node_scope()
+        return objects
+
+    # Builds the objects of a chunk of nodes in a worker process and sends them back pickled, or sends the exception
+    # raised while building them.
+    def _instantiate_in_worker(self, object_type: Type, node_ids: list[NodeId], singletons: list[Any],
+                               connection) -> None:
+        try:
+            absent = [binding for binding in self._bindings_by_type.values()
+                      if binding.scope is Scope.SINGLETON and binding.instance is ABSENT]
+            objects = self._instantiate_per_node(object_type, node_ids)
+            created = [binding.object_type for binding in absent if binding.instance is not ABSENT]
+            if created:
+                raise Exception(f"Cannot create singletons in a worker process: {created}")
+            buffer = io.BytesIO()
+            _SingletonPickler(buffer, singletons).dump(objects)
+            data = buffer.getvalue()
+        except BaseException as e:
+            data = pickle.dumps(_WorkerError(e))
+        connection.send_bytes(data)
+        connection.close()
+
+
+# The exception raised in a worker process while instantiating objects.
+@dataclass
+class _WorkerError:
+    exception: BaseException
+
+
+# Pickles the given singletons by reference, as their index.
+class _SingletonPickler(pickle.Pickler):
+    def __init__(self, file, singletons: list[Any]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._indices = {id(singleton): i for (i, singleton) in enumerate(singletons)}
+
+    def persistent_id(self, obj: Any) -> Optional[int]:
+        return self._indices.get(id(obj))
+
+
+class _SingletonUnpickler(pickle.Unpickler):
+    def __init__(self, file, singletons: list[Any]):
+        super().__init__(file)
+        self._singletons = singletons
+
+    def persistent_load(self, index: int) -> Any:
+        return self._singletons[index]
+
+    def load(self) -> Any:
+        result = super().load()
+        if isinstance(result, _WorkerError):
+            raise result.exception
+        return result
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+from dataclasses import dataclass
+from typing import Annotated, Callable, Optional
+
+import numpy as np
+
+import geodata
+from core import EventQueue, Group, LatencyModel, Message, NodeId, haversine_km, payload_size
+from randomness import RandomStreams
+
+# Latency models beyond the distance-based GeoLatencyModel.
+# Random draws come from per-node streams and are drawn in blocks, so that the latencies of the messages sent by a
+# node only depend on the messages this node sent before: a parallel simulation (see pdes.py) draws the same
+# latencies as a sequential one.
+
+
+# Samplers of jitter with a mean of 1, by name.
+JITTER_DISTRIBUTIONS: dict[str, Callable[[np.random.Generator, int], np.ndarray]] = {
+    "exponential": lambda rng, size: rng.standard_exponential(size),
+    "lognormal": lambda rng, size: rng.lognormal(-0.125, 0.5, size),
+    "uniform": lambda rng, size: rng.uniform(0, 2, size),
+}
+
+
+# Blocks of random draws of a sampler, one per node.
+# The first blocks of all the nodes are drawn at once, as the rows of a matrix, since creating a generator per node
+# costs more than drawing a block. The following blocks of a node are drawn from its own stream.
+class _Blocks:
+    # The maximal number of draws of the first blocks.
+    _INITIAL_DRAWS = 1 << 20
+
+    def __init__(self, random_streams: RandomStreams, name: str, sampler: Callable[[np.random.Generator, int],
+                 np.ndarray], block_size: int, group: Group):
+        self._random_streams = random_streams
+        self._name = name
+        self._sampler = sampler
+        self._block_size = block_size
+        self._generators: dict[NodeId, np.random.Generator] = {}
+        initial_size = max(1, min(block_size, self._INITIAL_DRAWS // max(len(group), 1)))
+        initial = sampler(random_streams.generator(name), (len(group), initial_size))
+        self._blocks: dict[NodeId, np.ndarray] = dict(zip(group, initial))
+        self._positions: dict[NodeId, int] = {}
+
+    # Returns the next `count` draws of a node.
+    def take(self, node_id: NodeId, count: int) -> np.ndarray:
+        block = self._blocks.get(node_id)
+        position = self._positions.get(node_id, 0)
+        if block is None or position + count > len(block):
+            generator = self._generators.get(node_id)
+            if generator is None:
+                generator = self._generators[node_id] = self._random_streams.generator(self._name, node_id)
+            fresh = self._sampler(generator, max(self._block_size, count))
+            block = self._blocks[node_id] = fresh if block is None else np.concatenate([block[position:], fresh])
+            position = 0
+        self._positions[node_id] = position + count
+        return block[position:position + count]
+
+    # Returns the next draw of a node.
+    def next(self, node_id: NodeId) -> float:
+        block = self._blocks.get(node_id)
+        position = self._positions.get(node_id, 0)
+        if block is None or position == len(block):
+            return float(self.take(node_id, 1)[0])
+        self._positions[node_id] = position + 1
+        return float(block[position])
+
+
+# Adds random jitter to the latencies of another model.
+# The jitter of a link is proportional to its base latency: `ratio` times a draw of the distribution, whose mean is 1.
+# The base latencies are thus lower bounds of the latencies.
+@dataclass
+class JitterLatencyModel(LatencyModel):
+    latency_model: Annotated[LatencyModel, 'base']
+    group: Group
+    random_streams: RandomStreams
+    ratio: Annotated[float, 'jitter'] = 0.1
+    distribution: Annotated[str, 'jitter_distribution'] = "exponential"
+    block_size: int = 256  # The number of draws per block, per node.
+
+    def __post_init__(self):
+        self._jitter = _Blocks(self.random_streams, "latency_jitter", JITTER_DISTRIBUTIONS[self.distribution],
+                               self.block_size, self.group)
+
+    def get_latency(self, src: NodeId, dst: NodeId) -> float:
+        return self.latency_model.get_latency(src, dst) * (1 + self.ratio * self._jitter.next(src))
+
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return self.latency_model.get_latencies(src, dsts) * (1 + self.ratio * self._jitter.take(src, len(dsts)))
+
+    def get_message_latency(self, msg: Message, dst: NodeId) -> float:
+        return self.latency_model.get_message_latency(msg, dst) * (1 + self.ratio * self._jitter.next(msg.sender))
+
+    def get_message_latencies(self, msg: Message, dsts: list[NodeId]) -> np.ndarray:
+        jitter = self._jitter.take(msg.sender, len(dsts))
+        return self.latency_model.get_message_latencies(msg, dsts) * (1 + self.ratio * jitter)
+
+    def get_min_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return self.latency_model.get_min_latencies(src, dsts)
+
+
+# Adds the transmission of the messages over the uplink of their sender to the latencies of another model.
+# A node transmits its messages one at a time, at the bandwidth of its uplink: a message waits for the transmission
+# of the messages sent before it, then takes its payload size over the bandwidth to transmit. The copies of a
+# broadcast message are transmitted in turn. The bandwidths of the nodes are log-normally distributed around
+# `uplink_mbps`, with the given spread (the standard deviation of their logarithm).
+@dataclass
+class BandwidthLatencyModel(LatencyModel):
+    latency_model: Annotated[LatencyModel, 'base']
+    event_queue: EventQueue
+    group: Group
+    random_streams: RandomStreams
+    uplink_mbps: Annotated[float, 'uplink_mbps'] = 100.0
+    spread: Annotated[float, 'uplink_spread'] = 0.0
+
+    def __post_init__(self):
+        bandwidths = self.uplink_mbps * self.random_streams.generator("uplink_bandwidth").lognormal(
+            0, self.spread, len(self.group)) if self.spread else np.full(len(self.group), self.uplink_mbps)
+        # The transmission time of a byte, in ms, for each node.
+        self._ms_per_byte = {node_id: 8 / (float(mbps) * 1e3) for (node_id, mbps) in zip(self.group, bandwidths)}
+        # The instant at which the uplink of each node is free.
+        self._free_at: dict[NodeId, float] = {}
+
+    # Returns the instants, relative to now, at which the uplink of a node finishes transmitting `count` copies of a
+    # payload of `size` bytes sent now.
+    def _transmit(self, src: NodeId, size: int, count: int) -> np.ndarray | float:
+        now = self.event_queue.clock
+        start = max(now, self._free_at.get(src, now))
+        duration = size * self._ms_per_byte[src]
+        if count == 1:
+            self._free_at[src] = end = start + duration
+            return end - now
+        ends = start + duration * np.arange(1, count + 1)
+        self._free_at[src] = float(ends[-1]) if count else start
+        return ends - now
+
+    def get_latency(self, src: NodeId, dst: NodeId) -> float:
+        return self.latency_model.get_latency(src, dst) + self._transmit(src, 0, 1)
+
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return self.latency_model.get_latencies(src, dsts) + self._transmit(src, 0, len(dsts))
+
+    def get_message_latency(self, msg: Message, dst: NodeId) -> float:
+        transmission = self._transmit(msg.sender, payload_size(msg.payload), 1)
+        return self.latency_model.get_message_latency(msg, dst) + transmission
+
+    def get_message_latencies(self, msg: Message, dsts: list[NodeId]) -> np.ndarray:
+        transmission = self._transmit(msg.sender, payload_size(msg.payload), len(dsts))
+        return self.latency_model.get_message_latencies(msg, dsts) + transmission
+
+    def get_min_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        return self.latency_model.get_min_latencies(src, dsts)
+
+
+# Latencies from tables of round-trip times between countries and between continents.
+# Nodes are placed like in GeoLatencyModel (the same seed gives the same placement). The latency between two nodes is
+# half the round-trip time between their countries if the table has it, between their continents otherwise, and the
+# default round-trip time for the pairs of continents not in the table. The continent of the peers without one is the
+# most frequent continent of their country in the dataset. See resources/rtt_tables.json for the format.
+@dataclass
+class ContinentLatencyModel(LatencyModel):
+    group: Group
+    geo_data_file_path: str = "resources/lotus_geo_20231105.json"
+    rtt_tables_file_path: Annotated[str, 'rtt_tables'] = "resources/rtt_tables.json"
+    seed: Annotated[Optional[int], 'seed'] = None
+    random_streams: Optional[RandomStreams] = None
+
+    def __post_init__(self):
+        (population, peers) = geodata.place_nodes(self.geo_data_file_path, self.group, self.random_streams, self.seed)
+        with open(self.rtt_tables_file_path) as f:
+            tables = json.load(f)
+
+        # Latencies between continents, with the default for unknown pairs.
+        continents = list(population.continents)
+        self._continent_latencies = np.full((len(continents), len(continents)), tables["default"] / 2)
+        self._fill(self._continent_latencies, continents, tables["continents"])
+        # Latencies between countries, NaN for the pairs not in the table.
+        countries = list(population.countries)
+        self._country_latencies = np.full((len(countries), len(countries)), np.nan)
+        self._fill(self._country_latencies, countries, tables.get("countries", {}))
+
+        self._index = {node_id: i for (i, node_id) in enumerate(self.group)}
+        self._continents = np.asarray(population.continent[peers], dtype=np.intp)
+        self._countries = np.asarray(population.country[peers], dtype=np.intp)
+        # Peers of unknown continent are on the most frequent continent of the peers of their country.
+        if "" in continents:
+            unknown = continents.index("")
+            counts = np.zeros((len(countries), len(continents)), dtype=np.int64)
+            np.add.at(counts, (np.asarray(population.country), np.asarray(population.continent)), 1)
+            counts[:, unknown] = 0
+            by_country = np.where(counts.any(axis=1), counts.argmax(axis=1), unknown)
+            missing = self._continents == unknown
+            self._continents[missing] = by_country[self._countries[missing]]
+        self._node_locations = {node_id: population.location(peer) for (node_id, peer) in zip(self.group, peers)}
+
+    # Fills a symmetric matrix of latencies from a table of round-trip times keyed by names.
+    @staticmethod
+    def _fill(latencies: np.ndarray, names: list[str], rtts: dict[str, dict[str, float]]):
+        index = {name: i for (i, name) in enumerate(names)}
+        for (a, row) in rtts.items():
+            for (b, rtt) in row.items():
+                if a in index and b in index:
+                    latencies[index[a], index[b]] = latencies[index[b], index[a]] = rtt / 2
+
+    def get_location(self, node_id: NodeId):
+        return self._node_locations[node_id]
+
+    def get_latency(self, src: NodeId, dst: NodeId) -> float:
+        if src == dst:
+            return 0.0
+        (i, j) = (self._index[src], self._index[dst])
+        latency = self._country_latencies[self._countries[i], self._countries[j]]
+        if latency != latency:
+            latency = self._continent_latencies[self._continents[i], self._continents[j]]
+        return float(latency)
+
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        i = self._index[src]
+        indices = np.fromiter(map(self._index.__getitem__, dsts), dtype=np.intp, count=len(dsts))
+        latencies = self._country_latencies[self._countries[i], self._countries[indices]]
+        unknown = np.isnan(latencies)
+        latencies[unknown] = self._continent_latencies[self._continents[i], self._continents[indices[unknown]]]
+        latencies[indices == i] = 0.0
+        return latencies
+
+
+# Kilometers per degree of latitude.
+_KM_PER_DEGREE = 2 * math.pi * 6371.0088 / 360
+
+
+# Distance-based latencies like GeoLatencyModel, stored by location instead of by node, for large groups.
+# Nodes are placed like in GeoLatencyModel (the same seed gives the same placement), on the distinct coordinates of
+# the dataset. The model holds the location of each node in a compact array and a table of the latencies between
+# the locations of the group, so that its memory is bounded by the size of the dataset rather than of the group.
+# With a resolution, locations are clustered in cells of about `resolution_km` by `resolution_km` placed at the mean
+# of their coordinates, shrinking the table further: nodes of the same cell have no latency between them.
+@dataclass
+class LocationLatencyModel(LatencyModel):
+    group: Group
+    geo_data_file_path: str = "resources/lotus_geo_20231105.json"
+    resolution_km: Annotated[float, 'location_resolution_km'] = 0.0
+    seed: Annotated[Optional[int], 'seed'] = None
+    random_streams: Optional[RandomStreams] = None
+
+    def __post_init__(self):
+        # The peer of each node, from which its location is described.
+        (self._population, self._peers) = geodata.place_nodes(self.geo_data_file_path, self.group,
+                                                              self.random_streams, self.seed, quiet=True)
+
+        latitudes = np.asarray(self._population.latitude, dtype=np.float64)
+        longitudes = np.asarray(self._population.longitude, dtype=np.float64)
+        if self.resolution_km > 0:
+            cell_degrees = self.resolution_km / _KM_PER_DEGREE
+            rows = np.floor(latitudes / cell_degrees)
+            columns = np.floor(longitudes * np.cos(np.radians((rows + 0.5) * cell_degrees)) / cell_degrees)
+            keys = np.stack([rows, columns], axis=1)
+        else:
+            keys = np.stack([latitudes, longitudes], axis=1)
+        # The location of each peer of the dataset, then of each node among the locations of the group.
+        (_, peer_locations) = np.unique(keys, axis=0, return_inverse=True)
+        (used, node_locations) = np.unique(peer_locations.ravel()[self._peers], return_inverse=True)
+        dtype = np.int16 if len(used) <= np.iinfo(np.int16).max else np.int32
+        self._locations = node_locations.astype(dtype)
+
+        # The coordinates of each location of the group: the mean of the coordinates of its peers.
+        members = np.flatnonzero(np.isin(peer_locations.ravel(), used))
+        clusters = np.searchsorted(used, peer_locations.ravel()[members])
+        counts = np.bincount(clusters, minlength=len(used))
+        location_latitudes = np.radians(np.bincount(clusters, latitudes[members], len(used)) / counts)
+        location_longitudes = np.radians(np.bincount(clusters, longitudes[members], len(used)) / counts)
+        self._latencies = haversine_km(location_latitudes[:, np.newaxis], location_longitudes[:, np.newaxis],
+                                       location_latitudes, location_longitudes) / 200 * 1.5
+        self._latencies = self._latencies.astype(np.float32)  # The precision of GeoLatencyModel.
+        np.fill_diagonal(self._latencies, 0.0)
+
+        self._ids_are_indices = all(node_id == i for (i, node_id) in enumerate(self.group))
+        # The index of each node, unless node ids are their own indices.
+        if not self._ids_are_indices:
+            self._index = {node_id: i for (i, node_id) in enumerate(self.group)}
+        logging.info(f"{len(self.group)} nodes placed at {len(used)} locations")
+
+    def _location_indices(self, node_ids: list[NodeId]) -> np.ndarray:
+        if self._ids_are_indices:
+            return self._locations[np.asarray(node_ids, dtype=np.intp)]
+        return self._locations[np.fromiter(map(self._index.__getitem__, node_ids), dtype=np.intp,
+                                           count=len(node_ids))]
+
+    def _node_index(self, node_id: NodeId) -> int:
+        return node_id if self._ids_are_indices else self._index[node_id]
+
+    def get_location(self, node_id: NodeId):
+        return self._population.location(self._peers[self._node_index(node_id)])
+
+    def get_latency(self, src: NodeId, dst: NodeId) -> float:
+        locations = self._locations
+        if self._ids_are_indices:
+            return float(self._latencies[locations[src], locations[dst]])
+        return float(self._latencies[locations[self._index[src]], locations[self._index[dst]]])
+
+    def get_latencies(self, src: NodeId, dsts: list[NodeId]) -> np.ndarray:
+        row = self._latencies[self._locations[self._node_index(src)]]
+        return row[self._location_indices(dsts)]
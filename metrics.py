@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import json
+import math
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import numpy as np
+
+# Streaming metrics of a simulation, in constant memory whatever the length of the run: histograms of the latencies
+# of the messages, overall, by path and by class of pair of nodes, and time series of the messages sent and delivered
+# per second and of the depth of the event queue.
+#
+# The network reports the messages it sends with their latencies, the dispatchers report the messages they deliver
+# and the simulator reports the depth of the event queue at each instant. A message counts in the latency histograms
+# when it is sent.
+
+# The classes of pairs of nodes, by their locations.
+PAIR_CLASSES = ("same city", "same country", "international")
+
+
+# A histogram of non-negative values with a bounded relative error, as in HdrHistogram.
+# Values are counted in units of `resolution`. Up to 2**precision units, each unit has its own bucket; above, each
+# power of two is split into 2**(precision-1) buckets, so that the buckets are at most 2**-(precision-1) wide
+# relative to their values. Values above 2**(precision+octaves) units (over an hour by default) count in the last
+# bucket. The count, sum, minimum and maximum are exact.
+# Only the buckets between the lowest and highest values recorded are allocated: latencies spanning a few octaves,
+# such as those of a path, take a few hundred buckets.
+@dataclass
+class Histogram:
+    resolution: float = 1e-3
+    precision: int = 8
+    octaves: int = 24
+
+    # The minimal number of buckets added when the allocated range grows.
+    _GROWTH = 64
+
+    def __post_init__(self):
+        self._size = self.octaves * (1 << (self.precision - 1)) + (1 << self.precision)
+        # The counts of the allocated buckets, from the bucket `_offset` on.
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._offset = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._max_units = (1 << (self.precision + self.octaves)) - 1
+
+    # The counts of all the buckets.
+    @property
+    def counts(self) -> np.ndarray:
+        counts = np.zeros(self._size, dtype=np.int64)
+        counts[self._offset:self._offset + len(self._counts)] = self._counts
+        return counts
+
+    def _index(self, value: float) -> int:
+        units = min(int(value / self.resolution), self._max_units) if value > 0 else 0
+        shift = max(units.bit_length() - self.precision, 0)
+        return (shift << (self.precision - 1)) + (units >> shift)
+
+    # Allocates the buckets from `low` to `high`, included.
+    def _allocate(self, low: int, high: int):
+        (offset, end) = (self._offset, self._offset + len(self._counts))
+        if not len(self._counts):
+            (offset, end) = (low, low)
+        if low >= offset and high < end:
+            return
+        if low < offset:
+            low = max(min(low, offset - self._GROWTH), 0)
+        else:
+            low = offset
+        high = min(max(high + 1, end + self._GROWTH), self._size) if high >= end else end
+        counts = np.zeros(high - low, dtype=np.int64)
+        counts[self._offset - low:self._offset - low + len(self._counts)] = self._counts
+        (self._counts, self._offset) = (counts, low)
+
+    def record(self, value: float):
+        index = self._index(value)
+        position = index - self._offset
+        if position < 0 or position >= len(self._counts):
+            self._allocate(index, index)
+            position = index - self._offset
+        self._counts[position] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def record_many(self, values: np.ndarray):
+        if not len(values):
+            return
+        units = np.minimum(np.maximum(values, 0) / self.resolution, self._max_units).astype(np.int64)
+        shifts = np.maximum(np.frexp(units)[1] - self.precision, 0)
+        indices = (shifts << (self.precision - 1)) + (units >> shifts)
+        self._allocate(int(indices.min()), int(indices.max()))
+        np.add.at(self._counts, indices - self._offset, 1)
+        self.count += len(values)
+        self.sum += float(np.sum(values))
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+    # Adds the values of another histogram with the same parameters.
+    def merge(self, other: Histogram):
+        if other.count:
+            self._allocate(other._offset, other._offset + len(other._counts) - 1)
+            start = other._offset - self._offset
+            self._counts[start:start + len(other._counts)] += other._counts
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    # Returns the highest value equivalent to the given percentile: the upper bound of its bucket.
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        index = self._offset + int(np.searchsorted(np.cumsum(self._counts), rank))
+        half = 1 << (self.precision - 1)
+        shift = 0 if index < 2 * half else (index - 2 * half) // half + 1
+        upper = (((index - (shift << (self.precision - 1))) + 1) << shift) * self.resolution
+        return min(max(upper, self.min), self.max)
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+    def summary(self) -> dict[str, Any]:
+        return {"count": self.count, "mean": self.mean(), "min": self.min if self.count else math.nan,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99),
+                "max": self.max if self.count else math.nan}
+
+
+# A series of values over simulated time, in bins of `bin_ms`, summed or maximized within each bin.
+# When the series reaches `max_bins` bins, adjacent bins are merged, doubling their width.
+@dataclass
+class TimeSeries:
+    bin_ms: float = 1000.0
+    max_bins: int = 1024
+    maximum: bool = False  # If the bins hold the maximal value instead of the sum.
+
+    def __post_init__(self):
+        if self.max_bins % 2:
+            raise ValueError("The number of bins must be even")
+        self.values = np.zeros(self.max_bins)
+        self.length = 0
+
+    def add(self, instant: float, value: float):
+        i = int(instant // self.bin_ms)
+        while i >= self.max_bins:
+            self._coalesce()
+            i = int(instant // self.bin_ms)
+        if self.maximum:
+            self.values[i] = max(self.values[i], value)
+        else:
+            self.values[i] += value
+        self.length = max(self.length, i + 1)
+
+    def _coalesce(self):
+        pairs = self.values.reshape(-1, 2)
+        merged = pairs.max(axis=1) if self.maximum else pairs.sum(axis=1)
+        self.values[:len(merged)] = merged
+        self.values[len(merged):] = 0
+        self.length = (self.length + 1) // 2
+        self.bin_ms *= 2
+
+    # Returns the values per second of simulated time, for summed series.
+    def rates(self) -> list[float]:
+        return (self.values[:self.length] * (1000 / self.bin_ms)).tolist()
+
+    def summary(self) -> dict[str, Any]:
+        values = self.values[:self.length].tolist() if self.maximum else self.rates()
+        return {"bin_ms": self.bin_ms, "values": values}
+
+
+@dataclass
+class Metrics:
+    # The locations of the nodes, by node id, which classify the pairs of nodes. Without them, pairs are unclassified.
+    locations: Optional[list[Any]] = None
+    output: Optional[str] = None  # The JSON lines file to which the metrics are exported.
+    interval: Optional[float] = None  # The period, in simulated ms, at which the metrics are exported.
+    latency: Histogram = field(default_factory=Histogram)
+    sent: TimeSeries = field(default_factory=TimeSeries)
+    delivered: TimeSeries = field(default_factory=TimeSeries)
+    queue_depth: TimeSeries = field(default_factory=lambda: TimeSeries(maximum=True))
+
+    def __post_init__(self):
+        # The instant of the current deliveries.
+        self.now = 0.0
+        self.latency_by_path: dict[int, Histogram] = {}
+        self.latency_by_class: dict[str, Histogram] = {}
+        self._next_export = self.interval or math.inf
+        if self.locations is not None:
+            self._cities = _codes([location.city for location in self.locations])
+            self._countries = _codes([location.country for location in self.locations])
+
+    # Records a message sent at an instant to a node, with its latency.
+    def send(self, instant: float, msg: Any, dst: int, latency: float):
+        self.latency.record(latency)
+        self._histogram(self.latency_by_path, msg.path.id).record(latency)
+        self._histogram(self.latency_by_class, self._pair_class(msg.sender, dst)).record(latency)
+        self.sent.add(instant, 1)
+
+    # Records a message sent at an instant to several nodes, with their latencies.
+    def send_many(self, instant: float, msg: Any, dsts: list[int], latencies: np.ndarray):
+        latencies = np.asarray(latencies, dtype=np.float64)
+        self.latency.record_many(latencies)
+        self._histogram(self.latency_by_path, msg.path.id).record_many(latencies)
+        if self.locations is None:
+            self._histogram(self.latency_by_class, "unclassified").record_many(latencies)
+        else:
+            dsts = np.asarray(dsts, dtype=np.intp)
+            classes = np.where(self._cities[dsts] == self._cities[msg.sender], 0,
+                               np.where(self._countries[dsts] == self._countries[msg.sender], 1, 2))
+            for (i, pair_class) in enumerate(PAIR_CLASSES):
+                self._histogram(self.latency_by_class, pair_class).record_many(latencies[classes == i])
+        self.sent.add(instant, len(dsts))
+
+    # Records a message delivered at the current instant.
+    def deliver(self, msg: Any):
+        self.delivered.add(self.now, 1)
+
+    # Starts the deliveries of an instant, with the depth of the event queue, and exports the metrics periodically.
+    def step(self, instant: float, queue_depth: int):
+        self.now = instant
+        self.queue_depth.add(instant, queue_depth)
+        if instant >= self._next_export:
+            self.export()
+            self._next_export = (instant // self.interval + 1) * self.interval
+
+    def _pair_class(self, src: int, dst: int) -> str:
+        if self.locations is None:
+            return "unclassified"
+        if self._cities[src] == self._cities[dst]:
+            return PAIR_CLASSES[0]
+        return PAIR_CLASSES[1] if self._countries[src] == self._countries[dst] else PAIR_CLASSES[2]
+
+    @staticmethod
+    def _histogram(histograms: dict[Any, Histogram], key: Any) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        return histogram
+
+    def summary(self) -> dict[str, Any]:
+        from core import Path
+
+        return {
+            "instant": self.now,
+            "latency": self.latency.summary(),
+            "latency_by_path": {str(Path.from_id(path_id)): histogram.summary()
+                                for (path_id, histogram) in self.latency_by_path.items()},
+            "latency_by_class": {pair_class: histogram.summary()
+                                 for (pair_class, histogram) in self.latency_by_class.items()},
+            "sent_per_s": self.sent.summary(),
+            "delivered_per_s": self.delivered.summary(),
+            "queue_depth": self.queue_depth.summary(),
+        }
+
+    # Appends the current metrics to the output file as a JSON line.
+    def export(self):
+        if self.output:
+            with open(self.output, "a") as f:
+                f.write(json.dumps(self.summary()) + "\n")
+
+
+# Returns the codes of the given values, equal for equal values.
+def _codes(values: list[str]) -> np.ndarray:
+    codes: dict[str, int] = {}
+    return np.array([codes.setdefault(value, len(codes)) for value in values], dtype=np.int32)
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import heapq
+import logging
+import math
+import multiprocessing
+import os
+from argparse import Namespace
+from multiprocessing.connection import Connection
+from operator import itemgetter
+from typing import Any, Optional, Type
+
+import numpy as np
+
+from core import Group, LatencyModel, Message, NodeId, Simulator
+from injection import Injector
+from injection.injector import AbstractModule
+from tracing import Tracer
+
+# Conservative parallel discrete-event simulation.
+#
+# The nodes are partitioned over worker processes, each of which builds the simulation of its own nodes and holds
+# their events. The simulation advances in windows (YAWNS): with M the earliest pending event over all the
+# partitions and L the lookahead, the minimal latency between nodes of different partitions, no message sent in
+# [M, M + L) can be delivered in another partition before M + L. The workers thus process their events up to M + L
+# independently, then exchange the messages for the other partitions before the next window.
+#
+# Events are ordered by instant and then by sequence numbers that only depend on the node that pushed them (see
+# EventQueue), so every node processes the same events in the same order as in a sequential simulation.
+
+
+# The keys of the summaries of simulations (see Simulator.summary).
+_SUMMARY_KEYS = ("events", "sim_time_ms", "backlog_held", "backlog_dropped", "backlog_spilled")
+
+
+# The size of the largest partition relative to the average, up to which partitions are grown to keep close nodes
+# together.
+PARTITION_IMBALANCE = 1.25
+
+# The lookahead relative to the median latency below which the windows hold too few events for a parallel simulation
+# to be faster than a sequential one: the simulation then runs sequentially.
+MIN_LOOKAHEAD_RATIO = 0.01
+
+
+# Splits the group in partitions of similar sizes, keeping close nodes together to maximize the lookahead.
+# The nodes are clustered by single linkage: merging the k shortest edges of a minimum spanning tree of the latencies
+# leaves clusters at least the (k + 1)-th shortest edge apart. The clusters are assigned, largest first, to the
+# smallest partition, and k is the largest (by bisection) for which the largest partition stays within
+# PARTITION_IMBALANCE of the average. Nodes at no latency from each other are kept together in any case, since
+# splitting them would leave no lookahead.
+def partition_nodes(group: Group, latency_model: LatencyModel, partitions: int) -> list[list[NodeId]]:
+    edges = sorted(_spanning_tree(group, latency_model))
+    max_size = max(math.ceil(len(group) / partitions * PARTITION_IMBALANCE), 1)
+
+    def assign(merged: int) -> list[list[NodeId]]:
+        clusters = list(range(len(group)))
+
+        def find(i: int) -> int:
+            while clusters[i] != i:
+                clusters[i] = clusters[clusters[i]]
+                i = clusters[i]
+            return i
+
+        for (_, i, j) in edges[:merged]:
+            clusters[find(j)] = find(i)
+        members: dict[int, list[NodeId]] = {}
+        for (i, node_id) in enumerate(group):
+            members.setdefault(find(i), []).append(node_id)
+        result = [[] for _ in range(partitions)]
+        for nodes in sorted(members.values(), key=len, reverse=True):
+            min(result, key=len).extend(nodes)
+        return [sorted(nodes) for nodes in result if nodes]
+
+    (low, high) = (sum(1 for edge in edges if edge[0] <= 0), len(edges))
+    while low < high:
+        merged = (low + high + 1) // 2
+        if max(map(len, assign(merged))) <= max_size:
+            low = merged
+        else:
+            high = merged - 1
+    return assign(low)
+
+
+# Returns the edges (latency, i, j) of a minimum spanning tree of the minimal latencies between the nodes of a group,
+# by their index in the group (Prim's algorithm).
+def _spanning_tree(group: Group, latency_model: LatencyModel) -> list[tuple[float, int, int]]:
+    in_tree = np.zeros(len(group), dtype=bool)
+    in_tree[0] = True
+    closest = np.asarray(latency_model.get_min_latencies(group[0], group), dtype=np.float64)
+    parents = np.zeros(len(group), dtype=np.int64)
+    edges = []
+    for _ in range(len(group) - 1):
+        j = int(np.argmin(np.where(in_tree, np.inf, closest)))
+        edges.append((float(closest[j]), int(parents[j]), j))
+        in_tree[j] = True
+        latencies = latency_model.get_min_latencies(group[j], group)
+        closer = ~in_tree & (latencies < closest)
+        closest[closer] = latencies[closer]
+        parents[closer] = j
+    return edges
+
+
+# Returns a lower bound of the latency of a message between nodes of different partitions.
+def compute_lookahead(group: Group, latency_model: LatencyModel, partitions: list[list[NodeId]]) -> float:
+    owner = {node_id: p for (p, nodes) in enumerate(partitions) for node_id in nodes}
+    owners = np.array([owner[node_id] for node_id in group])
+    lookahead = math.inf
+    for node_id in group:
+        remote = owners != owner[node_id]
+        if remote.any():
+            lookahead = min(lookahead, float(latency_model.get_min_latencies(node_id, group)[remote].min()))
+    return lookahead
+
+
+# Runs the simulation sequentially, returning the deliveries as (instant, node id, message) in processing order.
+def run_sequential(args: Namespace, modules: list[Type[AbstractModule]]) -> list[tuple[float, NodeId, Message]]:
+    simulator = Injector(args, modules).get(Simulator)
+    simulator.deliveries = []
+    simulator.run()
+    return simulator.deliveries
+
+
+# Simulates a partition of the nodes, in a worker process.
+# The worker alternates between exchanging messages with the other partitions through the coordinator, and
+# processing the events of a window, then returns the summary of its simulation. If recording the deliveries, each
+# delivery is recorded with its instant, its generation (the number of batches processed before it at the same
+# instant) and its node, which is the order of deliveries in a sequential simulation.
+# A traced worker writes its trace in its own subdirectory of the trace directory.
+def _simulate_partition(args: Namespace, modules: list[Type[AbstractModule]], partition: int,
+                        local_nodes: list[NodeId], record_deliveries: bool, connection: Connection):
+    args.local_nodes = local_nodes
+    if getattr(args, "trace", None):
+        args.trace = os.path.join(args.trace, f"partition-{partition}")
+    injector = Injector(args, modules)
+    simulator = injector.get(Simulator)
+    event_queue = simulator.event_queue
+    outbox = []
+    event_queue.partition(local_nodes, outbox)
+    if record_deliveries:
+        simulator.deliveries = []
+    generations = []
+
+    simulator.start()
+    (last_instant, generation) = (None, 0)
+    while True:
+        connection.send(outbox)
+        outbox.clear()
+        for (instant, seq, event) in connection.recv():
+            event_queue.schedule(instant, seq, event)
+
+        connection.send(event_queue.peek() if event_queue else math.inf)
+        window_end = connection.recv()
+        if window_end is None:
+            break
+        while event_queue and event_queue.peek() < window_end:
+            instant = event_queue.peek()
+            generation = generation + 1 if instant == last_instant else 0
+            events = simulator.step()
+            if record_deliveries:
+                generations.extend([generation] * len(events))
+            last_instant = instant
+
+    if getattr(args, "trace", None):
+        injector.get(Tracer).close()
+    deliveries = None
+    if record_deliveries:
+        deliveries = [(instant, generation, node_id, message)
+                      for ((instant, node_id, message), generation) in zip(simulator.deliveries, generations)]
+    connection.send((simulator.summary(), deliveries))
+
+
+# Runs a simulation over several worker processes, producing the same deliveries as a sequential run.
+# The simulation must be seeded, so that all the workers build the same latency model.
+# The deliveries are only recorded, and gathered by the coordinator, on demand: they grow with the number of events.
+# Below `min_lookahead_ratio` (see MIN_LOOKAHEAD_RATIO), the simulation runs sequentially.
+class ParallelSimulator:
+    def __init__(self, args: Namespace, modules: list[Type[AbstractModule]], partitions: int,
+                 record_deliveries: bool = False, min_lookahead_ratio: float = MIN_LOOKAHEAD_RATIO):
+        if args.seed is None:
+            raise ValueError("A parallel simulation requires a seed")
+        self.args = args
+        self.modules = modules
+        self.partitions = partitions
+        self.record_deliveries = record_deliveries
+        self.min_lookahead_ratio = min_lookahead_ratio
+        # The summaries of the simulations of the partitions.
+        self._summaries: list[dict[str, Any]] = []
+
+    # The number of events processed.
+    @property
+    def processed_events(self) -> int:
+        return self.summary()["events"]
+
+    # The instant of the last event.
+    @property
+    def clock(self) -> float:
+        return self.summary()["sim_time_ms"]
+
+    # Returns the summary metrics of the simulation, as Simulator.summary.
+    def summary(self) -> dict[str, Any]:
+        summaries = self._summaries
+        return {key: max((s[key] for s in summaries), default=0.0) if key == "sim_time_ms"
+                else sum(s[key] for s in summaries) for key in _SUMMARY_KEYS}
+
+    # Runs the simulation. If recording the deliveries, returns them as (instant, node id, message) in processing
+    # order.
+    def run(self) -> Optional[list[tuple[float, NodeId, Message]]]:
+        injector = Injector(self.args, self.modules)
+        group = injector.get(Group)
+        latency_model = injector.get(LatencyModel)
+        partitions = partition_nodes(group, latency_model, self.partitions)
+        lookahead = compute_lookahead(group, latency_model, partitions)
+        median = float(np.median(latency_model.get_min_latencies(group[0], group)))
+        if lookahead <= 0 or lookahead < self.min_lookahead_ratio * median:
+            logging.warning(f"The lookahead of {lookahead} ms between {len(partitions)} partitions is too short "
+                            f"compared to the median latency of {median} ms: simulating sequentially")
+            return self._run_sequential(injector)
+        logging.info(f"Simulating {len(group)} nodes in {len(partitions)} partitions with a lookahead of {lookahead} ms")
+
+        owner = {node_id: p for (p, nodes) in enumerate(partitions) for node_id in nodes}
+        connections, workers = [], []
+        for (partition, nodes) in enumerate(partitions):
+            (connection, worker_connection) = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_simulate_partition,
+                                             args=(self.args, self.modules, partition, nodes, self.record_deliveries,
+                                                   worker_connection),
+                                             daemon=True)
+            worker.start()
+            connections.append(connection)
+            workers.append(worker)
+
+        try:
+            while True:
+                inboxes = [[] for _ in partitions]
+                for connection in connections:
+                    for entry in connection.recv():
+                        inboxes[owner[entry[2].node_id]].append(entry)
+                for (connection, inbox) in zip(connections, inboxes):
+                    connection.send(inbox)
+
+                next_instant = min([connection.recv() for connection in connections])
+                window_end = next_instant + lookahead if next_instant < math.inf else None
+                for connection in connections:
+                    connection.send(window_end)
+                if window_end is None:
+                    break
+
+            results = [connection.recv() for connection in connections]
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+        finally:
+            for worker in workers:
+                worker.join()
+
+        self._summaries = [summary for (summary, _) in results]
+        if not self.record_deliveries:
+            return None
+        return [(instant, node_id, message) for (instant, _, node_id, message)
+                in heapq.merge(*(log for (_, log) in results), key=itemgetter(0, 1, 2))]
+
+    def _run_sequential(self, injector: Injector) -> Optional[list[tuple[float, NodeId, Message]]]:
+        simulator = injector.get(Simulator)
+        if self.record_deliveries:
+            simulator.deliveries = []
+        simulator.run()
+        if getattr(self.args, "trace", None):
+            injector.get(Tracer).close()
+        self._summaries = [simulator.summary()]
+        return simulator.deliveries if self.record_deliveries else None
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from time import perf_counter_ns
+from typing import Annotated, Any, Callable
+
+# Profiling of where the wall time of a simulation goes: the callbacks of the protocols, by callback and by path
+# prefix, the network, the event queue, and the rest of the simulator (dispatch and bookkeeping).
+#
+# The simulator, network, event queue and dispatchers report to the profiler while it is active. To keep the overhead
+# low on large runs, the profiler can be active only for one step of the simulation (one instant) in `period`: the
+# calls and times of the timed steps then count `period` times. Times are exclusive: the time of a callback does not
+# include the sends it makes, which count as network operations, and the time of a send does not include the pushes
+# to the event queue.
+
+
+# The times of an operation: the (estimated) number of calls and exclusive time in ns.
+@dataclass
+class Timing:
+    calls: int = 0
+    ns: int = 0
+
+
+@dataclass
+class Profiler:
+    period: Annotated[int, 'profile_period'] = 1  # Steps are timed one in `period`.
+
+    def __post_init__(self):
+        # If the current operations are timed.
+        self.active = False
+        # The timings by (kind, name) of operation.
+        self.operations: dict[tuple[str, str], Timing] = {}
+        # The timings of the callbacks by path id, including the operations they make.
+        self.paths: dict[int, Timing] = {}
+        # The wall time of the runs of the simulation, in ns.
+        self.run_ns = 0
+        self.steps = 0
+        # The number of times a timed operation counts, depending on the sampling of its step.
+        self._weight = 1
+        # The time spent in the operations nested in the current one.
+        self._nested_ns = 0
+
+    # Starts a step of the simulation, which is timed one in `period`.
+    def start_step(self):
+        self.active = self.steps % self.period == 0
+        self._weight = self.period
+        self.steps += 1
+
+    def end_step(self):
+        self.active = False
+        self._weight = 1
+
+    # Calls a function as an operation of the given kind and name, returning its result.
+    def time(self, kind: str, name: str, function: Callable[..., Any], *args: Any) -> Any:
+        nested_ns = self._nested_ns
+        self._nested_ns = 0
+        start = perf_counter_ns()
+        try:
+            return function(*args)
+        finally:
+            elapsed = perf_counter_ns() - start
+            self._add(self.operations, (kind, name), elapsed - self._nested_ns)
+            self._nested_ns = nested_ns + elapsed
+
+    # Delivers a message to a callback, timing it both as a callback and for the path of the message.
+    def deliver(self, callback: Callable[[Any], None], msg: Any):
+        nested_ns = self._nested_ns
+        self._nested_ns = 0
+        start = perf_counter_ns()
+        try:
+            callback(msg)
+        finally:
+            elapsed = perf_counter_ns() - start
+            self._add(self.operations, ("callback", _name(callback)), elapsed - self._nested_ns)
+            self._add(self.paths, msg.path.id, elapsed)
+            self._nested_ns = nested_ns + elapsed
+
+    def _add(self, timings: dict[Any, Timing], key: Any, ns: int):
+        timing = timings.get(key)
+        if timing is None:
+            timing = timings[key] = Timing()
+        timing.calls += self._weight
+        timing.ns += ns * self._weight
+
+    # Returns the timings of the callbacks by path prefix: a prefix counts the callbacks of all the paths it starts.
+    def path_prefixes(self) -> dict[str, Timing]:
+        from core import Path
+
+        prefixes: dict[str, Timing] = {}
+        for (path_id, timing) in self.paths.items():
+            path = Path.from_id(path_id)
+            for length in range(1, len(path) + 1):
+                prefix = prefixes.setdefault(str(Path(path[:length])), Timing())
+                prefix.calls += timing.calls
+                prefix.ns += timing.ns
+        return prefixes
+
+    # Returns a breakdown of the run time, ranked by time: the operations, then the path prefixes.
+    def report(self, limit: int = 20) -> str:
+        operations = {f"{kind} {name}": timing for ((kind, name), timing) in self.operations.items()}
+        other_ns = max(self.run_ns - sum(timing.ns for timing in operations.values()), 0)
+        operations["simulator (dispatch and other)"] = Timing(self.steps, other_ns)
+        total_ms = self.run_ns / 1e6
+        lines = [f"Profile of {total_ms:.1f} ms over {self.steps} steps, timing one step in {self.period}:"]
+        for (title, timings) in (("operation", operations), ("path prefix", self.path_prefixes())):
+            lines.append(f"{'time (ms)':>12} {'share':>7} {'calls':>10}  {title}")
+            ranked = sorted(timings.items(), key=lambda item: item[1].ns, reverse=True)
+            for (name, timing) in ranked[:limit]:
+                share = timing.ns / self.run_ns if self.run_ns else 0.0
+                lines.append(f"{timing.ns / 1e6:12.2f} {share:7.1%} {timing.calls:10d}  {name}")
+        return "\n".join(lines)
+
+
+def _name(callback: Callable) -> str:
+    return getattr(callback, "__qualname__", None) or type(callback).__qualname__
@@ -2,9 +2,10 @@ from __future__ import annotations
 
 import logging
 from dataclasses import dataclass
-from typing import Annotated
+from typing import Annotated, Optional
 
 from core import Message, NodeId, Network, Dispatcher, InstanceId, Protocol, Path, Group, PathSegment, EventQueue
+from coroutines import CoroutineProtocol
 from protocols.types import ConsistentBroadcast, BinaryConsensus
 
 
@@ -15,8 +16,9 @@ class ProtocolFactory:
     network: Network
     dispatcher: Dispatcher
 
-    def create(self, instance_id, **kwargs):
-        return self.protocol_type(instance_id, self.node_id, self.network, self.dispatcher, **kwargs)
+    def create(self, instance_id, parent=None, **kwargs):
+        return self.protocol_type(instance_id=instance_id, node_id=self.node_id, network=self.network,
+                                  dispatcher=self.dispatcher, parent=parent, **kwargs)
 
 
 @dataclass
@@ -32,15 +34,21 @@ class EchoConsistentBroadcast(ConsistentBroadcast):
 class BrachaBinaryConsensus(BinaryConsensus):
     broadcast_factory: ProtocolFactory
 
-    def __post_init__(self):
-        sender = NodeId(0)
-        b = self.broadcast_factory.create(
-            instance_id=InstanceId(("broadcast", 0)),
-            sender=sender,
-            value="v" if self.node_id == sender else False)
-
+    # The broadcasts of the nodes' values are created when their first message arrives, except for the node's own
+    # broadcast, for which no message arrives before the node starts it.
     def start(self):
-        pass
+        self.register_factory(self.path, self.create_broadcast)
+        self.dispatcher.instantiate(self.path.append(InstanceId(("broadcast", self.node_id))))
+
+    def create_broadcast(self, segment: PathSegment) -> Optional[ConsistentBroadcast]:
+        match getattr(segment, "id", None):
+            case ("broadcast", sender):
+                return self.broadcast_factory.create(
+                    instance_id=InstanceId(("broadcast", sender)),
+                    parent=self,
+                    sender=NodeId(sender),
+                    value="v" if self.node_id == sender else False)
+        return None
 
     def deliver(self, msg: Message):
         pass
@@ -52,17 +60,46 @@ class BroadcastPing(Protocol):
     pinger: Annotated[NodeId, 'pinger']
     event_queue: EventQueue
 
+    def __post_init__(self):
+        super().__post_init__()
+        self._ping_path = self.path.append(name="ping")
+        self._pong_path = self.path.append(name="pong")
+
     def start(self):
         if self.node_id == self.pinger:
-            self.subscribe(self.path.append(name="pong"), self.deliver_pong)
+            self.subscribe(self._pong_path, self.deliver_pong)
             # TODO: this construction is too low-level. Abstract details from the protocol implementer.
-            self.broadcast(Message(path=self.path.append(name="ping"), sender=self.node_id, payload="ping"), destination=self.group)
+            self.broadcast(Message(path=self._ping_path, sender=self.node_id, payload="ping"), destination=self.group)
         else:
-            self.subscribe(self.path.append(name="ping"), self.deliver_ping)
+            self.subscribe(self._ping_path, self.deliver_ping)
 
     def deliver_ping(self, msg: Message):
         logging.info(f"Node {self.node_id} received ping from {msg.sender} at {self.event_queue.clock} ms")
-        self.send(Message(path=self.path.append(name="pong"), sender=self.node_id, payload="pong"), destination=msg.sender)
+        self.send(Message(path=self._pong_path, sender=self.node_id, payload="pong"), destination=msg.sender)
 
     def deliver_pong(self, msg: Message):
         logging.info(f"Node {self.node_id} received pong from {msg.sender} at {self.event_queue.clock} ms")
+
+
+# BroadcastPing written as a coroutine.
+@dataclass
+class CoroutinePing(CoroutineProtocol):
+    group: Group
+    pinger: Annotated[NodeId, 'pinger']
+    event_queue: EventQueue
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._ping_path = self.path.append(name="ping")
+        self._pong_path = self.path.append(name="pong")
+
+    async def run(self):
+        if self.node_id == self.pinger:
+            self.broadcast(Message(path=self._ping_path, sender=self.node_id, payload="ping"), destination=self.group)
+            for _ in range(len(self.group) - 1):
+                msg = await self.receive(self._pong_path)
+                logging.info(f"Node {self.node_id} received pong from {msg.sender} at {self.event_queue.clock} ms")
+        else:
+            msg = await self.receive(self._ping_path)
+            logging.info(f"Node {self.node_id} received ping from {msg.sender} at {self.event_queue.clock} ms")
+            self.send(Message(path=self._pong_path, sender=self.node_id, payload="pong"), destination=msg.sender)
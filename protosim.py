@@ -2,23 +2,84 @@ import argparse
 import importlib
 import inspect
 import logging
-from typing import Annotated
+import math
+import shutil
+from typing import Annotated, Optional, Type
 
-from core import EventQueue, Network, Dispatcher, NodeId, Node, Simulator, Group, LatencyModel, GeoLatencyModel
-from injection import Injector, Scope
+import numpy as np
+
+from core import EventQueue, Network, Dispatcher, NodeId, Node, Simulator, Group, LatencyModel, GeoLatencyModel, \
+    Scheduler, HeapScheduler, CalendarScheduler, ArrayScheduler, Backlog, BacklogPolicy, BacklogReports, SpillFile
+import checkpoint
+from coroutines import SimulatorLoop
+from cache import ResultCache, config_key
+from latency import BandwidthLatencyModel, ContinentLatencyModel, JITTER_DISTRIBUTIONS, JitterLatencyModel, \
+    LocationLatencyModel
+from injection import Factory, Injector, Scope
 from injection.injector import AbstractModule
+from metrics import Metrics
+from pdes import ParallelSimulator
+from profiling import Profiler
+from randomness import RandomStreams
+from tracing import Tracer
+
+# The available latency models, selectable with --latency_model.
+LATENCY_MODELS = {
+    "geo": GeoLatencyModel,
+    "continent": ContinentLatencyModel,
+    "location": LocationLatencyModel,
+}
+
+# The available EventQueue backends, selectable with --scheduler.
+SCHEDULERS = {
+    "heap": HeapScheduler,
+    "calendar": CalendarScheduler,
+    "array": ArrayScheduler,
+}
+
+# The options that parallel simulations do not support (see pdes.py).
+PARALLEL_UNSUPPORTED = ("metrics", "profile", "cache", "checkpoint", "restore")
+
+# The options that restored simulations do not support: the components they add are built with the simulation, so
+# fresh ones would not be attached to the restored simulation.
+RESTORE_UNSUPPORTED = ("metrics", "profile")
 
 
 class MainModule(AbstractModule):
     # Constructor for the Group of Nodes.
+    # When simulating a partition of the group (see pdes.py), only the nodes of the partition are built.
+    @staticmethod
+    def build_nodes(injector: Injector, group: Group,
+                    local_nodes: Annotated[Optional[list[NodeId]], 'local_nodes'],
+                    build_workers: Annotated[int, 'build_workers'] = 1) -> list[Node]:
+        return injector.instantiate_per_node(Node, group if local_nodes is None else local_nodes, build_workers)
+
+    # Constructor for the LatencyModel: the base model selected with --latency_model, with jitter and uplink
+    # transmission times on top of it if enabled.
     @staticmethod
-    def build_nodes(injector: Injector, group: Group) -> list[Node]:
-        nodes = []
-        for node_id in group:
-            injector.enter_node_scope(node_id)
-            nodes.append(injector.get(Node))
-            injector.exit_node_scope()
-        return nodes
+    def provide_latency_model(injector: Injector, latency_model: Annotated[LatencyModel, 'base'],
+                              jitter: Annotated[float, 'jitter'],
+                              uplink_mbps: Annotated[Optional[float], 'uplink_mbps']) -> LatencyModel:
+        if jitter:
+            latency_model = injector.get(Factory[JitterLatencyModel]).create(latency_model=latency_model)
+        if uplink_mbps:
+            latency_model = injector.get(Factory[BandwidthLatencyModel]).create(latency_model=latency_model,
+                                                                                 uplink_mbps=uplink_mbps)
+        return latency_model
+
+    # Constructor for the Metrics, which classify the pairs of nodes by the locations of the base latency model.
+    @staticmethod
+    def provide_metrics(latency_model: Annotated[LatencyModel, 'base'], group: Group,
+                        output: Annotated[Optional[str], 'metrics'],
+                        interval: Annotated[Optional[float], 'metrics_interval']) -> Metrics:
+        get_location = getattr(latency_model, "get_location", None)
+        locations = [get_location(node_id) for node_id in group] if get_location else None
+        return Metrics(locations, output, interval)
+
+    # Constructor for the random generator of a node.
+    @staticmethod
+    def provide_node_generator(random_streams: RandomStreams, node_id: NodeId) -> np.random.Generator:
+        return random_streams.generator("node", node_id)
 
     # Constructor for the Group (list of NodeIds).
     @staticmethod
@@ -27,40 +88,178 @@ class MainModule(AbstractModule):
 
     # Module configuration.
     def configure(self, injector: Injector):
+        injector.provide(Scheduler, SCHEDULERS[self.args.scheduler], scope=Scope.SINGLETON)
         injector.provide(EventQueue, scope=Scope.SINGLETON)
-        injector.provide(LatencyModel, GeoLatencyModel, scope=Scope.SINGLETON)
+        injector.provide(SimulatorLoop, scope=Scope.SINGLETON)
+        injector.provide(Annotated[LatencyModel, 'base'], LATENCY_MODELS[self.args.latency_model],
+                         scope=Scope.SINGLETON)
+        injector.provide(LatencyModel, self.provide_latency_model, scope=Scope.SINGLETON)
+        injector.supply(Annotated[float, 'location_resolution_km'], getattr(self.args, "location_resolution_km", 0.0))
+        injector.supply(Annotated[float, 'jitter'], getattr(self.args, "jitter", 0.0))
+        injector.supply(Annotated[str, 'jitter_distribution'], getattr(self.args, "jitter_distribution", "exponential"))
+        injector.supply(Annotated[Optional[float], 'uplink_mbps'], getattr(self.args, "uplink_mbps", None))
+        injector.supply(Annotated[float, 'uplink_spread'], getattr(self.args, "uplink_spread", 0.0))
         injector.provide(Network, scope=Scope.SINGLETON)
         injector.provide(Dispatcher, scope=Scope.NODE)
+        injector.provide(Backlog, scope=Scope.NODE)
+        injector.provide(BacklogReports, scope=Scope.SINGLETON)
+        injector.supply(Annotated[Optional[int], 'backlog_path_limit'], getattr(self.args, "backlog_path_limit", None))
+        injector.supply(Annotated[Optional[int], 'backlog_node_limit'], getattr(self.args, "backlog_node_limit", None))
+        injector.supply(BacklogPolicy, BacklogPolicy(getattr(self.args, "backlog_policy", "drop_oldest")))
+        if getattr(self.args, "backlog_policy", None) == BacklogPolicy.SPILL.value:
+            injector.provide(SpillFile, scope=Scope.SINGLETON)
+            injector.supply(Annotated[Optional[str], 'backlog_spill_directory'],
+                            getattr(self.args, "backlog_spill_directory", None))
 
         injector.supply(Annotated[int, 'group_size'], self.args.group_size)
+        injector.supply(Annotated[bool, 'lazy_latency'], self.args.lazy_latency)
+        injector.supply(Annotated[int, 'latency_cache_rows'], self.args.latency_cache_rows)
+        injector.supply(Annotated[Optional[int], 'seed'], self.args.seed)
+        injector.provide(RandomStreams, scope=Scope.SINGLETON)
+        injector.provide(np.random.Generator, constructor=self.provide_node_generator, scope=Scope.NODE)
+        injector.supply(Annotated[Optional[list[NodeId]], 'local_nodes'], getattr(self.args, "local_nodes", None))
+        injector.supply(Annotated[int, 'build_workers'], getattr(self.args, "build_workers", 1))
         injector.provide(Group, constructor=self.provide_node_ids, scope=Scope.SINGLETON)
         injector.provide(list[Node], constructor=self.build_nodes, scope=Scope.SINGLETON)
 
         injector.provide(Simulator, constructor=Simulator, scope=Scope.SINGLETON)
 
+        if getattr(self.args, "trace", None):
+            injector.provide(Tracer, scope=Scope.SINGLETON)
+            injector.supply(Annotated[str, 'trace_directory'], self.args.trace)
+        if getattr(self.args, "metrics", None):
+            injector.provide(Metrics, constructor=self.provide_metrics, scope=Scope.SINGLETON)
+            injector.supply(Annotated[Optional[str], 'metrics'], self.args.metrics)
+            injector.supply(Annotated[Optional[float], 'metrics_interval'], getattr(self.args, "metrics_interval", None))
+        if getattr(self.args, "profile", False):
+            injector.provide(Profiler, scope=Scope.SINGLETON)
+            injector.supply(Annotated[int, 'profile_period'], getattr(self.args, "profile_period", 1))
 
-# Main function. Sets up the injector and runs the simulator.
-def main():
-    logging.basicConfig(level=logging.INFO)
 
+# Returns the parser of the command-line arguments.
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument("modules", nargs='+', type=str, help="whitespace-separated list of modules")
     parser.add_argument("-g", "--group_size", type=int, default=4, help="number of nodes in the group")
-    args = parser.parse_args()
+    parser.add_argument("-s", "--seed", type=int, default=None, help="seed for the random choices of the simulation")
+    parser.add_argument("--latency_model", choices=LATENCY_MODELS, default="geo", help="network latency model")
+    parser.add_argument("--scheduler", choices=SCHEDULERS, default="heap", help="event queue backend")
+    parser.add_argument("--location_resolution_km", type=float, default=0.0,
+                        help="with the location latency model, size of the cells in which node locations are merged")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="mean jitter added to the latencies, relative to the latency of each link")
+    parser.add_argument("--jitter_distribution", choices=JITTER_DISTRIBUTIONS, default="exponential",
+                        help="distribution of the jitter")
+    parser.add_argument("--uplink_mbps", type=float, default=None,
+                        help="mean uplink bandwidth of the nodes, adding the transmission of the payloads to latencies")
+    parser.add_argument("--uplink_spread", type=float, default=0.0,
+                        help="standard deviation of the logarithm of the uplink bandwidths of the nodes")
+    parser.add_argument("--lazy_latency", action="store_true",
+                        help="compute node latencies on demand instead of precomputing the full latency matrix")
+    parser.add_argument("--latency_cache_rows", type=int, default=1024,
+                        help="with --lazy_latency, maximal number of latency rows (one per source node) kept in memory")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="directory in which to write a binary trace of the messages")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="JSON lines file to which to export latency histograms, throughput and queue depth")
+    parser.add_argument("--metrics_interval", type=float, default=None,
+                        help="period (in simulated ms) at which to export the metrics, besides the end of the run")
+    parser.add_argument("--profile", action="store_true",
+                        help="print where the run time goes: protocol callbacks, paths, network and event queue")
+    parser.add_argument("--profile_period", type=int, default=1,
+                        help="when profiling, time one instant of the simulation in this many")
+    parser.add_argument("-p", "--partitions", type=int, default=1,
+                        help="number of worker processes over which the nodes are partitioned")
+    parser.add_argument("--backlog_path_limit", type=int, default=None,
+                        help="maximal number of messages held in memory for a path without subscription, per node")
+    parser.add_argument("--backlog_node_limit", type=int, default=None,
+                        help="maximal number of messages held in memory for paths without subscription, per node")
+    parser.add_argument("--backlog_policy", choices=[policy.value for policy in BacklogPolicy], default="drop_oldest",
+                        help="what to do with the messages beyond the backlog limits")
+    parser.add_argument("--backlog_spill_directory", type=str, default=None,
+                        help="directory of the file to which messages are spilled (default: the temporary directory)")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="file to which to save the state of the simulation at --checkpoint_at")
+    parser.add_argument("--checkpoint_at", type=float, default=math.inf,
+                        help="instant (in ms) after which the state of the simulation is saved")
+    parser.add_argument("--restore", type=str, default=None,
+                        help="checkpoint file from which to continue a simulation, instead of building it")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="directory of a cache of results: seeded runs whose configuration is cached are skipped")
+    parser.add_argument("--cache_size_mb", type=float, default=1024, help="maximal size of the cache of results")
+    parser.add_argument("--build_workers", type=int, default=1,
+                        help="number of worker processes building the nodes")
+    return parser
 
-    def is_injector_module(obj):
-        return inspect.isclass(obj) and inspect.getmodule(obj) is mod and issubclass(obj, AbstractModule)
 
+# Returns the injector modules to install: the main module followed by those defined in the given modules.
+def load_modules(module_names: list[str]) -> list[Type[AbstractModule]]:
     injector_modules = [MainModule]
-    for module_name in args.modules:
+    for module_name in module_names:
         mod = importlib.import_module(f"modules.{module_name}")
+
+        def is_injector_module(obj):
+            return inspect.isclass(obj) and inspect.getmodule(obj) is mod and issubclass(obj, AbstractModule)
+
         injector_modules += [cls for (name, cls) in inspect.getmembers(mod, is_injector_module)]
+    return injector_modules
+
+
+# Main function. Sets up the injector and runs the simulator.
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    args = build_parser().parse_args()
+    injector_modules = load_modules(args.modules)
 
     logging.info(f"Installing modules: {[m.__name__ for m in injector_modules]}")
 
+    if args.partitions > 1:
+        unsupported = [option for option in PARALLEL_UNSUPPORTED if getattr(args, option)]
+        if unsupported:
+            raise ValueError(f"Cannot run a parallel simulation with {', '.join('--' + o for o in unsupported)}")
+        simulator = ParallelSimulator(args, injector_modules, args.partitions)
+        simulator.run()
+        logging.info(f"Result: {simulator.summary()}")
+        return
+
+    if args.trace and (args.checkpoint or args.restore):
+        raise ValueError("Cannot checkpoint a traced simulation")
+    unsupported = [option for option in RESTORE_UNSUPPORTED if getattr(args, option)] if args.restore else []
+    if unsupported:
+        raise ValueError(f"Cannot restore a simulation with {', '.join('--' + o for o in unsupported)}")
+
     injector = Injector(args, injector_modules)
-    simulator = injector.get(Simulator)
+    cache = ResultCache(args.cache, int(args.cache_size_mb * 2 ** 20)) if args.cache else None
+    # A profiled run, or one exporting metrics, is never skipped.
+    key = config_key(args, injector, injector_modules) if cache and not args.profile and not args.metrics else None
+    if key is not None:
+        summary = cache.get(key)
+        cached_trace = cache.trace_directory(key)
+        if summary is not None and (not args.trace or cached_trace):
+            if args.trace:
+                shutil.copytree(cached_trace, args.trace, dirs_exist_ok=True)
+            logging.info(f"Cached result {key}: {summary}")
+            return
+
+    simulator = checkpoint.load(args.restore) if args.restore else injector.get(Simulator)
+    if args.checkpoint:
+        simulator.run_until(args.checkpoint_at)
+        checkpoint.save(simulator, args.checkpoint)
+        logging.info(f"Saved checkpoint at {simulator.event_queue.clock} ms to {args.checkpoint}")
     simulator.run()
+    if args.trace:
+        injector.get(Tracer).close()
+    summary = simulator.summary()
+    logging.info(f"Result: {summary}")
+    if args.metrics:
+        metrics = injector.get(Metrics)
+        metrics.export()
+        logging.info(f"Latencies: {metrics.latency.summary()}, metrics written to {args.metrics}")
+    if args.profile:
+        print(injector.get(Profiler).report())
+    if key is not None:
+        cache.put(key, summary, args.trace)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import logging
+import random
+import zlib
+from dataclasses import dataclass
+from typing import Annotated, Optional
+
+import numpy as np
+
+# Independent random streams derived from a single seed, one per component and optionally per node.
+# The stream of a component is derived from the seed and the component's name (and node), as with
+# `SeedSequence.spawn`, but without depending on the order in which the streams are requested: a stream is the same
+# in every run with the same seed, whatever the other components, and in every process of a parallel simulation.
+# Without a seed, the streams derive from fresh entropy, which is logged so that the run can be reproduced.
+@dataclass
+class RandomStreams:
+    seed: Annotated[Optional[int], 'seed'] = None
+
+    def __post_init__(self):
+        self._seed_sequence = np.random.SeedSequence(self.seed)
+        if self.seed is None:
+            logging.info(f"Random streams seeded with {self._seed_sequence.entropy} (pass it as --seed to reproduce)")
+
+    @property
+    def entropy(self) -> int:
+        return self._seed_sequence.entropy
+
+    # Returns the seed sequence of a component's stream.
+    def seed_sequence(self, name: str, node_id: Optional[int] = None) -> np.random.SeedSequence:
+        spawn_key = (zlib.crc32(name.encode()),) if node_id is None else (zlib.crc32(name.encode()), int(node_id))
+        return np.random.SeedSequence(self._seed_sequence.entropy, spawn_key=spawn_key)
+
+    # Returns a new generator of a component's stream. Every call starts the stream over.
+    def generator(self, name: str, node_id: Optional[int] = None) -> np.random.Generator:
+        return np.random.Generator(np.random.PCG64(self.seed_sequence(name, node_id)))
+
+    # Returns a new `random.Random` generator of a component's stream, for code using the standard library's API.
+    def python_random(self, name: str, node_id: Optional[int] = None) -> random.Random:
+        return random.Random(int.from_bytes(self.seed_sequence(name, node_id).generate_state(4, np.uint64).tobytes(),
+                                            "little"))
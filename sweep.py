@@ -0,0 +1,125 @@
+import argparse
+import csv
+import itertools
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from functools import partial
+from typing import Any, Optional
+
+from cache import ResultCache, config_key
+from core import Simulator
+from injection import Injector
+from metrics import Metrics
+from protosim import build_parser, load_modules, LATENCY_MODELS, SCHEDULERS
+
+
+# The parameters of one simulation of a sweep.
+@dataclass(frozen=True)
+class SweepConfig:
+    modules: tuple[str, ...]
+    group_size: int
+    seed: int
+    latency_model: str
+    scheduler: str
+
+
+# The columns of the result table.
+COLUMNS = ["modules", "group_size", "seed", "latency_model", "scheduler", "events", "sim_time_ms",
+           "build_s", "run_s", "events_per_s", "latency_p50_ms", "latency_p90_ms", "latency_p99_ms", "latency_max_ms"]
+
+
+# Builds and runs one simulation, returning its result row. Executed in a worker process.
+# With a cache, the row of a configuration already simulated is returned from the cache.
+def run_simulation(config: SweepConfig, cache: Optional[ResultCache] = None) -> dict[str, Any]:
+    args = build_parser().parse_args(list(config.modules))
+    args.group_size = config.group_size
+    args.seed = config.seed
+    args.latency_model = config.latency_model
+    args.scheduler = config.scheduler
+
+    start = time.perf_counter()
+    modules = load_modules(args.modules)
+    injector = Injector(args, modules)
+    key = config_key(args, injector, modules, producer="sweep") if cache else None
+    if key is not None:
+        row = cache.get(key)
+        if row is not None:
+            return row
+    simulator = injector.get(Simulator)
+    built = time.perf_counter()
+
+    # The latencies of the messages, in a histogram of constant size.
+    metrics = simulator.network.metrics = Metrics()
+    simulator.run()
+    end = time.perf_counter()
+
+    latencies = metrics.latency
+    p50, p90, p99 = (latencies.percentile(q) for q in (50, 90, 99))
+    p100 = latencies.max if latencies.count else float('nan')
+    row = asdict(config) | {
+        "modules": ",".join(config.modules),
+        "events": simulator.processed_events,
+        "sim_time_ms": simulator.event_queue.clock,
+        "build_s": built - start,
+        "run_s": end - built,
+        "events_per_s": simulator.processed_events / (end - built) if end > built else float('nan'),
+        "latency_p50_ms": p50,
+        "latency_p90_ms": p90,
+        "latency_p99_ms": p99,
+        "latency_max_ms": p100,
+    }
+    if key is not None:
+        cache.put(key, row)
+    return row
+
+
+# Runs the simulations of the given configurations in a pool of worker processes.
+# Yields the result rows as the simulations complete.
+def run_sweep(configs: list[SweepConfig], jobs: int, cache: Optional[ResultCache] = None):
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(partial(run_simulation, cache=cache), config) for config in configs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Main function. Runs a simulation for every combination of the given parameters and writes the results as CSV.
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs='+', type=str,
+                        help="module sets to simulate, each a comma-separated list of modules")
+    parser.add_argument("-g", "--group_sizes", nargs='+', type=int, default=[4], help="numbers of nodes in the group")
+    parser.add_argument("-s", "--seeds", nargs='+', type=int, default=[0], help="seeds of the simulations")
+    parser.add_argument("--latency_models", nargs='+', choices=LATENCY_MODELS, default=["geo"],
+                        help="network latency models")
+    parser.add_argument("--schedulers", nargs='+', choices=SCHEDULERS, default=["heap"], help="event queue backends")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-o", "--output", type=str, default=None, help="CSV file to write (default: stdout)")
+    parser.add_argument("--cache", type=str, default=None,
+                        help="directory of a cache of results: the configurations already simulated are skipped")
+    parser.add_argument("--cache_size_mb", type=float, default=1024, help="maximal size of the cache of results")
+    args = parser.parse_args()
+    cache = ResultCache(args.cache, int(args.cache_size_mb * 2 ** 20)) if args.cache else None
+
+    configs = [
+        SweepConfig(tuple(modules.split(",")), group_size, seed, latency_model, scheduler)
+        for (modules, group_size, seed, latency_model, scheduler)
+        in itertools.product(args.modules, args.group_sizes, args.seeds, args.latency_models, args.schedulers)
+    ]
+    logging.warning(f"Running {len(configs)} simulation(s) on {args.jobs} worker(s)")
+
+    with open(args.output, "w", newline="") if args.output else sys.stdout as output:
+        writer = csv.DictWriter(output, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in run_sweep(configs, args.jobs, cache):
+            writer.writerow(row)
+            output.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from typing import Annotated, Optional
+
+from core import InstanceId, LatencyModel, NodeId, Protocol, Simulator
+from injection import Factory, Injector, Scope
+from injection.injector import AbstractModule
+from protosim import build_parser, load_modules
+
+
+class ConstantLatencyModel(LatencyModel):
+    def __init__(self, latency: float = 10.0):
+        self.latency = latency
+
+    def get_latency(self, src: NodeId, dst: NodeId) -> float:
+        return self.latency
+
+
+# Builds the injector of a seeded run of the ping protocol, or of the given modules instead of the ones of the args.
+def build_injector(*options: str, group_size: int = 30, seed: int = 0, modules: Optional[list] = None) -> Injector:
+    args = build_parser().parse_args(["ping", "-g", str(group_size), "-s", str(seed), *options])
+    return Injector(args, load_modules(args.modules) if modules is None else modules)
+
+
+# Returns an injector module providing an instance of the given protocol as the root protocol of every node.
+def root_protocol_module(protocol_type: type[Protocol]) -> type[AbstractModule]:
+    def provide_root_protocol(factory: Factory[protocol_type]) -> Protocol:
+        return factory.create(instance_id=InstanceId(id="root"))
+
+    class RootProtocolModule(AbstractModule):
+        def configure(self, injector: Injector):
+            injector.provide(Annotated[Protocol, 'root'], constructor=provide_root_protocol, scope=Scope.NODE)
+
+    return RootProtocolModule
+
+
+# Builds the simulator of a seeded run, recording its deliveries.
+def build_ping(*options: str, **kwargs) -> Simulator:
+    simulator = build_injector(*options, **kwargs).get(Simulator)
+    simulator.deliveries = []
+    return simulator
+
+
+def run_ping(*options: str, **kwargs) -> Simulator:
+    simulator = build_ping(*options, **kwargs)
+    simulator.run()
+    return simulator
+
+
+# The recorded deliveries, comparable across runs and processes.
+def deliveries(simulator: Simulator) -> list[tuple[float, int, str, int]]:
+    return [(instant, node_id, str(msg.path), msg.sender) for (instant, node_id, msg) in simulator.deliveries]
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import geodata
+from cache import ResultCache, _data_files, config_key
+from injection import Injector
+from protosim import build_parser, load_modules
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def key(*options: str, producer: str = "protosim"):
+    args = build_parser().parse_args(["ping", "-g", "10", *options])
+    modules = load_modules(args.modules)
+    return config_key(args, Injector(args, modules), modules, producer)
+
+
+class TestConfigKey(unittest.TestCase):
+    def test_stable(self):
+        self.assertEqual(key("-s", "1"), key("-s", "1"))
+
+    def test_changes_with_configuration(self):
+        keys = {key("-s", "1"), key("-s", "2"), key("-s", "1", "-g", "11"), key("-s", "1", "--jitter", "0.2")}
+        self.assertEqual(len(keys), 4)
+
+    def test_ignores_output_options(self):
+        self.assertEqual(key("-s", "1"), key("-s", "1", "--partitions", "2", "--cache", "elsewhere"))
+
+    def test_namespaced_by_producer(self):
+        self.assertTrue(key("-s", "1").startswith("protosim-"))
+        self.assertNotEqual(key("-s", "1"), key("-s", "1", producer="sweep"))
+
+    # The modules of the bindings are named the same whether protosim runs as a script or is imported.
+    def test_same_key_as_script(self):
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.run([sys.executable, "protosim.py", "ping", "-g", "10", "-s", "1", "--cache", directory],
+                           cwd=ROOT, capture_output=True, check=True)
+            self.assertEqual(os.listdir(directory), [key("-s", "1")])
+
+    # The files of a geographical dataset are those that geodata.load reads.
+    def test_data_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            json_path = os.path.join(directory, "peers.json")
+            with open(json_path, "w") as f:
+                f.write('[{"latitude": "1", "longitude": "2"}]')
+            self.assertEqual(_data_files(json_path), [json_path])
+            geodata.load(json_path).save(geodata.binary_path(json_path), source=json_path)
+            files = _data_files(json_path)
+            self.assertEqual(len(files), len(geodata.GeoDataset._COLUMNS) + 1)
+            self.assertEqual(_data_files(geodata.binary_path(json_path)), files)
+            with open(json_path, "a") as f:
+                f.write("\n")
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(_data_files(json_path), [json_path])
+        self.assertEqual(_data_files("missing.json"), [])
+
+    def test_not_reproducible(self):
+        self.assertIsNone(key())
+        self.assertIsNone(key("-s", "1", "--checkpoint", "checkpoint"))
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", {"events": 10})
+        self.assertEqual(self.cache.get("a"), {"events": 10})
+        self.assertIsNone(self.cache.trace_directory("a"))
+
+    def test_trace(self):
+        with tempfile.TemporaryDirectory() as trace:
+            with open(os.path.join(trace, "events.csv"), "w") as f:
+                f.write("instant,node\n")
+            self.cache.put("a", {}, trace)
+        stored = self.cache.trace_directory("a")
+        with open(os.path.join(stored, "events.csv")) as f:
+            self.assertEqual(f.read(), "instant,node\n")
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("a", {"value": "x" * 100})
+        self.cache.put("b", {"value": "x" * 100})
+        entry_size = os.path.getsize(os.path.join(self.directory.name, "a", "result.json"))
+        past = time.time() - 10
+        for (name, offset) in (("a", 1), ("b", 0)):
+            os.utime(os.path.join(self.directory.name, name), (past + offset, past + offset))
+        self.cache.get("b")  # "b" is now the most recently used.
+        self.cache.max_bytes = 2 * entry_size
+        self.cache.put("c", {"value": "x" * 100})
+        self.assertIsNone(self.cache.get("a"))
+        self.assertIsNotNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
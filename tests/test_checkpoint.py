@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import checkpoint
+from core import Simulator
+from helpers import build_ping, deliveries
+from injection import Injector
+from protosim import build_parser, load_modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.expected = build_ping()
+        self.expected.run()
+
+    def test_run_until(self):
+        simulator = build_ping()
+        simulator.run_until(100)
+        self.assertTrue(simulator.event_queue)
+        self.assertLessEqual(simulator.event_queue.clock, 100)
+        self.assertGreater(simulator.event_queue.peek(), 100)
+        simulator.run()
+        self.assertEqual(deliveries(simulator), deliveries(self.expected))
+
+    def test_restore_copies(self):
+        for scheduler in ("heap", "array"):
+            simulator = build_ping("--scheduler", scheduler)
+            simulator.run_until(100)
+            data = checkpoint.snapshot(simulator)
+            copies = [checkpoint.restore(data) for _ in range(2)]
+            for copy in copies:
+                copy.run()
+                self.assertEqual(deliveries(copy), deliveries(self.expected))
+            self.assertLessEqual(simulator.event_queue.clock, 100)
+
+    # The paths have other ids in another process.
+    def test_restore_in_other_process(self):
+        for scheduler in ("heap", "array"):
+            simulator = build_ping("--scheduler", scheduler, "--backlog_path_limit", "1")
+            simulator.run_until(100)
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "checkpoint")
+                checkpoint.save(simulator, path)
+                script = ("import sys, checkpoint; from core import Path\n"
+                          "[Path().append(name='unrelated', index=i) for i in range(100)]\n"
+                          "simulator = checkpoint.load(sys.argv[1])\n"
+                          "simulator.run()\n"
+                          "print(len(simulator.deliveries), sum(len(node.dispatcher.backlog) for node in simulator.nodes))")
+                output = subprocess.run([sys.executable, "-c", script, path], cwd=ROOT, capture_output=True,
+                                        text=True, check=True).stdout
+            backlog = sum(len(node.dispatcher.backlog) for node in self.expected.nodes)
+            self.assertEqual(output.split(), [str(len(self.expected.deliveries)), str(backlog)])
+
+    def test_spilled_backlog(self):
+        simulator = build_ping("--backlog_policy", "spill", "--backlog_path_limit", "0")
+        simulator.run_until(100)
+        spilled = sum(node.dispatcher.backlog.spilled for node in simulator.nodes)
+        self.assertGreater(spilled, 0)
+        copy = checkpoint.restore(checkpoint.snapshot(simulator))
+        copy.run()
+        self.assertEqual(deliveries(copy), deliveries(self.expected))
+        backlog = sum(len(node.dispatcher.backlog) for node in self.expected.nodes)
+        self.assertEqual(sum(len(node.dispatcher.backlog) for node in copy.nodes), backlog)
+
+    def test_coroutines_not_supported(self):
+        args = build_parser().parse_args(["coroutine_ping", "-g", "10", "-s", "0"])
+        simulator = Injector(args, load_modules(args.modules)).get(Simulator)
+        simulator.run_until(100)
+        with self.assertRaisesRegex(ValueError, "coroutine protocols"):
+            checkpoint.snapshot(simulator)
+
+    def test_fork(self):
+        simulator = build_ping()
+        simulator.run_until(100)
+
+        def variant(simulator: Simulator):
+            simulator.run()
+            return deliveries(simulator)
+
+        self.assertEqual(checkpoint.fork(simulator, [variant, variant], jobs=1), [deliveries(self.expected)] * 2)
+        self.assertLessEqual(simulator.event_queue.clock, 100)
+
+    def test_fork_raises(self):
+        def variant(simulator: Simulator):
+            raise KeyError("variant")
+
+        with self.assertRaises(KeyError):
+            checkpoint.fork(build_ping(), [variant])
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from dataclasses import dataclass
+
+from core import Group, Message
+from coroutines import CoroutineProtocol
+from helpers import deliveries, root_protocol_module, run_ping
+from protosim import load_modules
+
+
+# Every node sends a vote to all, sleeps, then waits for a quorum of votes with a timeout, twice.
+@dataclass
+class Rounds(CoroutineProtocol):
+    group: Group
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.log: list[tuple[str, float, int]] = []
+
+    async def run(self):
+        for round in range(2):
+            path = self.path.append(name="vote", round=round)
+            self.broadcast(Message(path, self.node_id), self.group)
+            await asyncio.sleep(5)
+            self.log.append(("slept", self.loop.time(), round))
+            try:
+                votes = await asyncio.wait_for(self.receive_many(path, 2 * len(self.group) // 3 + 1), 10_000)
+                self.log.append(("quorum", self.loop.time(), len(votes)))
+            except asyncio.TimeoutError:
+                self.log.append(("timeout", self.loop.time(), round))
+
+
+# Fails after a sleep.
+@dataclass
+class Failing(CoroutineProtocol):
+    async def run(self):
+        await asyncio.sleep(1)
+        raise KeyError("failing")
+
+
+class TestCoroutines(unittest.TestCase):
+    def test_same_as_callbacks(self):
+        callbacks = run_ping(group_size=20, seed=4, modules=load_modules(["ping"]))
+        coroutines = run_ping(group_size=20, seed=4, modules=load_modules(["coroutine_ping"]))
+        self.assertEqual(deliveries(coroutines), deliveries(callbacks))
+
+    def test_rounds(self):
+        simulator = run_ping(group_size=10, seed=4, modules=load_modules([]) + [root_protocol_module(Rounds)])
+        for node in simulator.nodes:
+            log = node.root_protocol.log
+            self.assertEqual([(entry[0], entry[2]) for entry in log], [("slept", 0), ("quorum", 7), ("slept", 1),
+                                                                       ("quorum", 7)])
+            self.assertEqual(log[0][1], 5)
+            self.assertLess(log[1][1], 10_000)
+        # The timeouts of wait_for are cancelled: they do not extend the simulation.
+        self.assertLess(simulator.event_queue.clock, 10_000)
+        self.assertFalse(simulator.event_queue)
+        self.assertIsNone(asyncio.events._get_running_loop())
+
+    def test_failure(self):
+        with self.assertRaises(KeyError):
+            run_ping(group_size=2, seed=4, modules=load_modules([]) + [root_protocol_module(Failing)])
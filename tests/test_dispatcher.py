@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import pickle
+import unittest
+from dataclasses import dataclass, field
+from typing import Optional
+
+from core import FINISHED, Backlog, BacklogPolicy, BacklogReports, Dispatcher, InstanceId, Message, NodeId, Path, \
+    PathSegment, Protocol
+from protocols.implementations import BrachaBinaryConsensus, EchoConsistentBroadcast, ProtocolFactory
+
+
+class TestBacklog(unittest.TestCase):
+    def setUp(self):
+        self.paths = [Path().append(name="backlog", index=i) for i in range(3)]
+
+    def fill(self, backlog: Backlog, path_indices: list[int]):
+        for (i, path_index) in enumerate(path_indices):
+            backlog.add(Message(self.paths[path_index], NodeId(0), i))
+
+    def payloads(self, backlog: Backlog, path_index: int) -> list[int]:
+        return [msg.payload for msg in backlog.take(self.paths[path_index].id)]
+
+    def test_unbounded(self):
+        backlog = Backlog(NodeId(0))
+        self.fill(backlog, [0, 1, 0, 0])
+        self.assertEqual(len(backlog), 4)
+        self.assertEqual(self.payloads(backlog, 0), [0, 2, 3])
+        self.assertEqual(self.payloads(backlog, 0), [])
+        self.assertEqual(len(backlog), 1)
+
+    def test_path_limit(self):
+        for (policy, expected) in [(BacklogPolicy.DROP_OLDEST, [3, 4]), (BacklogPolicy.DROP_NEWEST, [0, 2]),
+                                   (BacklogPolicy.SPILL, [0, 2, 3, 4])]:
+            backlog = Backlog(NodeId(0), path_limit=2, policy=policy)
+            self.fill(backlog, [0, 1, 0, 0, 0])
+            self.assertEqual(backlog._in_memory, 3)
+            self.assertEqual(self.payloads(backlog, 0), expected)
+            self.assertEqual(self.payloads(backlog, 1), [1])
+            self.assertEqual(len(backlog), 0)
+            self.assertEqual(backlog.dropped, 0 if policy is BacklogPolicy.SPILL else 2)
+            self.assertEqual(backlog.spilled, 2 if policy is BacklogPolicy.SPILL else 0)
+
+    # Each simulation reports a path once, for all its nodes.
+    def test_reported_once_per_simulation(self):
+        for _ in range(2):
+            reports = BacklogReports()
+            with self.assertLogs(level="WARNING") as logs:
+                for node_id in range(2):
+                    self.fill(Backlog(NodeId(node_id), reports=reports), [0, 0])
+            self.assertEqual(len(logs.output), 1)
+        restored = pickle.loads(pickle.dumps(reports))
+        self.assertEqual(restored.path_ids, {self.paths[0].id})
+
+    def test_node_limit_drops_oldest_of_node(self):
+        backlog = Backlog(NodeId(0), node_limit=3)
+        self.fill(backlog, [0, 1, 2, 1, 0])
+        self.assertEqual((len(backlog), backlog.dropped), (3, 2))
+        self.assertEqual(self.payloads(backlog, 0), [4])
+        self.assertEqual(self.payloads(backlog, 1), [3])
+        self.assertEqual(self.payloads(backlog, 2), [2])
+
+    def test_node_limit_with_taken_paths(self):
+        backlog = Backlog(NodeId(0), node_limit=2, policy=BacklogPolicy.SPILL)
+        for _ in range(100):
+            self.fill(backlog, [0, 1, 2])
+            backlog.take(self.paths[1].id)
+        self.assertLess(len(backlog._order), 200)
+        self.assertEqual(backlog._in_memory, 1)
+        self.assertEqual(len(self.payloads(backlog, 0)), 100)
+        self.assertEqual(self.payloads(backlog, 2), [2] * 100)
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_subscribe_replays_backlog(self):
+        path = Path().append(name="late")
+        dispatcher = Dispatcher(NodeId(0), backlog=Backlog(NodeId(0), path_limit=2))
+        with self.assertLogs(level="WARNING") as logs:
+            for i in range(3):
+                dispatcher.deliver(Message(path, NodeId(1), i))
+        self.assertEqual(len(logs.output), 1)
+
+        received = []
+        dispatcher.deliver = None  # The backlog is replayed without going through deliver.
+        dispatcher.subscribe(path, lambda msg: received.append(msg.payload))
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(len(dispatcher.backlog), 0)
+
+
+@dataclass
+class Instance(Protocol):
+    received: list = field(default_factory=list)
+    created: list = field(default_factory=list)  # The instances created by the factory of the instance.
+    finished: set = field(default_factory=set)  # The ids of the finished instances created by the factory.
+
+    def start(self):
+        self.subscribe(self.path.append(name="data"), self.received.append)
+        self.subscribe(self.timer_path("done"), self.done)
+
+    def done(self, msg: Optional[Message] = None):
+        self.finish()
+        if self.parent is not None:
+            self.parent.finished.add(self.instance_id.id)
+
+    # Creates sub-instances, except for the "declined" ones.
+    def create(self, segment: PathSegment) -> Optional[Instance]:
+        if getattr(segment, "id", None) == "declined":
+            return None
+        if segment.id in self.finished:
+            return FINISHED
+        instance = Instance(instance_id=InstanceId(segment.id), node_id=self.node_id, network=None,
+                            dispatcher=self.dispatcher, parent=self)
+        self.created.append(instance)
+        return instance
+
+    def deliver(self, msg: Message):
+        pass
+
+
+class TestFactories(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = Dispatcher(NodeId(0))
+        self.root = Instance(instance_id=InstanceId("lazy"), node_id=NodeId(0), network=None,
+                             dispatcher=self.dispatcher)
+        self.prefix = self.root.path
+        self.created = self.root.created
+        self.dispatcher.register_factory(self.prefix, self.root.create)
+
+    def data_path(self, instance: str, prefix: Optional[Path] = None) -> Path:
+        return (prefix or self.prefix).append(InstanceId(instance)).append(name="data")
+
+    def test_created_on_first_message(self):
+        self.assertEqual(self.created, [])
+        for i in range(2):
+            self.dispatcher.deliver(Message(self.data_path("a"), NodeId(1), i))
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual([msg.payload for msg in self.created[0].received], [0, 1])
+
+    def test_declined_and_unknown_paths_are_backlogged(self):
+        self.dispatcher.deliver(Message(self.data_path("declined"), NodeId(1), 0))
+        self.dispatcher.deliver(Message(self.prefix.append(InstanceId("a")).append(name="other"), NodeId(1), 1))
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(len(self.dispatcher.backlog), 2)
+
+    def test_released_instance_discards_messages(self):
+        self.dispatcher.deliver(Message(self.data_path("a"), NodeId(1), 0))
+        instance = self.created[0]
+        self.dispatcher.deliver(Message(instance.timer_path("done"), NodeId(0)))
+        self.assertEqual(self.dispatcher._instances, {})
+        self.assertEqual(self.dispatcher._subscriptions, {})
+        self.dispatcher.deliver(Message(self.data_path("a"), NodeId(1), 1))
+        self.assertEqual((len(self.created), len(instance.received), self.dispatcher.discarded), (1, 1, 1))
+        self.assertEqual(len(self.dispatcher.backlog), 0)
+
+    def test_released_instances_leave_no_state(self):
+        for i in range(100):
+            self.dispatcher.deliver(Message(self.data_path(str(i)), NodeId(1), 0))
+            self.created[-1].done()
+        self.assertEqual((self.dispatcher._instances, self.dispatcher._owned), ({}, {}))
+        self.assertEqual(list(self.dispatcher._factories), [self.prefix])
+        # Unknown paths are looked up without interning their prefixes.
+        path = Path(tuple(PathSegment(name="unknown", index=i) for i in range(5)))
+        interned = len(Path._paths)
+        self.dispatcher.deliver(Message(path, NodeId(1), 0))
+        self.assertEqual(len(Path._paths), interned)
+
+    def test_release_nested_instances(self):
+        self.dispatcher.deliver(Message(self.data_path("a"), NodeId(1), 0))
+        outer = self.created[0]
+        self.dispatcher.register_factory(outer.path, outer.create)
+        self.dispatcher.deliver(Message(self.data_path("b", outer.path), NodeId(1), 0))
+        self.assertEqual(len(outer.created), 1)
+        outer.done()
+        self.assertEqual((self.dispatcher._instances, self.dispatcher._subscriptions), ({}, {}))
+        self.assertEqual(list(self.dispatcher._factories), [self.prefix])
+
+    def test_pickle(self):
+        self.dispatcher.deliver(Message(self.data_path("a"), NodeId(1), 0))
+        self.dispatcher.deliver(Message(self.data_path("b"), NodeId(1), 0))
+        self.created[1].done()
+        restored: Dispatcher = pickle.loads(pickle.dumps(self.dispatcher))
+        restored.deliver(Message(self.data_path("a"), NodeId(1), 1))
+        restored.deliver(Message(self.data_path("b"), NodeId(1), 1))
+        (instance,) = restored._instances.values()
+        self.assertEqual([msg.payload for msg in instance.received], [0, 1])
+        self.assertEqual(restored.discarded, 1)
+
+
+@dataclass
+class RecordingBroadcast(EchoConsistentBroadcast):
+    started: bool = False
+    received: list = field(default_factory=list)
+
+    def start(self):
+        self.started = True
+        self.subscribe(self.path.append(name="echo"), self.received.append)
+
+
+class TestBrachaBinaryConsensus(unittest.TestCase):
+    def test_broadcasts_created_and_started(self):
+        dispatcher = Dispatcher(NodeId(1))
+        factory = ProtocolFactory(RecordingBroadcast, NodeId(1), None, dispatcher)
+        consensus = BrachaBinaryConsensus(instance_id=InstanceId("consensus"), node_id=NodeId(1), network=None,
+                                          dispatcher=dispatcher, value=True, broadcast_factory=factory)
+        consensus.start()
+        (own,) = dispatcher._instances.values()
+        self.assertEqual((own.sender, own.value, own.started, own.parent), (1, "v", True, consensus))
+
+        path = consensus.path.append(InstanceId(("broadcast", 2))).append(name="echo")
+        dispatcher.deliver(Message(path, NodeId(2), "echo"))
+        other = dispatcher._instances[Path(path[:-1])]
+        self.assertEqual((other.sender, other.value, other.started), (2, False, True))
+        self.assertEqual([msg.payload for msg in other.received], ["echo"])
+        self.assertIs(dispatcher.instantiate(other.path), other)
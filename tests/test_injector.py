@@ -3,9 +3,11 @@ import logging
 import unittest
 from typing import Annotated
 
-from core import EventQueue, Network, NodeId, Dispatcher, Node, Protocol, InstanceId, Group, Simulator
+from core import EventQueue, Network, NodeId, Dispatcher, Node, Protocol, InstanceId, Group, Simulator, \
+    LatencyModel, GeoLatencyModel
 from injection.injector import Injector
 from injection import Factory, Scope
+from helpers import deliveries, run_ping
 from protocols.implementations import BroadcastPing
 
 logging.basicConfig(level=logging.DEBUG)
@@ -39,6 +41,7 @@ class TestInjector(unittest.TestCase):
         injector = self.injector
 
         injector.provide(EventQueue, scope=Scope.SINGLETON)
+        injector.provide(LatencyModel, constructor=GeoLatencyModel, scope=Scope.SINGLETON)
         injector.provide(Network, scope=Scope.SINGLETON)
         injector.provide(Dispatcher, scope=Scope.NODE)
 
@@ -85,3 +88,58 @@ class TestInjector(unittest.TestCase):
     def test_factory(self):
         factory = self.injector.get(Factory[EventQueue])
         self.assertIs(type(factory.create()), EventQueue)
+
+    def test_plan_is_cached(self):
+        @dataclass
+        class B:
+            a: A
+
+        self.injector.provide(A, constructor=A, scope=Scope.UNSCOPED)
+        self.injector.get(B)
+        plan = self.injector._plans[B]
+        self.injector.get(B)
+        self.assertIs(self.injector._plans[B], plan)
+        self.assertEqual(plan.parameters, [("a", A)])
+
+    def test_plan_follows_new_bindings(self):
+        @dataclass
+        class B:
+            value: Annotated[int, 'value'] = 0
+
+        self.assertEqual(self.injector.get(B).value, 0)
+        self.injector.supply(Annotated[int, 'value'], 666)
+        self.assertEqual(self.injector.get(B).value, 666)
+
+    def test_node_scope(self):
+        self.injector.provide(A, constructor=A, scope=Scope.NODE)
+        with self.assertRaises(Exception):
+            self.injector.get(A)
+        self.injector.enter_node_scope(NodeId(0))
+        a = self.injector.get(A)
+        self.assertIs(self.injector.get(A), a)
+        self.assertEqual(self.injector.get(NodeId), NodeId(0))
+        self.injector.exit_node_scope()
+        self.injector.enter_node_scope(NodeId(1))
+        self.assertIsNot(self.injector.get(A), a)
+        self.injector.exit_node_scope()
+
+    def test_instantiate_per_node(self):
+        self.injector.provide(A, constructor=A, scope=Scope.NODE)
+        objects = self.injector.instantiate_per_node(A, [NodeId(i) for i in range(10)])
+        self.assertEqual(len(objects), 10)
+        self.assertEqual(len({id(a) for a in objects}), 10)
+        # The node-scoped bindings are not re-registered for every node.
+        self.assertEqual(len(self.injector._bindings_with_node_scope), 2)
+
+    def test_instantiate_per_node_in_workers(self):
+        def run(build_workers: int):
+            simulator = run_ping("--build_workers", str(build_workers), group_size=20)
+            return (simulator, deliveries(simulator))
+
+        (sequential, sequential_deliveries) = run(1)
+        (parallel, parallel_deliveries) = run(3)
+        self.assertEqual([node.id for node in parallel.nodes], list(range(20)))
+        for node in parallel.nodes:
+            self.assertIs(node.root_protocol.network, parallel.network)
+            self.assertIs(node.root_protocol.event_queue, parallel.event_queue)
+        self.assertEqual(parallel_deliveries, sequential_deliveries)
@@ -0,0 +1,206 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import geodata
+from core import EventQueue, GeoLatencyModel, Group, Message, NodeId, Path, haversine_km
+from helpers import ConstantLatencyModel
+from latency import BandwidthLatencyModel, ContinentLatencyModel, JitterLatencyModel, LocationLatencyModel
+from randomness import RandomStreams
+
+PEERS = [
+    {"latitude": "45.5088", "longitude": "-73.5878", "city": "Montréal", "country": "CA"},
+    {"latitude": "32.7157", "longitude": "-117.1647", "city": "San Diego", "country": "US"},
+    {"latitude": "50.1109", "longitude": "8.6821", "city": "Frankfurt", "country": "DE"},
+    {"latitude": "35.6895", "longitude": "139.6917", "city": "Tokyo", "country": "JP"},
+]
+
+
+class TestGeoDataset(unittest.TestCase):
+    def test_binary_matches_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "peers.json")
+            with open(json_path, "w") as f:
+                json.dump(PEERS + PEERS[:1], f)
+            parsed = geodata.load(json_path)
+            parsed.save(geodata.binary_path(json_path), source=json_path)
+            mapped = geodata.load(json_path)
+
+            self.assertIsInstance(mapped.latitude, np.memmap)
+            self.assertEqual(len(mapped), len(PEERS) + 1)
+            self.assertEqual(len(mapped.cities), len(PEERS))
+            for i in range(len(mapped)):
+                self.assertEqual(mapped.location(i), parsed.location(i))
+            self.assertEqual(mapped.location(0).city, "Montréal")
+
+    def test_stale_binary_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "peers.json")
+            with open(json_path, "w") as f:
+                json.dump(PEERS, f)
+            geodata.load(json_path).save(geodata.binary_path(json_path), source=json_path)
+            with open(json_path, "w") as f:
+                json.dump(PEERS[1:], f)
+            with self.assertLogs(level="WARNING"):
+                edited = geodata.load(json_path)
+            self.assertNotIsInstance(edited.latitude, np.memmap)
+            self.assertEqual(edited.location(0).city, "San Diego")
+
+
+class TestGeoLatencyModel(unittest.TestCase):
+    def setUp(self):
+        self.geo_data = tempfile.NamedTemporaryFile("w", suffix=".json")
+        json.dump(PEERS, self.geo_data)
+        self.geo_data.flush()
+        self.group = Group([NodeId(i) for i in range(16)])
+
+    def tearDown(self):
+        self.geo_data.close()
+
+    def build(self, lazy: bool) -> GeoLatencyModel:
+        return GeoLatencyModel(self.group, self.geo_data.name, lazy=lazy, seed=42)
+
+    def test_haversine(self):
+        # Montréal - San Diego, the geodesic distance is ~3970 km.
+        distance = haversine_km(*np.radians([45.5088, -73.5878, 32.7157, -117.1647]))
+        self.assertAlmostEqual(distance, 3970, delta=3970 * 0.005)
+
+    def test_dense_matrix(self):
+        model = self.build(lazy=False)
+        for src in self.group:
+            self.assertEqual(model.get_latency(src, src), 0)
+            for dst in self.group:
+                self.assertEqual(model.get_latency(src, dst), model.get_latency(dst, src))
+                # Latencies are stored in single precision.
+                expected = model.get_distance(src, dst) / 200 * 1.5
+                self.assertAlmostEqual(model.get_latency(src, dst), expected, places=3)
+
+    def test_lazy_matches_dense(self):
+        dense, lazy = self.build(lazy=False), self.build(lazy=True)
+        self.assertEqual(len(lazy._rows), 0)
+        for src in self.group:
+            for dst in self.group:
+                self.assertEqual(lazy.get_latency(src, dst), dense.get_latency(src, dst))
+        self.assertEqual(len(lazy._rows), len(self.group))
+
+    def test_lazy_cache_bounded(self):
+        dense, lazy = self.build(lazy=False), self.build(lazy=True)
+        lazy.cache_rows = 2
+        for src in self.group + self.group[:1]:
+            np.testing.assert_array_equal(lazy.get_latencies(src, self.group), dense.get_latencies(src, self.group))
+        self.assertEqual(list(lazy._rows), [len(self.group) - 1, 0])
+        self.assertEqual(dense._matrix.dtype, np.float32)
+
+
+class TestLocationLatencyModel(unittest.TestCase):
+    def setUp(self):
+        # Peers sharing coordinates, and two peers 10 km apart.
+        peers = PEERS + PEERS[:2] + [{"latitude": "50.2", "longitude": "8.6821", "city": "Bad Homburg", "country": "DE"}]
+        self.geo_data = tempfile.NamedTemporaryFile("w", suffix=".json")
+        json.dump(peers, self.geo_data)
+        self.geo_data.flush()
+        self.group = Group([NodeId(i) for i in range(64)])
+
+    def tearDown(self):
+        self.geo_data.close()
+
+    def test_matches_geo(self):
+        geo = GeoLatencyModel(self.group, self.geo_data.name, seed=42)
+        model = LocationLatencyModel(self.group, self.geo_data.name, seed=42)
+        self.assertEqual(model._latencies.shape, (5, 5))
+        self.assertEqual(model._locations.dtype, np.int16)
+        self.assertEqual(model._peers.dtype, np.int32)
+        self.assertFalse(hasattr(model, "_index"))
+        for src in self.group:
+            self.assertEqual(model.get_location(src), geo.get_location(src))
+            np.testing.assert_allclose(model.get_latencies(src, self.group), geo.get_latencies(src, self.group))
+            self.assertAlmostEqual(model.get_latency(src, NodeId(7)), geo.get_latency(src, NodeId(7)))
+
+    def test_clustering(self):
+        model = LocationLatencyModel(self.group, self.geo_data.name, resolution_km=50, seed=42)
+        self.assertEqual(model._latencies.shape, (4, 4))
+        frankfurt = [node_id for node_id in self.group if model.get_location(node_id).country == "DE"]
+        self.assertEqual(model.get_latencies(frankfurt[0], frankfurt).tolist(), [0.0] * len(frankfurt))
+
+    def test_node_ids(self):
+        group = Group([NodeId(i) for i in range(100, 164)])
+        (model, reference) = (LocationLatencyModel(group, self.geo_data.name, seed=42),
+                              LocationLatencyModel(self.group, self.geo_data.name, seed=42))
+        self.assertEqual(model.get_latencies(NodeId(103), group[::-1]).tolist(),
+                         reference.get_latencies(NodeId(3), self.group[::-1]).tolist())
+        self.assertEqual(model.get_latency(NodeId(110), NodeId(120)), reference.get_latency(NodeId(10), NodeId(20)))
+
+
+class TestStochasticLatencyModels(unittest.TestCase):
+    def setUp(self):
+        self.group = Group([NodeId(i) for i in range(4)])
+
+    def test_jitter(self):
+        models = [JitterLatencyModel(ConstantLatencyModel(), self.group, RandomStreams(0), ratio=0.5, block_size=8)
+                  for _ in range(2)]
+        unicasts = [models[0].get_latency(NodeId(0), NodeId(1)) for _ in range(20)]
+        multicast = models[1].get_latencies(NodeId(0), [NodeId(1)] * 20)
+        # Every node has its own stream, whether its draws are taken one by one or in blocks.
+        models[1].get_latencies(NodeId(1), [NodeId(0)] * 5)
+        np.testing.assert_allclose(unicasts + [models[0].get_latency(NodeId(0), NodeId(1))],
+                                   list(multicast) + [models[1].get_latency(NodeId(0), NodeId(1))])
+        self.assertTrue(all(latency >= 10 for latency in unicasts))
+        self.assertAlmostEqual(np.mean(models[0].get_latencies(NodeId(9), [NodeId(0)] * 10000)), 15, delta=0.3)
+        np.testing.assert_array_equal(models[0].get_min_latencies(NodeId(0), self.group), [10] * 4)
+
+    def test_bandwidth(self):
+        event_queue = EventQueue()
+        # 8 Mbps: 1 ms per kB.
+        model = BandwidthLatencyModel(ConstantLatencyModel(), event_queue, self.group, RandomStreams(0), uplink_mbps=8)
+        msg = Message(Path(), NodeId(0), b"x" * 1000)
+        self.assertAlmostEqual(model.get_message_latency(msg, NodeId(1)), 11)
+        np.testing.assert_allclose(model.get_message_latencies(msg, [NodeId(1), NodeId(2)]), [12, 13])
+        event_queue.clock = 2.5
+        self.assertAlmostEqual(model.get_message_latency(msg, NodeId(1)), 11.5)
+        event_queue.clock = 100
+        self.assertAlmostEqual(model.get_message_latency(Message(Path(), NodeId(1), None), NodeId(0)), 10)
+        self.assertAlmostEqual(model.get_message_latency(msg, NodeId(1)), 11)
+
+    def test_continent(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            geo_path = os.path.join(tmp, "peers.json")
+            with open(geo_path, "w") as f:
+                json.dump([dict(peer, continent=continent) for (peer, continent) in zip(PEERS, ["NA", "NA", "EU", ""])],
+                          f)
+            tables_path = os.path.join(tmp, "rtt.json")
+            with open(tables_path, "w") as f:
+                json.dump({"default": 300, "continents": {"NA": {"NA": 40, "EU": 100}}, "countries": {"US": {"CA": 20}}},
+                          f)
+            group = Group([NodeId(i) for i in range(32)])
+            model = ContinentLatencyModel(group, geo_path, tables_path, seed=0)
+
+        countries = {node_id: model.get_location(node_id).country for node_id in group}
+        expected = {frozenset(["CA"]): 20, frozenset(["US"]): 20, frozenset(["CA", "US"]): 10,
+                    frozenset(["CA", "DE"]): 50, frozenset(["US", "DE"]): 50, frozenset(["DE"]): 150}
+        for src in group:
+            latencies = model.get_latencies(src, group)
+            for dst in group:
+                pair = frozenset([countries[src], countries[dst]])
+                self.assertEqual(latencies[dst], model.get_latency(src, dst))
+                self.assertEqual(latencies[dst], 0 if src == dst else expected.get(pair, 150))
+
+    def test_unknown_continent_from_country(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            geo_path = os.path.join(tmp, "peers.json")
+            with open(geo_path, "w") as f:
+                json.dump([dict(PEERS[2], continent="EU"), dict(PEERS[2], continent=""),
+                           dict(PEERS[3], continent="")], f)
+            tables_path = os.path.join(tmp, "rtt.json")
+            with open(tables_path, "w") as f:
+                json.dump({"default": 300, "continents": {"EU": {"EU": 30}}}, f)
+            group = Group([NodeId(i) for i in range(16)])
+            model = ContinentLatencyModel(group, geo_path, tables_path, seed=0)
+
+        countries = {node_id: model.get_location(node_id).country for node_id in group}
+        for src in group:
+            for dst in group:
+                expected = 15 if countries[src] == countries[dst] == "DE" else 150
+                self.assertEqual(model.get_latency(src, dst), 0 if src == dst else expected)
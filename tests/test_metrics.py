@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core import Message, NodeId, Path, Simulator
+from injection import Injector
+from metrics import PAIR_CLASSES, Histogram, Metrics, TimeSeries
+from protosim import build_parser, load_modules
+
+
+class TestHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        values = np.random.default_rng(0).lognormal(3, 1.5, 10000)
+        histogram = Histogram()
+        histogram.record_many(values)
+        for q in (1, 50, 90, 99, 99.9):
+            expected = np.percentile(values, q, method='inverted_cdf')
+            self.assertAlmostEqual(histogram.percentile(q) / expected, 1, delta=2 ** -7)
+        self.assertEqual(histogram.percentile(100), values.max())
+        self.assertEqual(histogram.count, len(values))
+        self.assertAlmostEqual(histogram.mean(), values.mean())
+
+    def test_record_matches_record_many(self):
+        values = [0.0, 0.0004, 0.2, 1.5, 1.5, 90.0, 1e12]
+        (one, many) = (Histogram(), Histogram())
+        for value in values:
+            one.record(value)
+        many.record_many(np.array(values))
+        self.assertEqual(one.counts.tolist(), many.counts.tolist())
+        self.assertEqual((one.min, one.max), (many.min, many.max))
+
+    def test_merge(self):
+        (first, second) = (Histogram(), Histogram())
+        first.record_many(np.arange(100.0))
+        second.record_many(np.arange(100.0, 200.0))
+        first.merge(second)
+        self.assertEqual(first.count, 200)
+        self.assertAlmostEqual(first.percentile(50), 99, delta=1)
+        self.assertEqual((first.min, first.max), (0, 199))
+
+    def test_allocates_recorded_range(self):
+        histogram = Histogram()
+        histogram.record(120.0)
+        histogram.record_many(np.linspace(50, 200, 1000))
+        self.assertLess(histogram._counts.nbytes, 8 * 1024)
+        self.assertEqual(histogram.counts.sum(), 1001)
+
+    def test_empty(self):
+        self.assertTrue(np.isnan(Histogram().percentile(50)))
+
+
+class TestTimeSeries(unittest.TestCase):
+    def test_coalesce(self):
+        series = TimeSeries(bin_ms=10, max_bins=4)
+        for instant in range(0, 80, 5):
+            series.add(instant, 1)
+        self.assertEqual(series.bin_ms, 20)
+        self.assertEqual(series.values.tolist(), [4, 4, 4, 4])
+        self.assertEqual(series.rates(), [200, 200, 200, 200])
+
+    def test_maximum(self):
+        series = TimeSeries(bin_ms=10, max_bins=2, maximum=True)
+        for (instant, value) in ((0, 3), (5, 1), (10, 2), (25, 7)):
+            series.add(instant, value)
+        self.assertEqual(series.values.tolist(), [3, 7])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_simulation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "metrics.jsonl")
+            args = build_parser().parse_args(["ping", "-g", "30", "-s", "2", "--metrics", output,
+                                              "--metrics_interval", "20"])
+            injector = Injector(args, load_modules(args.modules))
+            simulator = injector.get(Simulator)
+            simulator.run()
+            metrics = injector.get(Metrics)
+            metrics.export()
+            with open(output) as f:
+                lines = [json.loads(line) for line in f]
+
+        self.assertIs(simulator.network.metrics, metrics)
+        self.assertEqual(metrics.latency.count, 59)
+        self.assertEqual(sum(histogram.count for histogram in metrics.latency_by_path.values()), 59)
+        self.assertLessEqual(set(metrics.latency_by_class), set(PAIR_CLASSES))
+        self.assertEqual(sum(histogram.count for histogram in metrics.latency_by_class.values()), 59)
+        self.assertEqual(metrics.delivered.values.sum(), simulator.processed_events)
+        self.assertEqual(metrics.sent.values.sum(), 59)
+        self.assertGreater(len(lines), 1)
+        self.assertEqual(lines[-1]["latency"]["count"], 59)
+        self.assertEqual([line["instant"] for line in lines], sorted(line["instant"] for line in lines))
+
+    def test_unclassified(self):
+        metrics = Metrics()
+        metrics.send(0, Message(Path().append(name="metrics"), NodeId(0)), NodeId(1), 5.0)
+        self.assertEqual(list(metrics.latency_by_class), ["unclassified"])
+
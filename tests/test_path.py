@@ -0,0 +1,34 @@
+import pickle
+import unittest
+
+from core import InstanceId, Path, PathSegment
+
+
+class TestPath(unittest.TestCase):
+    def test_segments_are_interned(self):
+        self.assertIs(PathSegment(name="ping", round=1), PathSegment(round=1, name="ping"))
+        self.assertIsNot(PathSegment(name="ping"), PathSegment(name="pong"))
+        self.assertIs(InstanceId(("root", 0)), InstanceId(id=("root", 0)))
+        self.assertIsNot(InstanceId(id="root"), PathSegment(id="root"))
+        self.assertEqual(InstanceId(id="root").id, "root")
+
+    def test_unused_segments_are_freed(self):
+        number = PathSegment(name="transient")._number
+        self.assertNotEqual(PathSegment(name="transient")._number, number)
+        segment = PathSegment(name="kept")
+        self.assertIs(PathSegment(name="kept"), segment)
+        self.assertNotEqual(hash(PathSegment(name="other")), hash(segment))
+
+    def test_paths_are_interned(self):
+        root = Path().append(InstanceId(id="root"))
+        self.assertIs(root, Path((PathSegment(id="root"),)))
+        self.assertIs(root.append(name="ping"), root.append(name="ping"))
+        self.assertEqual(root.append(name="ping"), Path(root + (PathSegment(name="ping"),)))
+        self.assertNotEqual(root.append(name="ping"), root.append(name="pong"))
+        self.assertIs(Path.from_id(root.append(name="ping").id), root.append(name="ping"))
+        self.assertEqual(hash(root), root.id)
+
+    def test_pickle(self):
+        path = Path().append(InstanceId(id="root")).append(name="ping")
+        self.assertIs(pickle.loads(pickle.dumps(path)), path)
+        self.assertIs(pickle.loads(pickle.dumps(InstanceId(id="root"))), InstanceId(id="root"))
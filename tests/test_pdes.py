@@ -0,0 +1,98 @@
+import math
+import unittest
+from argparse import Namespace
+from dataclasses import dataclass
+
+from core import Group, LatencyModel, Message, NodeId, Protocol, Simulator
+from helpers import root_protocol_module
+from injection import Injector
+from pdes import PARTITION_IMBALANCE, ParallelSimulator, compute_lookahead, partition_nodes, run_sequential
+from protosim import build_parser, load_modules
+
+
+# Every node broadcasts a hello, and acknowledges every hello with two messages, the second one relayed by a third node.
+@dataclass(kw_only=True)
+class Echo(Protocol):
+    group: Group
+
+    def start(self):
+        self.subscribe(self.path.append(name="hello"), self.deliver_hello)
+        self.subscribe(self.path.append(name="ack"), self.deliver_ack)
+        self.subscribe(self.path.append(name="relay"), self.deliver_relay)
+        self.broadcast(Message(self.path.append(name="hello"), self.node_id, self.node_id), self.group)
+
+    def deliver_hello(self, msg: Message):
+        self.send(Message(self.path.append(name="ack"), self.node_id, (msg.payload, 0)), msg.sender)
+        relay = NodeId((self.node_id + msg.sender) % len(self.group))
+        self.send(Message(self.path.append(name="relay"), self.node_id, msg.sender), relay)
+
+    def deliver_relay(self, msg: Message):
+        self.send(Message(self.path.append(name="ack"), self.node_id, (msg.payload, 1)), msg.payload)
+
+    def deliver_ack(self, msg: Message):
+        pass
+
+
+class TestPartitions(unittest.TestCase):
+    # Co-located nodes are kept together, and the partitions stay balanced.
+    def test_partition_nodes(self):
+        args = build_parser().parse_args(["ping", "-g", "300", "-s", "0"])
+        injector = Injector(args, load_modules(args.modules))
+        (group, latency_model) = (injector.get(Group), injector.get(LatencyModel))
+        for count in (2, 4):
+            partitions = partition_nodes(group, latency_model, count)
+            self.assertEqual(sorted(node_id for nodes in partitions for node_id in nodes), group)
+            self.assertLessEqual(max(map(len, partitions)), math.ceil(len(group) / count * PARTITION_IMBALANCE))
+            self.assertGreater(compute_lookahead(group, latency_model, partitions), 0)
+
+
+class TestParallelSimulator(unittest.TestCase):
+    def args(self, group_size: int, seed: int) -> Namespace:
+        args = build_parser().parse_args(["ping"])
+        (args.group_size, args.seed) = (group_size, seed)
+        return args
+
+    def test_matches_sequential(self):
+        modules = load_modules([]) + [root_protocol_module(Echo)]
+        for (group_size, seed, partitions) in [(12, 0, 2), (24, 1, 3), (5, 2, 8)]:
+            args = self.args(group_size, seed)
+            sequential = run_sequential(args, modules)
+            self.assertEqual(len(sequential), group_size ** 2 * 4)
+            simulator = ParallelSimulator(args, modules, partitions, record_deliveries=True, min_lookahead_ratio=0)
+            self.assertEqual(simulator.run(), sequential)
+            self.assertEqual(simulator.processed_events, len(sequential))
+
+    def test_ping(self):
+        args = self.args(16, 3)
+        modules = load_modules(args.modules)
+        parallel = ParallelSimulator(args, modules, 4, record_deliveries=True, min_lookahead_ratio=0)
+        self.assertEqual(parallel.run(), run_sequential(args, modules))
+
+    def test_stochastic_latencies(self):
+        args = self.args(16, 4)
+        (args.jitter, args.uplink_mbps, args.uplink_spread) = (0.5, 1.0, 0.5)
+        modules = load_modules([]) + [root_protocol_module(Echo)]
+        parallel = ParallelSimulator(args, modules, 3, record_deliveries=True, min_lookahead_ratio=0)
+        self.assertEqual(parallel.run(), run_sequential(args, modules))
+
+    def test_short_lookahead_runs_sequentially(self):
+        args = self.args(16, 3)
+        modules = load_modules(args.modules)
+        parallel = ParallelSimulator(args, modules, 4, record_deliveries=True, min_lookahead_ratio=1)
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertEqual(parallel.run(), run_sequential(args, modules))
+        self.assertIn("simulating sequentially", "\n".join(logs.output))
+        self.assertEqual(parallel.processed_events, 31)
+
+    def test_requires_seed(self):
+        with self.assertRaises(ValueError):
+            ParallelSimulator(self.args(4, None), load_modules(["ping"]), 2)
+
+    def test_summary(self):
+        args = self.args(16, 3)
+        modules = load_modules(args.modules)
+        simulator = ParallelSimulator(args, modules, 4)
+        self.assertIsNone(simulator.run())
+        sequential = Injector(args, modules).get(Simulator)
+        sequential.run()
+        self.assertEqual(simulator.summary(), sequential.summary())
@@ -0,0 +1,53 @@
+import unittest
+
+from core import Simulator
+from helpers import build_injector, deliveries
+from injection import Injector
+from profiling import Profiler
+
+
+def run(*options: str) -> tuple[Simulator, Injector]:
+    injector = build_injector(*options, group_size=20, seed=3)
+    simulator = injector.get(Simulator)
+    simulator.deliveries = []
+    simulator.run()
+    return simulator, injector
+
+
+class TestProfiling(unittest.TestCase):
+    def test_profile(self):
+        (expected, _) = run()
+        (simulator, injector) = run("--profile")
+        profiler = injector.get(Profiler)
+        self.assertIs(simulator.profiler, profiler)
+        self.assertEqual(deliveries(simulator), deliveries(expected))
+
+        operations = profiler.operations
+        self.assertEqual(operations["callback", "BroadcastPing.deliver_ping"].calls, 19)
+        self.assertEqual(operations["callback", "BroadcastPing.deliver_pong"].calls, 19)
+        self.assertEqual(operations["network", "broadcast"].calls, 1)
+        self.assertEqual(operations["network", "send"].calls, 19)
+        self.assertEqual(operations["event queue", "push"].calls, 19)
+        self.assertEqual(operations["node", "start"].calls, 20)
+        self.assertEqual(operations["event queue", "pop"].calls, profiler.steps)
+        self.assertLessEqual(sum(timing.ns for timing in operations.values()), profiler.run_ns)
+
+        prefixes = profiler.path_prefixes()
+        self.assertEqual(prefixes["(PathSegment(id='root'),)"].calls, 38)
+        self.assertEqual(prefixes["(PathSegment(id='root'), PathSegment(name='ping'))"].calls, 19)
+        report = profiler.report()
+        self.assertIn("callback BroadcastPing.deliver_ping", report)
+        self.assertIn("simulator (dispatch and other)", report)
+
+    def test_sampling(self):
+        (_, injector) = run("--profile", "--profile_period", "3")
+        profiler = injector.get(Profiler)
+        timed_steps = (profiler.steps + 2) // 3
+        self.assertEqual(profiler.operations["event queue", "pop"].calls, 3 * timed_steps)
+        self.assertEqual(sum(timing.calls for (kind, _), timing in profiler.operations.items() if kind == "callback")
+                         % 3, 0)
+
+    def test_not_profiled(self):
+        (simulator, _) = run()
+        self.assertIsNone(simulator.profiler)
+        self.assertIsNone(simulator.network.profiler)
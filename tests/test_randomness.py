@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from core import NodeId
+from helpers import build_injector, deliveries, run_ping
+from randomness import RandomStreams
+
+
+class TestRandomStreams(unittest.TestCase):
+    def test_streams_do_not_depend_on_request_order(self):
+        (a, b) = (RandomStreams(7), RandomStreams(7))
+        first = a.generator("x").random(5)
+        a.generator("y").random(5)
+        b.generator("y", NodeId(3)).random(5)
+        np.testing.assert_array_equal(b.generator("x").random(5), first)
+        self.assertEqual(a.python_random("x", 1).random(), b.python_random("x", 1).random())
+
+    def test_streams_are_independent(self):
+        streams = RandomStreams(7)
+        draws = [streams.generator("x").random(), streams.generator("y").random(),
+                 streams.generator("x", 0).random(), streams.generator("x", 1).random(),
+                 RandomStreams(8).generator("x").random()]
+        self.assertEqual(len(set(draws)), len(draws))
+
+    def test_unseeded_streams_can_be_reproduced(self):
+        streams = RandomStreams()
+        self.assertEqual(RandomStreams(streams.entropy).generator("x").random(), streams.generator("x").random())
+
+    def test_seeded_runs_are_identical(self):
+        (first, again, other) = [deliveries(run_ping(group_size=20, seed=seed)) for seed in (3, 3, 4)]
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+
+    def test_node_generators(self):
+        injector = build_injector()
+        draws = []
+        for node_id in (NodeId(0), NodeId(1), NodeId(0)):
+            injector.enter_node_scope(node_id)
+            draws.append(injector.get(np.random.Generator).random())
+            injector.exit_node_scope()
+        self.assertEqual(draws[0], draws[2])
+        self.assertNotEqual(draws[0], draws[1])
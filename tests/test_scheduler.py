@@ -0,0 +1,121 @@
+import random
+import unittest
+
+from core import ArrayScheduler, CalendarScheduler, Event, EventQueue, HeapScheduler, Message, NodeId, Path
+
+
+def drain(event_queue: EventQueue) -> list[tuple[float, Event]]:
+    events = []
+    while event_queue:
+        event = event_queue.pop()
+        events.append((event_queue.clock, event))
+    return events
+
+
+def deliveries(event_queue: EventQueue) -> list[tuple[float, NodeId, Message]]:
+    return [(instant, event.node_id, event.message) for (instant, event) in drain(event_queue)]
+
+
+class TestSchedulers(unittest.TestCase):
+    def simulate(self, event_queue: EventQueue, seed: int) -> list[tuple[float, Event]]:
+        rng = random.Random(seed)
+        processed = []
+        for i in range(200):
+            event_queue.push(Event(rng.choice([0, 1, 2.5, rng.uniform(0, 300)]), NodeId(i % 7), Message(Path(), i)))
+        # Every processed event schedules up to two new ones, with delays spread over several orders of magnitude.
+        while event_queue:
+            event = event_queue.pop()
+            processed.append((event_queue.clock, event))
+            if len(processed) < 5000:
+                for _ in range(rng.randint(0, 2)):
+                    delay = rng.choice([0, 0.5, rng.uniform(0, 10), rng.uniform(0, 1000)])
+                    event_queue.push(Event(delay, NodeId(rng.randrange(7)), Message(Path(), len(processed))))
+        return processed
+
+    def test_calendar_matches_heap(self):
+        for seed in range(5):
+            heap = self.simulate(EventQueue(scheduler=HeapScheduler()), seed)
+            calendar = self.simulate(EventQueue(scheduler=CalendarScheduler()), seed)
+            self.assertEqual([instant for (instant, _) in heap], sorted(instant for (instant, _) in heap))
+            self.assertEqual(heap, calendar)
+
+    def test_array_matches_heap(self):
+        for seed in range(5):
+            heap = self.simulate(EventQueue(scheduler=HeapScheduler()), seed)
+            for scheduler in (ArrayScheduler(), ArrayScheduler(front_size=16, capacity=4)):
+                self.assertEqual(self.simulate(EventQueue(scheduler=scheduler), seed), heap)
+
+    def test_ties_are_fifo(self):
+        for scheduler in (HeapScheduler(), CalendarScheduler(), ArrayScheduler(front_size=2)):
+            event_queue = EventQueue(scheduler=scheduler)
+            for node_id in (3, 1, 2):
+                event_queue.push(Event(5, NodeId(node_id), Message(Path(), NodeId(0))))
+            self.assertEqual([event.node_id for (_, event) in drain(event_queue)], [3, 1, 2])
+
+    def test_calendar_resizes(self):
+        scheduler = CalendarScheduler(bucket_count=4)
+        for seq, instant in enumerate(range(1000, 0, -1)):
+            scheduler.push(instant / 10, seq, None)
+        self.assertGreaterEqual(len(scheduler._buckets), 256)
+        self.assertEqual(scheduler.peek(), 0.1)
+        self.assertEqual([scheduler.pop()[0] for _ in range(1000)], [i / 10 for i in range(1, 1001)])
+        self.assertEqual(len(scheduler._buckets), 4)
+        with self.assertRaises(IndexError):
+            scheduler.pop()
+
+    def test_array_stores_rows(self):
+        scheduler = ArrayScheduler(front_size=8, capacity=4)
+        path = Path().append(name="test")
+        payload = ("a", "b")
+        for seq, instant in enumerate(range(1000, 0, -1)):
+            scheduler.push(instant / 10, seq, Event(instant / 10, NodeId(seq % 5), Message(path, NodeId(1), payload)))
+        # Events that cannot be stored as rows are kept whole.
+        special = Event(50, NodeId(2), Message(path, "not a node", payload))
+        scheduler.push(50, 1000, special)
+        self.assertEqual(len(scheduler), 1001)
+        self.assertEqual(len(scheduler._objects), 1001)
+
+        popped = [scheduler.pop() for _ in range(1001)]
+        self.assertEqual([instant for (instant, _) in popped], sorted(instant for (instant, _) in popped))
+        self.assertIs(popped[500][1], special)
+        self.assertEqual(popped[0], (0.1, Event(0.1, NodeId(4), Message(path, NodeId(1), payload))))
+        self.assertIs(popped[0][1].message.payload, payload)
+        self.assertLessEqual(len(scheduler._rows), 16)
+        with self.assertRaises(IndexError):
+            scheduler.peek()
+
+
+class TestMulticast(unittest.TestCase):
+    # Schedules the same messages as individual events and as multicasts, interleaved with unicast events.
+    def schedule(self, event_queue: EventQueue, multicast: bool, seed: int) -> list[tuple[float, NodeId, Message]]:
+        rng = random.Random(seed)
+        for i in range(20):
+            event_queue.clock = rng.choice([0, 0.1, 1e9])
+            msg = Message(Path(), NodeId(i))
+            node_ids = [NodeId(rng.randrange(10)) for _ in range(rng.randrange(50))]
+            # Few distinct delays, so that deliveries tie, also after rounding when added to a large clock.
+            delays = [rng.choice([1, 2, 2 + 1e-9, 3.5]) for _ in node_ids]
+            if multicast:
+                event_queue.push_multicast(msg, delays, node_ids)
+            else:
+                for (delay, node_id) in zip(delays, node_ids):
+                    event_queue.push(Event(delay, node_id, msg))
+            event_queue.push(Event(2, NodeId(rng.randrange(10)), Message(Path(), NodeId(-1))))
+        event_queue.clock = 0
+        return deliveries(event_queue)
+
+    def test_multicast_matches_unicast(self):
+        for scheduler_type in (HeapScheduler, CalendarScheduler, ArrayScheduler):
+            for seed in range(5):
+                unicast = self.schedule(EventQueue(scheduler=scheduler_type()), False, seed)
+                multicast_queue = EventQueue(scheduler=scheduler_type())
+                multicast = self.schedule(multicast_queue, True, seed)
+                self.assertEqual(multicast, unicast)
+                self.assertEqual(len(multicast_queue), 0)
+
+    def test_len_counts_deliveries(self):
+        event_queue = EventQueue()
+        event_queue.push_multicast(Message(Path(), NodeId(0)), [3, 1, 2], [NodeId(1), NodeId(2), NodeId(3)])
+        event_queue.push_multicast(Message(Path(), NodeId(0)), [], [])
+        self.assertEqual(len(event_queue), 3)
+        self.assertEqual([node_id for (_, node_id, _) in deliveries(event_queue)], [2, 3, 1])
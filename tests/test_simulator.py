@@ -0,0 +1,81 @@
+import logging
+import unittest
+from dataclasses import dataclass, field
+
+from core import Dispatcher, EventQueue, InstanceId, Message, Network, Node, NodeId, Protocol, Simulator
+from helpers import ConstantLatencyModel, build_ping
+
+
+# Node 0 sends the configured messages at start; every node records the messages it receives.
+@dataclass(kw_only=True)
+class Recorder(Protocol):
+    log: list
+    sends: list[tuple[NodeId, str]] = field(default_factory=list)
+
+    def start(self):
+        self.subscribe(self.path.append(name="msg"), self.deliver)
+        for (destination, payload) in self.sends:
+            self.send(Message(self.path.append(name="msg"), self.node_id, payload), destination)
+
+    def deliver(self, msg: Message):
+        self.log.append((self.network.event_queue.clock, self.node_id, msg.payload))
+
+
+def build_simulator(group_size: int, log: list, sends: list[tuple[NodeId, str]]) -> Simulator:
+    event_queue = EventQueue()
+    network = Network(event_queue, ConstantLatencyModel(1.0))
+    nodes = []
+    for i in range(group_size):
+        dispatcher = Dispatcher(NodeId(i))
+        protocol = Recorder(instance_id=InstanceId(id="root"), node_id=NodeId(i), network=network,
+                            dispatcher=dispatcher, log=log, sends=sends if i == 0 else [])
+        nodes.append(Node(NodeId(i), protocol, dispatcher))
+    return Simulator(nodes, event_queue, network)
+
+
+class TestSimulator(unittest.TestCase):
+    def test_same_instant_grouped_by_node(self):
+        log = []
+        sends = [(NodeId(2), "a"), (NodeId(1), "b"), (NodeId(2), "c"), (NodeId(0), "d"), (NodeId(1), "e")]
+        build_simulator(3, log, sends).run()
+        self.assertEqual(log, [(1.0, 0, "d"), (1.0, 1, "b"), (1.0, 1, "e"), (1.0, 2, "a"), (1.0, 2, "c")])
+
+    def test_run_with_debug_logging(self):
+        log = []
+        with self.assertLogs(level=logging.DEBUG) as logs:
+            build_simulator(2, log, [(NodeId(1), "a")]).run()
+        self.assertEqual(log, [(1.0, 1, "a")])
+        self.assertIn("DEBUG:root:Node 1 processing message", "\n".join(logs.output))
+
+
+class TestStepping(unittest.TestCase):
+    def setUp(self):
+        self.expected = build_ping()
+        self.expected.run()
+
+    def test_run_until_predicate(self):
+        simulator = build_ping()
+        self.assertTrue(simulator.run_until(lambda: simulator.processed_events >= 20))
+        self.assertGreaterEqual(simulator.processed_events, 20)
+        self.assertLess(simulator.processed_events, self.expected.processed_events)
+        self.assertFalse(simulator.run_until(lambda: False))
+        self.assertEqual(simulator.deliveries, self.expected.deliveries)
+
+    def test_predicate_checked_every_k_events(self):
+        simulator = build_ping()
+        checks = []
+        self.assertFalse(simulator.run_until(lambda: checks.append(simulator.processed_events), every=10))
+        self.assertEqual(checks[0], 0)
+        self.assertTrue(all(b - a >= 10 for (a, b) in zip(checks[:-2], checks[1:-1])))
+        self.assertLess(len(checks), self.expected.processed_events // 10 + 3)
+
+    def test_iter_events(self):
+        simulator = build_ping()
+        events = []
+        for (instant, event) in simulator.iter_events():
+            events.append((instant, event.node_id, event.message))
+            if len(events) == 20:
+                break
+        self.assertEqual(events, simulator.deliveries[:20])
+        events += [(instant, event.node_id, event.message) for (instant, event) in simulator.iter_events()]
+        self.assertEqual(events, self.expected.deliveries)
@@ -0,0 +1,19 @@
+import unittest
+
+from sweep import SweepConfig, run_simulation, run_sweep
+
+
+class TestSweep(unittest.TestCase):
+    def test_run_sweep(self):
+        configs = [SweepConfig(("ping",), group_size, seed, "geo", "heap") for group_size in (2, 8) for seed in (0, 1)]
+        rows = list(run_sweep(configs, jobs=2))
+        self.assertEqual(len(rows), len(configs))
+        for row in rows:
+            self.assertEqual(row["events"], 2 * row["group_size"] - 1)
+            self.assertLessEqual(row["latency_p50_ms"], row["latency_max_ms"])
+
+    def test_seeded_runs_are_reproducible(self):
+        config = SweepConfig(("ping",), 8, 3, "geo", "calendar")
+        first, second = run_simulation(config), run_simulation(config)
+        self.assertEqual(first["sim_time_ms"], second["sim_time_ms"])
+        self.assertEqual(first["latency_p90_ms"], second["latency_p90_ms"])
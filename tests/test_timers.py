@@ -0,0 +1,95 @@
+import math
+import random
+import unittest
+from dataclasses import dataclass
+
+from core import Event, EventQueue, Group, Message, NodeId, Protocol, Simulator
+from helpers import build_injector, root_protocol_module
+from protosim import load_modules
+from timers import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    # Compares the wheel with a sorted list of the pending timers, over delays spanning all the levels.
+    def test_order(self):
+        rng = random.Random(1)
+        wheel = TimerWheel(tick_ms=0.5)
+        (pending, now, seq) = ({}, 0.0, 0)
+        for _ in range(3000):
+            operation = rng.random()
+            if operation < 0.5:
+                delay = rng.choice([0, 0.1, 1, 10, 1e3, 1e5, 1e8, 1e10]) * rng.random()
+                timer = wheel.add(now + delay, seq, seq)
+                pending[seq] = timer
+                seq += 1
+            elif operation < 0.7 and pending:
+                timer = pending.pop(rng.choice(list(pending)))
+                self.assertTrue(wheel.cancel(timer))
+                self.assertFalse(wheel.cancel(timer))
+            elif pending:
+                expected = min((timer.instant, timer.seq) for timer in pending.values())
+                self.assertEqual(wheel.peek(), expected[0])
+                now = expected[0]
+                fired = wheel.pop_instant(now)
+                self.assertEqual(fired, sorted(seq for (seq, timer) in pending.items() if timer.instant == now))
+                for seq_fired in fired:
+                    self.assertFalse(pending.pop(seq_fired).pending)
+            self.assertEqual(len(wheel), len(pending))
+        while pending:
+            now = wheel.peek()
+            for seq_fired in wheel.pop_instant(now):
+                self.assertEqual(pending.pop(seq_fired).instant, now)
+        self.assertEqual(wheel.peek(), math.inf)
+
+    def test_event_queue_pop_merges_timers(self):
+        event_queue = EventQueue()
+        event_queue.set_timer(Event(5, NodeId(0), "timer at 5"))
+        event_queue.push(Event(10, NodeId(0), "event at 10"))
+        event_queue.set_timer(Event(10, NodeId(0), "timer at 10"))
+        popped = []
+        while event_queue:
+            popped.append((event_queue.pop().message, event_queue.clock))
+        self.assertEqual(popped, [("timer at 5", 5), ("event at 10", 10), ("timer at 10", 10)])
+        with self.assertRaises(IndexError):
+            event_queue.timers.pop()
+
+
+# Every node arms a timeout at start and cancels it when the ping arrives, except the pinger.
+@dataclass
+class TimeoutPing(Protocol):
+    group: Group
+    event_queue: EventQueue
+    timeout: float = 1000.0
+
+    def __post_init__(self):
+        super().__post_init__()
+        self._ping_path = self.path.append(name="ping")
+        self.timeouts: list[tuple[float, str]] = []
+
+    def start(self):
+        self.subscribe(self.timer_path("timeout"), self.deliver_timeout)
+        self.timer = self.set_timer(self.timeout, "timeout", payload="late")
+        if self.node_id == 0:
+            self.broadcast(Message(self._ping_path, self.node_id), self.group[1:])
+        else:
+            self.subscribe(self._ping_path, self.deliver_ping)
+
+    def deliver_ping(self, msg: Message):
+        self.cancel_timer(self.timer)
+
+    def deliver_timeout(self, msg: Message):
+        self.timeouts.append((self.event_queue.clock, msg.payload))
+
+
+class TestProtocolTimers(unittest.TestCase):
+    def test_timeouts(self):
+        modules = load_modules([]) + [root_protocol_module(TimeoutPing)]
+        simulator = build_injector(group_size=50, modules=modules).get(Simulator)
+        simulator.start()
+        self.assertEqual(len(simulator.event_queue.scheduler), 1)  # The broadcast, but no timer.
+        simulator.run()
+        protocols = [node.root_protocol for node in simulator.nodes]
+        self.assertEqual(protocols[0].timeouts, [(1000.0, "late")])
+        self.assertEqual([protocol.timeouts for protocol in protocols[1:]], [[]] * 49)
+        self.assertEqual(simulator.event_queue.clock, 1000.0)
+        self.assertEqual(len(simulator.event_queue), 0)
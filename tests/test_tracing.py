@@ -0,0 +1,42 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from core import Simulator
+from injection import Injector
+from protosim import build_parser, load_modules
+from tracing import Tracer, TraceKind, load_trace
+
+
+class TestTracing(unittest.TestCase):
+    def test_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracer = Tracer(directory, capacity=3)
+            tracer.record(TraceKind.SEND, 0.5, 1, 2, 0, 4)
+            tracer.record_many(TraceKind.SEND, 1.5, 1, list(range(7)), 0, 4)
+            tracer.record(TraceKind.DELIVER, 2.5, 2, 1, 0, 0)
+            tracer.close()
+
+            trace = load_trace(directory)
+            self.assertEqual(len(trace), 9)
+            self.assertEqual(trace.instant.tolist(), [0.5] + [1.5] * 7 + [2.5])
+            self.assertEqual(trace.dst.tolist(), [2, 0, 1, 2, 3, 4, 5, 6, 1])
+            self.assertEqual(trace.kind[-1], TraceKind.DELIVER)
+
+    def test_simulation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            args = build_parser().parse_args(["ping", "--group_size", "8", "--seed", "1", "--trace", directory])
+            injector = Injector(args, load_modules(args.modules))
+            simulator = injector.get(Simulator)
+            simulator.run()
+            injector.get(Tracer).close()
+
+            trace = load_trace(directory)
+            for kind in TraceKind:
+                self.assertEqual(np.count_nonzero(trace.kind == kind), 15)
+            self.assertEqual(trace.instant.max(), simulator.event_queue.clock)
+            self.assertEqual(trace.size.tolist(), [4] * 45)
+            self.assertEqual({trace.paths[path_id] for path_id in trace.path.tolist()},
+                             {"(PathSegment(id='root'), PathSegment(name='ping'))",
+                              "(PathSegment(id='root'), PathSegment(name='pong'))"})
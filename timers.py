@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import heapq
+import math
+from dataclasses import dataclass
+from typing import Any
+
+# Timers of the protocols, in a hierarchical timing wheel beside the event queue's scheduler.
+#
+# Instants are bucketed in ticks of `tick_ms`. The wheel has _LEVELS levels of _SLOTS slots: a timer whose tick
+# shares all but its last 8 bits with the cursor (the first tick not yet expired) is in a slot of level 0, one that
+# shares all but its last 16 bits in a slot of level 1, and so on, and the timers beyond the last level are in an
+# overflow table. Arming and cancelling a timer are thus O(1): they add it to or remove it from the table of its
+# slot. As the cursor advances, the slot of each level it enters is cascaded to the lower levels. The timers of the
+# slot of level 0 at the cursor expire: they move to a small heap ordered by instant and sequence number, from which
+# they are popped in the same order as the events of the scheduler.
+
+_BITS = 8
+_SLOTS = 1 << _BITS
+_MASK = _SLOTS - 1
+_LEVELS = 4
+
+# The levels of the timers that are not in the wheel.
+_DUE = -1  # In the heap of expired timers.
+_DONE = -2  # Fired or cancelled.
+
+
+# A timer, delivering an event at an instant.
+@dataclass(slots=True, eq=False)
+class Timer:
+    instant: float
+    seq: int
+    event: Any
+    tick: int
+    level: int = _DONE
+
+    # If the timer is still to fire.
+    @property
+    def pending(self) -> bool:
+        return self.level != _DONE
+
+
+@dataclass
+class TimerWheel:
+    tick_ms: float = 1.0
+
+    def __post_init__(self):
+        self._slots: list[list[dict[int, Timer]]] = [[{} for _ in range(_SLOTS)] for _ in range(_LEVELS)]
+        # The non-empty slots of each level, as bits.
+        self._occupied = [0] * _LEVELS
+        self._overflow: dict[int, Timer] = {}
+        # The expired timers, as (instant, sequence number, timer). Cancelled timers are removed lazily.
+        self._due: list[tuple[float, int, Timer]] = []
+        self._cursor = 0
+        self._size = 0
+
+    # Arms a timer delivering an event at an instant, ordered by its sequence number among the events of that instant.
+    def add(self, instant: float, seq: int, event: Any) -> Timer:
+        timer = Timer(instant, seq, event, int(instant // self.tick_ms))
+        self._place(timer)
+        self._size += 1
+        return timer
+
+    # Cancels a timer. Returns whether it was pending.
+    def cancel(self, timer: Timer) -> bool:
+        level = timer.level
+        if level == _DONE:
+            return False
+        if level == _LEVELS:
+            del self._overflow[timer.seq]
+        elif level != _DUE:
+            index = (timer.tick >> (_BITS * level)) & _MASK
+            slot = self._slots[level][index]
+            del slot[timer.seq]
+            if not slot:
+                self._occupied[level] &= ~(1 << index)
+        timer.level = _DONE
+        self._size -= 1
+        return True
+
+    # Returns the instant of the next timer.
+    def peek(self) -> float:
+        due = self._due
+        while True:
+            while due and due[0][2].level == _DONE:
+                heapq.heappop(due)
+            if due:
+                return due[0][0]
+            if not self._size:
+                return math.inf
+            self._advance()
+
+    # Removes the next timer, returning its instant and event.
+    def pop(self) -> tuple[float, Any]:
+        instant = self.peek()
+        if instant == math.inf:
+            raise IndexError("pop from an empty timer wheel")
+        timer = heapq.heappop(self._due)[2]
+        timer.level = _DONE
+        self._size -= 1
+        return (instant, timer.event)
+
+    # Removes the timers of the given instant, which must be the instant of the next timer, returning their events in
+    # order.
+    def pop_instant(self, instant: float) -> list[Any]:
+        events = []
+        while self.peek() == instant:
+            events.append(self.pop()[1])
+        return events
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _place(self, timer: Timer):
+        tick = timer.tick
+        if tick < self._cursor:
+            timer.level = _DUE
+            heapq.heappush(self._due, (timer.instant, timer.seq, timer))
+            return
+        level = max((tick ^ self._cursor).bit_length() - 1, 0) // _BITS
+        timer.level = level
+        if level == _LEVELS:
+            self._overflow[timer.seq] = timer
+            return
+        index = (tick >> (_BITS * level)) & _MASK
+        self._slots[level][index][timer.seq] = timer
+        self._occupied[level] |= 1 << index
+
+    # Advances the cursor to the next non-empty slot: expires the timers of a slot of level 0, or cascades a slot of a
+    # higher level. There are no timers between the cursor and that slot.
+    def _advance(self):
+        cursor = self._cursor
+        for level in range(_LEVELS):
+            shift = _BITS * level
+            position = (cursor >> shift) & _MASK
+            bits = self._occupied[level] >> position
+            if not bits:
+                continue
+            index = position + (bits & -bits).bit_length() - 1
+            start = (cursor >> (shift + _BITS) << (shift + _BITS)) | (index << shift)
+            if level:
+                self._move(start)
+                return
+            slot = self._slots[0][index]
+            self._slots[0][index] = {}
+            self._occupied[0] &= ~(1 << index)
+            for timer in slot.values():
+                timer.level = _DUE
+                heapq.heappush(self._due, (timer.instant, timer.seq, timer))
+            self._move(start + 1)
+            return
+        self._move(min(timer.tick for timer in self._overflow.values()))
+
+    # Moves the cursor forward, cascading the slots it enters.
+    def _move(self, cursor: int):
+        (previous, self._cursor) = (self._cursor, cursor)
+        if (cursor ^ previous) >> (_BITS * _LEVELS):
+            (overflow, self._overflow) = (self._overflow, {})
+            for timer in overflow.values():
+                self._place(timer)
+        for level in range(_LEVELS - 1, 0, -1):
+            if not (cursor ^ previous) >> (_BITS * level):
+                continue
+            index = (cursor >> (_BITS * level)) & _MASK
+            slot = self._slots[level][index]
+            if slot:
+                self._slots[level][index] = {}
+                self._occupied[level] &= ~(1 << index)
+                for timer in slot.values():
+                    self._place(timer)
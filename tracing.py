@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Annotated, BinaryIO
+
+import numpy as np
+
+
+class TraceKind(IntEnum):
+    SEND = 0  # A message is sent by the network.
+    POP = 1  # An event is removed from the event queue.
+    DELIVER = 2  # A message is delivered by a node's dispatcher.
+
+
+# The columns of a trace and their types.
+COLUMNS = {
+    "instant": np.float64,
+    "kind": np.uint8,
+    "src": np.int32,
+    "dst": np.int32,
+    "path": np.int32,  # The id of the message's path, see `paths.json`.
+    "size": np.int32,  # The size of the message's payload.
+}
+
+# Size of the header of the column files, large enough for any column length.
+_HEADER_SIZE = 128
+
+
+# The records of a trace, as rows of a structured array.
+_ROW = np.dtype(list(COLUMNS.items()))
+
+
+# Records the messages going through the network, the event queue and the dispatchers.
+# Records are buffered in a preallocated structured array and flushed, when it is full, to one .npy file per column
+# in the trace directory. The files are valid .npy files once the tracer is closed, and `load_trace` memory-maps them.
+@dataclass
+class Tracer:
+    directory: Annotated[str, 'trace_directory']
+    capacity: int = 1 << 16  # The number of records buffered before flushing.
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._records = np.empty(self.capacity, dtype=_ROW)
+        self._count = 0
+        self._length = 0  # The number of records flushed.
+        self._files: dict[str, BinaryIO] = {}
+        for (column, dtype) in COLUMNS.items():
+            f = self._files[column] = open(os.path.join(self.directory, f"{column}.npy"), "wb")
+            _write_header(f, dtype, 0)
+        # The instant of the last popped event, at which the following deliveries happen.
+        self.now = 0.0
+
+    def record(self, kind: TraceKind, instant: float, src: int, dst: int, path_id: int, size: int):
+        if self._count == self.capacity:
+            self.flush()
+        self._records[self._count] = (instant, kind, src, dst, path_id, size)
+        self._count += 1
+
+    # Records the same message to several destinations.
+    def record_many(self, kind: TraceKind, instant: float, src: int, dsts: list[int], path_id: int, size: int):
+        for start in range(0, len(dsts), self.capacity):
+            chunk = dsts[start:start + self.capacity]
+            if self._count + len(chunk) > self.capacity:
+                self.flush()
+            rows = self._records[self._count:self._count + len(chunk)]
+            (rows['instant'], rows['kind'], rows['src'], rows['dst']) = (instant, kind, src, chunk)
+            (rows['path'], rows['size']) = (path_id, size)
+            self._count += len(chunk)
+
+    # Writes the buffered records to the column files.
+    def flush(self):
+        if not self._count:
+            return
+        records = self._records[:self._count]
+        for column in COLUMNS:
+            np.ascontiguousarray(records[column]).tofile(self._files[column])
+        self._length += self._count
+        self._count = 0
+
+    # Flushes the buffered records, finalizes the column files and writes the table of paths.
+    def close(self):
+        from core import Path
+
+        self.flush()
+        for (column, dtype) in COLUMNS.items():
+            f = self._files[column]
+            f.seek(0)
+            _write_header(f, dtype, self._length)
+            f.close()
+        with open(os.path.join(self.directory, "paths.json"), "w") as f:
+            json.dump({path.id: str(path) for path in Path._paths_by_id}, f)
+
+
+def _write_header(f: BinaryIO, dtype: type, length: int):
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (length,)}
+    np.lib.format.write_array_header_1_0(f, header)
+    assert f.tell() == _HEADER_SIZE, "Unexpected .npy header size"
+
+
+# A trace loaded from a directory, with one array per column.
+@dataclass(eq=False)
+class Trace:
+    instant: np.ndarray
+    kind: np.ndarray
+    src: np.ndarray
+    dst: np.ndarray
+    path: np.ndarray
+    size: np.ndarray
+    paths: dict[int, str]  # The paths, by id.
+
+    def __len__(self) -> int:
+        return len(self.instant)
+
+
+# Memory-maps a trace written by a Tracer.
+def load_trace(directory: str) -> Trace:
+    with open(os.path.join(directory, "paths.json")) as f:
+        paths = {int(path_id): path for (path_id, path) in json.load(f).items()}
+    return Trace(**{column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode='r') for column in COLUMNS},
+                 paths=paths)
+
+
+# Prints a summary of a trace: the number of records of each kind, for each path.
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", type=str, help="trace directory")
+    args = parser.parse_args()
+
+    trace = load_trace(args.directory)
+    print(f"{len(trace)} records from {trace.instant.min(initial=0)} to {trace.instant.max(initial=0)} ms")
+    for path_id in np.unique(trace.path).tolist():
+        counts = np.bincount(trace.kind[trace.path == path_id], minlength=len(TraceKind))
+        print(trace.paths[path_id], ", ".join(f"{kind.name.lower()}: {counts[kind]}" for kind in TraceKind))
+
+
+if __name__ == "__main__":
+    main()